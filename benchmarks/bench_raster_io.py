@@ -0,0 +1,256 @@
+"""Raster I/O benchmarks on synthetic GeoTIFFs.
+
+Generates images across sizes, band counts, data types, layouts (tiled vs. scanline) and
+compressions, measures the throughput and the peak memory (RSS, in a separate run) of the
+RasterData readers and writers and writes the results to JSON, so runs of different commits
+can be compared:
+
+    python benchmarks/bench_raster_io.py --out before.json
+    python benchmarks/bench_raster_io.py --out after.json --compare before.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from osgeo import gdal, gdal_array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from geodata.rasterdata import RasterData  # noqa: E402
+from geodata.raster_iterator import RasterPaddingIterator  # noqa: E402
+
+DATA_TYPES = {"uint8": gdal.GDT_Byte, "uint16": gdal.GDT_UInt16, "float32": gdal.GDT_Float32}
+LAYOUTS = ("tiled", "scanline")
+COMPRESSIONS = ("NONE", "DEFLATE")
+
+
+def create_synthetic_image(path: str, size: int, bands: int, data_type: str, layout: str, compression: str):
+    """Creates a square GeoTIFF with smooth data plus noise, so compression behaves like real images."""
+    options = ["COMPRESS=" + compression]
+    if layout == "tiled":
+        options += ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256"]
+    dataset = gdal.GetDriverByName("GTiff").Create(path, size, size, bands, DATA_TYPES[data_type], options=options)
+    dataset.SetGeoTransform((0, 1, 0, size, 0, -1))
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(DATA_TYPES[data_type])
+    rng = np.random.default_rng(0)
+    cols = np.arange(size)
+    strip_height = 256
+    for y0 in range(0, size, strip_height):
+        rows = np.arange(y0, min(y0 + strip_height, size))[:, np.newaxis]
+        for band in range(bands):
+            smooth = 100 + 60 * np.sin(rows / 50 + band) * np.cos(cols / 70)
+            data = smooth + rng.normal(0, 5, smooth.shape)
+            dataset.GetRasterBand(band + 1).WriteArray(data.astype(dtype), 0, y0)
+    dataset.FlushCache()
+    del dataset
+
+
+def _reset_gdal_cache():
+    # O cache do gdal é esvaziado para medir a decodificação, não a memória.
+    gdal.SetCacheMax(0)
+    gdal.SetCacheMax(64 * 1024 ** 2)
+
+
+def _peak_rss_bytes() -> int:
+    """Peak resident memory of this process, ru_maxrss is in KiB on Linux and in bytes on macOS."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_memory(function) -> int:
+    """Peak RSS growth of one run of function.
+    ru_maxrss never decreases, so the run happens in a forked process that starts with its own peak.
+    """
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+
+    def child():
+        _reset_gdal_cache()
+        baseline = _peak_rss_bytes()
+        function()
+        sender.send(_peak_rss_bytes() - baseline)
+
+    process = context.Process(target=child)
+    process.start()
+    sender.close()
+    try:
+        peak = receiver.recv()
+    except EOFError:
+        raise RuntimeError("The memory measurement process failed.")
+    finally:
+        process.join()
+    return peak
+
+
+def measure(function, repeat: int) -> dict:
+    """Runs function (which returns bytes and blocks processed) and keeps the best time.
+    The memory is measured in a separate run, so it doesn't slow down the timed runs.
+    """
+    best = None
+    for _ in range(repeat):
+        _reset_gdal_cache()
+        start = time.perf_counter()
+        n_bytes, n_blocks = function()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best["seconds"]:
+            best = {"seconds": seconds, "bytes": n_bytes, "blocks": n_blocks}
+    best["mb_per_s"] = best["bytes"] / 1024 ** 2 / best["seconds"] if best["seconds"] else None
+    best["blocks_per_s"] = best["blocks"] / best["seconds"] if best["seconds"] else None
+    best["peak_rss_bytes"] = measure_memory(function)
+    return best
+
+
+def benchmark_cases(path: str, workdir: str, max_blocks: int, padding: int):
+    """The benchmarked operations, each returns (bytes, blocks)."""
+
+    def get_iterator():
+        raster = RasterData(path)
+        n_bytes = n_blocks = 0
+        for block in itertools.islice(raster.get_iterator(), max_blocks):
+            n_bytes += block.nbytes
+            n_blocks += 1
+        return n_bytes, n_blocks
+
+    def get_rgb_iterator():
+        raster = RasterData(path)
+        n_bytes = n_blocks = 0
+        for block in itertools.islice(raster.get_rgb_iterator(), max_blocks):
+            n_bytes += block.nbytes
+            n_blocks += 1
+        return n_bytes, n_blocks
+
+    def read_block_by_coordinates():
+        raster = RasterData(path)
+        rng = np.random.default_rng(0)
+        window = min(256, raster.rows, raster.cols)
+        n_bytes = 0
+        for _ in range(max_blocks):
+            y0 = int(rng.integers(0, raster.rows - window + 1))
+            x0 = int(rng.integers(0, raster.cols - window + 1))
+            n_bytes += raster.read_block_by_coordinates(y0, y0 + window, x0, x0 + window).nbytes
+        return n_bytes, max_blocks
+
+    def padding_iterator(halo_reuse: bool):
+        def run():
+            raster = RasterData(path)
+            n_bytes = n_blocks = 0
+            iterator = RasterPaddingIterator(raster, padding, halo_reuse=halo_reuse)
+            for block in itertools.islice(iterator, max_blocks):
+                n_bytes += block.data.nbytes
+                n_blocks += 1
+            return n_bytes, n_blocks
+        return run
+
+    def clone_empty():
+        raster = RasterData(path)
+        clone = raster.clone_empty(os.path.join(workdir, "clone.tif"), data_type=raster.gdal_dataset.GetRasterBand(
+            1).DataType)
+        del clone
+        return 0, 1
+
+    def write_block():
+        raster = RasterData(path)
+        clone = raster.clone_empty(os.path.join(workdir, "written.tif"), bandas=1,
+                                   data_type=raster.gdal_dataset.GetRasterBand(1).DataType)
+        n_bytes = n_blocks = 0
+        for index, block in enumerate(itertools.islice(raster.get_iterator(), max_blocks)):
+            clone.write_block(block, index)
+            n_bytes += block.nbytes
+            n_blocks += 1
+        return n_bytes, n_blocks
+
+    cases = {"get_iterator": get_iterator,
+             "read_block_by_coordinates": read_block_by_coordinates,
+             "RasterPaddingIterator": padding_iterator(False),
+             "RasterPaddingIterator[halo_reuse]": padding_iterator(True),
+             "clone_empty": clone_empty,
+             "write_block": write_block}
+    if RasterData(path).n_channels >= 3:
+        cases["get_rgb_iterator"] = get_rgb_iterator
+    return cases
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run(args) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for size, bands, data_type, layout, compression in itertools.product(
+                args.sizes, args.bands, args.data_types, args.layouts, args.compressions):
+            image = {"size": size, "bands": bands, "data_type": data_type, "layout": layout,
+                     "compression": compression}
+            path = os.path.join(workdir, "synthetic.tif")
+            create_synthetic_image(path, **image)
+            image["file_bytes"] = os.path.getsize(path)
+            for name, function in benchmark_cases(path, workdir, args.max_blocks, args.padding).items():
+                if args.only and name not in args.only:
+                    continue
+                result = dict(image, case=name, **measure(function, args.repeat))
+                results.append(result)
+                print("{case:36s} {size:6d}px {bands}b {data_type:8s} {layout:8s} {compression:8s} "
+                      "{mb_per_s:10.1f} MB/s {blocks_per_s:10.1f} blocks/s".format(
+                          **dict(result, mb_per_s=result["mb_per_s"] or 0,
+                                 blocks_per_s=result["blocks_per_s"] or 0)))
+            os.remove(path)
+    return {"meta": {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "python": platform.python_version(), "gdal": gdal.__version__, "numpy": np.__version__,
+                     "max_blocks": args.max_blocks, "padding": args.padding, "repeat": args.repeat},
+            "results": results}
+
+
+def result_key(result: dict) -> tuple:
+    return tuple(result[key] for key in ("case", "size", "bands", "data_type", "layout", "compression"))
+
+
+def compare(current: dict, previous: dict) -> None:
+    """Prints the time ratio (current / previous) of the matching results."""
+    previous_results = {result_key(result): result for result in previous["results"]}
+    print("\nComparison with {} (time ratio, < 1 is faster):".format(previous["meta"].get("commit", "")[:10]))
+    for result in current["results"]:
+        old = previous_results.get(result_key(result))
+        if old and old["seconds"]:
+            print("{:36s} {:>40s} {:6.2f}".format(result["case"], " ".join(map(str, result_key(result)[1:])),
+                                                  result["seconds"] / old["seconds"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_results.json", help="Output JSON file.")
+    parser.add_argument("--compare", help="Previous results JSON to compare with.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 4096])
+    parser.add_argument("--bands", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--data-types", nargs="+", default=["uint8", "float32"], choices=sorted(DATA_TYPES))
+    parser.add_argument("--layouts", nargs="+", default=list(LAYOUTS), choices=LAYOUTS)
+    parser.add_argument("--compressions", nargs="+", default=list(COMPRESSIONS))
+    parser.add_argument("--max-blocks", type=int, default=500, help="Maximum blocks read by each case.")
+    parser.add_argument("--padding", type=int, default=16, help="RasterPaddingIterator padding.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the best time is kept.")
+    parser.add_argument("--only", nargs="+", help="Run only these cases.")
+    parser.add_argument("--workdir", default=None, help="Directory for the synthetic images.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    with open(args.out, "w") as out_file:
+        json.dump(report, out_file, indent=2)
+    if args.compare:
+        with open(args.compare) as previous_file:
+            compare(report, json.load(previous_file))
+
+
+if __name__ == "__main__":
+    main()
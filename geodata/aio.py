@@ -0,0 +1,108 @@
+"""Asyncio support: blocking GDAL/OGR calls run in a bounded thread pool.
+
+GDAL datasets can't be used by two threads at the same time, so every dataset has a
+set of handles (AsyncHandles) and at most one call uses each handle. Requests waiting
+for a handle wait on the event loop, not on the executor threads, the thread level
+semaphore only guards the handles of calls still running after their task was cancelled
+and of requests from other event loops.
+"""
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+#: Default number of threads of the shared executor.
+DEFAULT_MAX_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """The executor shared by the async API, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="geodata-aio")
+        return _executor
+
+
+def set_max_workers(max_workers: int) -> None:
+    """Replaces the shared executor by one with max_workers threads."""
+    global _executor
+    with _executor_lock:
+        old_executor = _executor
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geodata-aio")
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+async def run_in_executor(function: Callable, *args) -> Any:
+    """Runs a blocking function in the shared executor."""
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), function, *args)
+
+
+class AsyncHandles:
+    def __init__(self, first_handle, opener: Callable = None, max_handles: int = 1):
+        """Handles of a single dataset for concurrent async requests.
+
+        :param first_handle: The dataset already open.
+        :param opener: Function that opens another handle of the same dataset, required if max_handles > 1.
+        :param max_handles: Maximum number of concurrent requests (and open handles).
+        """
+        if max_handles > 1 and opener is None:
+            raise ValueError("An opener is required for more than one handle.")
+        self.opener = opener
+        self.max_handles = max_handles
+        self._free = [first_handle]
+        self._n_handles = 1
+        self._lock = threading.Lock()
+        # Limite global de handles, o semáforo do event loop é liberado se a task for cancelada
+        # enquanto a chamada ainda roda no executor.
+        self._handles_semaphore = threading.BoundedSemaphore(max_handles)
+        # Semáforos por event loop, loops encerrados (ex.: asyncio.run) são descartados.
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Semáforos pertencem a um event loop.
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_handles)
+        return semaphore
+
+    def _acquire(self):
+        """A free handle, opened if needed. Must be called holding the handles semaphore."""
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            if self.opener is None or self._n_handles >= self.max_handles:
+                raise RuntimeError("No free dataset handle.")
+            self._n_handles += 1
+        try:
+            return self.opener()
+        except BaseException:
+            with self._lock:
+                self._n_handles -= 1
+            raise
+
+    def _release(self, handle) -> None:
+        with self._lock:
+            self._free.append(handle)
+
+    async def run(self, function: Callable, *args) -> Any:
+        """Runs function(handle, *args) in the executor with a handle no other request is using."""
+        async with self._semaphore():
+            def call():
+                self._handles_semaphore.acquire()
+                try:
+                    handle = self._acquire()
+                    try:
+                        return function(handle, *args)
+                    finally:
+                        self._release(handle)
+                finally:
+                    self._handles_semaphore.release()
+            return await run_in_executor(call)
@@ -0,0 +1,224 @@
+"""Focal (moving window) operations computed block by block on padded blocks.
+
+Every kernel receives a padded 2D array and returns only the valid part, the input
+shape minus the padding on each side. apply_focal reads the raster with a
+RasterPaddingIterator using exactly the padding (halo) the kernel needs.
+"""
+import math
+from typing import Callable, Union
+
+import numpy as np
+
+from geodata.instrumentation import count, gdal_call, timed
+from geodata.rasterdata import RasterData
+from geodata.raster_iterator import RasterPaddingIterator
+from geodata.raster_utils import PAD_EDGE, PAD_SYMMETRIC
+
+
+def focal_sum(data: np.ndarray, radius: int) -> np.ndarray:
+    """Sum of the (2 * radius + 1) square window, using an integral image."""
+    size = 2 * radius + 1
+    integral = np.zeros((data.shape[0] + 1, data.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(data, axis=0, dtype=np.float64), axis=1, out=integral[1:, 1:])
+    return (integral[size:, size:] - integral[:-size, size:] -
+            integral[size:, :-size] + integral[:-size, :-size])
+
+
+def focal_mean(data: np.ndarray, radius: int) -> np.ndarray:
+    """Mean of the (2 * radius + 1) square window."""
+    return focal_sum(data, radius) / (2 * radius + 1) ** 2
+
+
+def gaussian_radius(sigma: float, truncate: float = 3.0) -> int:
+    """Radius (padding) of a gaussian kernel truncated at truncate sigmas."""
+    return int(math.ceil(truncate * sigma))
+
+
+def gaussian_kernel(sigma: float, radius: int) -> np.ndarray:
+    """Normalized 1D gaussian kernel with 2 * radius + 1 weights."""
+    positions = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = np.exp(-0.5 * (positions / sigma) ** 2)
+    return kernel / kernel.sum()
+
+
+def _correlate_valid(data: np.ndarray, kernel: np.ndarray, axis: int) -> np.ndarray:
+    """1D correlation along an axis, keeping only the positions where the kernel fits."""
+    size = len(kernel)
+    length = data.shape[axis] - size + 1
+    out = np.zeros(data.shape[:axis] + (length,) + data.shape[axis + 1:], dtype=np.float64)
+    for position, weight in enumerate(kernel):
+        out += weight * np.take(data, np.arange(position, position + length), axis=axis)
+    return out
+
+
+def focal_gaussian(data: np.ndarray, sigma: float, radius: int = None) -> np.ndarray:
+    """Separable gaussian filter, the padding must be gaussian_radius(sigma) or the given radius."""
+    if radius is None:
+        radius = gaussian_radius(sigma)
+    kernel = gaussian_kernel(sigma, radius)
+    return _correlate_valid(_correlate_valid(data, kernel, 0), kernel, 1)
+
+
+def _running_extreme(data: np.ndarray, size: int, axis: int, function: np.ufunc) -> np.ndarray:
+    """van Herk/Gil-Werman running min or max along an axis, 3 comparisons per pixel for any size."""
+    data = np.moveaxis(data, axis, -1)
+    length = data.shape[-1]
+    n_out = length - size + 1
+    n_chunks = -(-length // size)
+    # Completa com o elemento neutro para dividir em pedaços do tamanho da janela.
+    if data.dtype == np.bool_:
+        neutral = function is np.minimum
+    elif np.issubdtype(data.dtype, np.floating):
+        neutral = np.inf if function is np.minimum else -np.inf
+    else:
+        info = np.iinfo(data.dtype)
+        neutral = info.max if function is np.minimum else info.min
+    padded = np.full(data.shape[:-1] + (n_chunks * size,), neutral, dtype=data.dtype)
+    padded[..., :length] = data
+    chunks = padded.reshape(data.shape[:-1] + (n_chunks, size))
+    prefix = function.accumulate(chunks, axis=-1).reshape(padded.shape)
+    suffix = function.accumulate(chunks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    out = function(suffix[..., :n_out], prefix[..., size - 1:size - 1 + n_out])
+    return np.moveaxis(out, -1, axis)
+
+
+def focal_min(data: np.ndarray, radius: int) -> np.ndarray:
+    """Minimum of the (2 * radius + 1) square window (van Herk/Gil-Werman)."""
+    size = 2 * radius + 1
+    return _running_extreme(_running_extreme(data, size, 0, np.minimum), size, 1, np.minimum)
+
+
+def focal_max(data: np.ndarray, radius: int) -> np.ndarray:
+    """Maximum of the (2 * radius + 1) square window (van Herk/Gil-Werman)."""
+    size = 2 * radius + 1
+    return _running_extreme(_running_extreme(data, size, 0, np.maximum), size, 1, np.maximum)
+
+
+def focal_median(data: np.ndarray, radius: int, max_memory: int = 64 * 1024 ** 2) -> np.ndarray:
+    """Median of the (2 * radius + 1) square window.
+    Computed on groups of rows so the window views take at most max_memory bytes.
+    """
+    size = 2 * radius + 1
+    windows = np.lib.stride_tricks.sliding_window_view(data, (size, size))
+    out = np.empty(windows.shape[:2], dtype=np.float64)
+    row_bytes = max(windows.shape[1] * size * size * np.dtype(np.float64).itemsize, 1)
+    step = max(max_memory // row_bytes, 1)
+    for row in range(0, out.shape[0], step):
+        group = windows[row:row + step].reshape(windows[row:row + step].shape[:2] + (-1,))
+        out[row:row + step] = np.median(group, axis=-1)
+    return out
+
+
+def _horn_gradients(data: np.ndarray, pixel_size: float):
+    """dz/dx and dz/dy of a DEM (Horn), the padding must be 1. y grows to the north."""
+    data = np.asarray(data, dtype=np.float64)
+    a, b, c = data[:-2, :-2], data[:-2, 1:-1], data[:-2, 2:]
+    d, f = data[1:-1, :-2], data[1:-1, 2:]
+    g, h, i = data[2:, :-2], data[2:, 1:-1], data[2:, 2:]
+    dz_dx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * pixel_size)
+    dz_dy = ((a + 2 * b + c) - (g + 2 * h + i)) / (8 * pixel_size)
+    return dz_dx, dz_dy
+
+
+def slope(data: np.ndarray, pixel_size: float = 1.0) -> np.ndarray:
+    """Slope in degrees of a DEM, padding 1."""
+    dz_dx, dz_dy = _horn_gradients(data, pixel_size)
+    return np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+
+
+def hillshade(data: np.ndarray, pixel_size: float = 1.0, azimuth: float = 315.0,
+              altitude: float = 45.0) -> np.ndarray:
+    """Hillshade (0 - 255) of a DEM, padding 1.
+
+    :param azimuth: Sun azimuth in degrees, clockwise from north.
+    :param altitude: Sun altitude in degrees above the horizon.
+    """
+    dz_dx, dz_dy = _horn_gradients(data, pixel_size)
+    slope_radians = np.arctan(np.hypot(dz_dx, dz_dy))
+    aspect = np.arctan2(-dz_dx, -dz_dy)
+    zenith = np.radians(90.0 - altitude)
+    azimuth = np.radians(azimuth)
+    shade = (np.cos(zenith) * np.cos(slope_radians) +
+             np.sin(zenith) * np.sin(slope_radians) * np.cos(azimuth - aspect))
+    return 255.0 * np.clip(shade, 0, 1)
+
+
+def sobel(data: np.ndarray) -> np.ndarray:
+    """Sobel gradient magnitude, padding 1."""
+    dz_dx, dz_dy = _horn_gradients(data, 1.0)
+    # Horn usa os mesmos pesos do Sobel, normalizados por 8.
+    return 8 * np.hypot(dz_dx, dz_dy)
+
+
+def apply_focal(raster_data: RasterData, function: Callable, radius: int, out: RasterData = None,
+                band: int = 1, out_band: int = 1, border_mode: str = PAD_SYMMETRIC,
+                constant_value=0) -> Union[np.ndarray, None]:
+    """Applies a focal kernel to a raster band, block by block.
+
+    The raster is read with a RasterPaddingIterator (halo_reuse), padded by radius, so each
+    native block of the band is read once (only that band) and every kernel sees exactly the
+    neighbourhood it needs.
+
+    :param raster_data: Source raster.
+    :param function: Kernel, receives a padded 2D block and returns its valid part
+        (e.g. functools.partial(focal_gaussian, sigma=2) with radius=gaussian_radius(2)).
+    :param radius: Padding the kernel needs.
+    :param out: Output raster with the same shape, if not given returns a float64 array.
+    :param band: Source band.
+    :param out_band: Output band.
+    :param border_mode: Padding outside the image, one of the raster_utils PAD_* modes.
+    :param constant_value: Fill value for PAD_CONSTANT.
+    """
+    iterator = RasterPaddingIterator(raster_data, radius, halo_reuse=True, border_mode=border_mode,
+                                     constant_value=constant_value, reuse_buffer=True, bands=[band])
+    if out is None:
+        result = np.empty(raster_data.shape, dtype=np.float64)
+    else:
+        if out.shape != raster_data.shape:
+            raise ValueError("The output raster must have the same shape of the source raster.")
+        out_gdal_band = out.gdal_dataset.GetRasterBand(out_band)
+
+    for block in iterator:
+        with timed("focal.kernel"):
+            block_result = function(block.data[:, :, 0])
+        valid = block.corta_matriz_por_regiao_valida(block_result)
+        y0, _, x0, _ = (int(item) for item in block.original_block_coordinates)
+        if out is None:
+            result[y0:y0 + valid.shape[0], x0:x0 + valid.shape[1]] = valid
+            continue
+        with timed("focal.write") as section:
+            with gdal_call():
+                out_gdal_band.WriteArray(valid, x0, y0)
+            section.n_bytes = valid.nbytes
+
+    if out is None:
+        return result
+    with gdal_call():
+        out.gdal_dataset.FlushCache()
+    count("raster.flush")
+    return None
+
+
+def focal_filter(raster_data: RasterData, operation: str, out: RasterData = None, radius: int = 1,
+                 sigma: float = 1.0, **kwargs) -> Union[np.ndarray, None]:
+    """Applies a named focal operation, with the padding it needs.
+
+    :param operation: sum, mean, min, max, median (square windows of 2 * radius + 1),
+        gaussian (sigma) or the DEM operations slope, hillshade and sobel (padding 1, edge border).
+    :param kwargs: Other apply_focal parameters.
+    """
+    if operation in ("sum", "mean", "min", "max", "median"):
+        kernel = {"sum": focal_sum, "mean": focal_mean, "min": focal_min,
+                  "max": focal_max, "median": focal_median}[operation]
+        return apply_focal(raster_data, lambda data: kernel(data, radius), radius, out, **kwargs)
+    if operation == "gaussian":
+        radius = gaussian_radius(sigma)
+        return apply_focal(raster_data, lambda data: focal_gaussian(data, sigma, radius), radius, out, **kwargs)
+    if operation in ("slope", "hillshade", "sobel"):
+        kwargs.setdefault("border_mode", PAD_EDGE)
+        if operation == "sobel":
+            return apply_focal(raster_data, sobel, 1, out, **kwargs)
+        kernel = slope if operation == "slope" else hillshade
+        pixel_size = raster_data.pixel_size
+        return apply_focal(raster_data, lambda data: kernel(data, pixel_size), 1, out, **kwargs)
+    raise ValueError("Unknown focal operation: {}.".format(operation))
@@ -3,6 +3,7 @@ from warnings import warn
 
 import numpy as np
 
+from geodata.instrumentation import gdal_call, instrumented
 from geodata.srs_utils import create_osr_srs
 
 try:
@@ -47,11 +48,19 @@ class BBox:
     def __str__(self):
         return f"BBox: {self.xmin}, {self.ymin}, {self.xmax}, {self.ymax}"
 
+    def __reduce__(self):
+        # Only the coordinates and the wkt, the geometry is rebuilt unless it was transformed.
+        args = (self.xmin, self.ymin, self.xmax, self.ymax, self._wkt_srs)
+        if self._geometry == ((self.xmin, self.ymax), (self.xmax, self.ymax), (self.xmax, self.ymin),
+                              (self.xmin, self.ymin)):
+            return BBox, args
+        return BBox, args, {"_geometry": self._geometry}
+
     def __iter__(self):
         """This magic method allows the BBox to be cast as a sequence."""
         return iter((self.xmin, self.ymin, self.xmax, self.ymax))
 
-    # def transform_srs(self, new_srs: Union[str, int, osr.SpatialReference]):
+    @instrumented("srs.transform")
     def transform_srs(self, new_srs: Union[str, int, osr.SpatialReference]):
         """Transform this BBox to a srs and returns a new BBox."""
 
@@ -66,8 +75,9 @@ class BBox:
             src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
 
         dst_srs = create_osr_srs(new_srs)
-        transform = osr.CoordinateTransformation(src_srs, dst_srs)
-        new_geom = transform.TransformPoints(self._geometry)
+        with gdal_call():
+            transform = osr.CoordinateTransformation(src_srs, dst_srs)
+            new_geom = transform.TransformPoints(self._geometry)
         # Get bbox from new geom:
         new_geom = np.asarray(new_geom)
         xcol = new_geom[:, 0]
@@ -134,3 +144,6 @@ class RasterDefinition:
         self.xmin = xmin
         self.cols = cols
         self.rows = rows
+
+    def __reduce__(self):
+        return RasterDefinition, (self.rows, self.cols, self.xmin, self.ymax, self.xres, self.yres, self.srs)
@@ -0,0 +1,101 @@
+"""Pool of read only GDAL dataset handles, one per thread and path, with a limit of open files."""
+import collections
+import threading
+
+from osgeo import gdal
+
+from geodata.instrumentation import count, gdal_call
+
+#: Default maximum number of handles kept open by a pool.
+DEFAULT_MAX_OPEN = 256
+
+
+class DatasetPool:
+    def __init__(self, max_open: int = DEFAULT_MAX_OPEN):
+        """Hands out read only dataset handles, a different handle for each thread.
+
+        GDAL datasets can't be used by two threads at the same time, so each thread gets its
+        own handle of a path. At most max_open handles are kept, the least recently used are
+        closed (once no one else references them) and reopened transparently when requested again.
+        The last handle handed to each live thread is in use (a band doesn't keep its dataset open)
+        and is never evicted, the handles of threads that exited are dropped first.
+
+        :param max_open: Maximum number of handles kept open.
+        """
+        self.max_open = max_open
+        self.hits = 0
+        self.misses = 0
+        self._handles = collections.OrderedDict()
+        #: Handle in use by each thread, the last one handed to it.
+        self._in_use = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def get(self, path: str) -> gdal.Dataset:
+        """The handle of path for the current thread, opened if needed."""
+        key = (path, threading.get_ident())
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                self._handles.move_to_end(key)
+                self._in_use[key[1]] = key
+                self.hits += 1
+                count("pool.hit")
+                return handle
+            self.misses += 1
+        count("pool.miss")
+
+        with gdal_call():
+            handle = gdal.Open(path, gdal.GA_ReadOnly)
+        if not handle:
+            raise IOError("Erro ao abrir o arquivo ou arquivo inexistente: " + path)
+        with self._lock:
+            self._handles[key] = handle
+            self._in_use[key[1]] = key
+            self._evict()
+        return handle
+
+    def _evict(self) -> None:
+        """Drops the handles of finished threads and then the least recently used ones not in use.
+        The datasets are only closed when no one else references them. Called with the lock held.
+        """
+        alive = {thread.ident for thread in threading.enumerate()}
+        for key in [key for key in self._handles if key[1] not in alive]:
+            del self._handles[key]
+            count("pool.evict")
+        for ident in [ident for ident in self._in_use if ident not in alive]:
+            del self._in_use[ident]
+        excess = len(self._handles) - self.max_open
+        if excess > 0:
+            in_use = set(self._in_use.values())
+            for key in [key for key in self._handles if key not in in_use][:excess]:
+                del self._handles[key]
+                count("pool.evict")
+
+    def close_path(self, path: str) -> None:
+        """Drops every handle of a path, e.g. after the file was rewritten."""
+        with self._lock:
+            for key in [key for key in self._handles if key[0] == path]:
+                del self._handles[key]
+            self._in_use = {ident: key for ident, key in self._in_use.items() if key[0] != path}
+
+    def clear(self) -> None:
+        """Drops every handle."""
+        with self._lock:
+            self._handles.clear()
+            self._in_use.clear()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> DatasetPool:
+    """The pool shared by the rasters opened with handle_pool=True, created on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = DatasetPool()
+        return _default_pool
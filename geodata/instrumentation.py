@@ -0,0 +1,188 @@
+"""Optional I/O instrumentation.
+
+Records the number of calls, bytes moved, total time and time spent inside GDAL/OGR calls
+of the instrumented operations, plus plain counters (cache hits, flushes). It is disabled
+unless a collector or a callback is active, and the disabled path is a single flag check.
+
+Example:
+
+    with collect() as stats:
+        run_pipeline()
+    print(stats.as_dict())
+
+Callbacks receive (event, calls, seconds, gdal_seconds, n_bytes) for every record, and can be
+used to feed a metrics exporter:
+
+    add_callback(lambda event, calls, seconds, gdal_seconds, n_bytes: histogram(event).observe(seconds))
+"""
+import functools
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import numpy as np
+
+_enabled = False
+_collectors = []
+_callbacks = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class IOStats:
+    def __init__(self):
+        """Accumulated statistics per event."""
+        self.calls = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.gdal_seconds = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, event: str, calls: int, seconds: float, gdal_seconds: float, n_bytes: int) -> None:
+        with self._lock:
+            self.calls[event] += calls
+            self.bytes[event] += n_bytes
+            self.seconds[event] += seconds
+            self.gdal_seconds[event] += gdal_seconds
+
+    def as_dict(self) -> dict:
+        """Statistics by event, python_seconds is the time spent outside GDAL."""
+        with self._lock:
+            return {event: {"calls": self.calls[event],
+                            "bytes": self.bytes[event],
+                            "seconds": self.seconds[event],
+                            "gdal_seconds": self.gdal_seconds[event],
+                            "python_seconds": self.seconds[event] - self.gdal_seconds[event]}
+                    for event in self.calls}
+
+    def __str__(self):
+        lines = ["{:32s} {:>8s} {:>12s} {:>10s} {:>10s}".format("event", "calls", "MB", "total s", "gdal s")]
+        for event, stats in sorted(self.as_dict().items()):
+            lines.append("{:32s} {:8d} {:12.2f} {:10.3f} {:10.3f}".format(
+                event, stats["calls"], stats["bytes"] / 1024 ** 2, stats["seconds"], stats["gdal_seconds"]))
+        return "\n".join(lines)
+
+
+def _update_enabled():
+    global _enabled
+    _enabled = bool(_collectors or _callbacks)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def add_callback(callback: Callable) -> None:
+    """Adds a callback(event, calls, seconds, gdal_seconds, n_bytes), enabling the instrumentation."""
+    with _lock:
+        _callbacks.append(callback)
+        _update_enabled()
+
+
+def remove_callback(callback: Callable) -> None:
+    with _lock:
+        _callbacks.remove(callback)
+        _update_enabled()
+
+
+@contextmanager
+def collect() -> Iterator[IOStats]:
+    """Collects the statistics of everything that runs inside the context, in any thread."""
+    stats = IOStats()
+    with _lock:
+        _collectors.append(stats)
+        _update_enabled()
+    try:
+        yield stats
+    finally:
+        with _lock:
+            _collectors.remove(stats)
+            _update_enabled()
+
+
+def record(event: str, calls: int = 1, seconds: float = 0.0, gdal_seconds: float = 0.0, n_bytes: int = 0) -> None:
+    """Records an event in the active collectors and callbacks."""
+    for stats in list(_collectors):
+        stats.add(event, calls, seconds, gdal_seconds, n_bytes)
+    for callback in list(_callbacks):
+        callback(event, calls, seconds, gdal_seconds, n_bytes)
+
+
+def count(event: str, calls: int = 1) -> None:
+    """Counts an event without timing (e.g. cache hits, flushes)."""
+    if _enabled:
+        record(event, calls)
+
+
+class _Section:
+    __slots__ = ("event", "gdal", "n_bytes", "gdal_seconds", "_start")
+
+    def __init__(self, event: str = None, gdal: bool = False):
+        """A timed section. GDAL sections add their time to the enclosing section gdal time."""
+        self.event = event
+        self.gdal = gdal
+        self.n_bytes = 0
+        self.gdal_seconds = 0.0
+
+    def __enter__(self) -> "_Section":
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        seconds = time.perf_counter() - self._start
+        stack = _local.stack
+        stack.pop()
+        gdal_seconds = seconds if self.gdal else self.gdal_seconds
+        if stack:
+            stack[-1].gdal_seconds += gdal_seconds
+        if self.event is not None:
+            record(self.event, 1, seconds, gdal_seconds, self.n_bytes)
+
+
+class _NullSection:
+    __slots__ = ("n_bytes",)
+
+    def __enter__(self) -> "_NullSection":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+_NULL_SECTION = _NullSection()
+
+
+def timed(event: str, gdal: bool = False):
+    """Context manager that times a section as an event, set n_bytes on it to record the bytes moved.
+    With gdal=True the whole section is accounted as GDAL time.
+    """
+    return _Section(event, gdal) if _enabled else _NULL_SECTION
+
+
+def gdal_call():
+    """Context manager around GDAL/OGR calls, its time is added to the enclosing event GDAL time."""
+    return _Section(None, True) if _enabled else _NULL_SECTION
+
+
+def instrumented(event: str) -> Callable:
+    """Decorator that times every call of a function as an event.
+    The bytes of numpy array results are recorded.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Section(event) as section:
+                result = function(*args, **kwargs)
+                if isinstance(result, np.ndarray):
+                    section.n_bytes = result.nbytes
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,209 @@
+"""Lazy, chunked array view on a RasterData."""
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+from osgeo import gdal_array
+
+from geodata.geo_objects import BBox
+from geodata.instrumentation import gdal_call, timed
+
+
+def _reduce_identity(reduction: str, dtype: np.dtype):
+    """Value that doesn't change the result of combining chunks with min or max."""
+    if reduction == "min":
+        return np.inf if dtype.kind == "f" else np.iinfo(dtype).max
+    return -np.inf if dtype.kind == "f" else np.iinfo(dtype).min
+
+
+def _block_groups(indices: np.ndarray, block_size: int) -> list:
+    """Slices of the ascending indices that fall in the same native block, a single slice when contiguous."""
+    if indices[-1] - indices[0] + 1 == len(indices):
+        return [slice(0, len(indices))]
+    bounds = np.flatnonzero(np.diff(indices // block_size)) + 1
+    starts, ends = np.concatenate(([0], bounds)), np.concatenate((bounds, [len(indices)]))
+    return [slice(int(start), int(end)) for start, end in zip(starts, ends)]
+
+
+class LazyRasterArray:
+    def __init__(self, raster_data):
+        """Array like, read only view of a raster with shape (rows, cols, channels).
+
+        Nothing is read until the array is indexed, converted with np.asarray or reduced.
+        Reductions are computed chunk by chunk, on the raster native blocks, so the
+        raster is never loaded entirely in memory (only the result).
+
+        :param raster_data: The RasterData.
+        """
+        self.raster_data = raster_data
+        data_type = raster_data.gdal_dataset.GetRasterBand(1).DataType
+        self.dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(data_type))
+        self.shape = (raster_data.rows, raster_data.cols, raster_data.n_channels)
+
+    def __repr__(self):
+        return "LazyRasterArray(shape={}, dtype={}, chunks={})".format(self.shape, self.dtype, self.chunks)
+
+    @property
+    def ndim(self) -> int:
+        return 3
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    @property
+    def chunks(self) -> Tuple[int, int, int]:
+        """Chunk shape, the native block (rows, cols, channels)."""
+        block_x, block_y = self.raster_data.block_size
+        return block_y, block_x, self.shape[2]
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _read(self, y0: int, y1: int, x0: int, x1: int, channels: np.ndarray) -> np.ndarray:
+        out = np.empty((y1 - y0, x1 - x0, len(channels)), dtype=self.dtype)
+        if out.size == 0:
+            return out
+        with timed("raster.lazy_read") as section:
+            for position, channel in enumerate(channels):
+                band = self.raster_data.gdal_dataset.GetRasterBand(int(channel) + 1)
+                with gdal_call():
+                    out[:, :, position] = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
+            section.n_bytes = out.nbytes
+        return out
+
+    def _read_indices(self, rows: np.ndarray, cols: np.ndarray, channels: np.ndarray) -> np.ndarray:
+        """Reads the pixels at the ascending rows and cols indices. Contiguous indices are read as a
+        single window, strided ones block by block: only the native blocks with selected pixels are
+        read, each one limited to the span of its selected rows and columns.
+        """
+        block_x, block_y = self.raster_data.block_size
+        col_groups = _block_groups(cols, block_x)
+        out = None
+        for row_group in _block_groups(rows, block_y):
+            block_rows = rows[row_group]
+            y0, y1 = int(block_rows[0]), int(block_rows[-1]) + 1
+            for col_group in col_groups:
+                block_cols = cols[col_group]
+                x0, x1 = int(block_cols[0]), int(block_cols[-1]) + 1
+                data = self._read(y0, y1, x0, x1, channels)
+                if len(block_rows) != y1 - y0:
+                    data = data[block_rows - y0]
+                if len(block_cols) != x1 - x0:
+                    data = data[:, block_cols - x0]
+                if out is None and len(block_rows) == len(rows) and len(block_cols) == len(cols):
+                    return data
+                if out is None:
+                    out = np.empty((len(rows), len(cols), len(channels)), dtype=self.dtype)
+                out[row_group, col_group] = data
+        return out
+
+    def _bbox_slices(self, bbox: BBox) -> Tuple[slice, slice]:
+        x0, y0, width, height = self.raster_data.get_bboxes_windows([bbox])[0]
+        rows, cols = self.shape[:2]
+        return (slice(int(np.clip(y0, 0, rows)), int(np.clip(y0 + height, 0, rows))),
+                slice(int(np.clip(x0, 0, cols)), int(np.clip(x0 + width, 0, cols))))
+
+    def _normalize_key(self, key) -> tuple:
+        if isinstance(key, BBox):
+            return self._bbox_slices(key) + (slice(None),)
+        if not isinstance(key, tuple):
+            key = (key,)
+        if key and isinstance(key[0], BBox):
+            key = self._bbox_slices(key[0]) + key[1:]
+        if any(item is Ellipsis for item in key):
+            position = key.index(Ellipsis)
+            key = key[:position] + (slice(None),) * (3 - len(key) + 1) + key[position + 1:]
+        if len(key) > 3:
+            raise IndexError("Too many indices for a 3 dimensional array.")
+        return key + (slice(None),) * (3 - len(key))
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Reads the selected part of the raster. Accepts ints, slices (with steps) and a BBox
+        in the raster SRS in place of the row and column indices, e.g. lazy[bbox, :, 0].
+        """
+        key = self._normalize_key(key)
+        indices = []
+        squeeze = []
+        for axis, (item, size) in enumerate(zip(key, self.shape)):
+            if isinstance(item, (int, np.integer)):
+                if not -size <= item < size:
+                    raise IndexError("Index {} out of bounds for axis {} with size {}.".format(item, axis, size))
+                indices.append(np.array([item % size]))
+                squeeze.append(axis)
+            elif isinstance(item, slice):
+                indices.append(np.arange(*item.indices(size)))
+            else:
+                raise TypeError("Only integers, slices, Ellipsis and BBox are valid indices.")
+
+        rows, cols, channels = indices
+        if len(rows) == 0 or len(cols) == 0:
+            data = np.empty((len(rows), len(cols), len(channels)), dtype=self.dtype)
+        else:
+            # Passos negativos: lê em ordem crescente e inverte depois.
+            data = self._read_indices(np.sort(rows), np.sort(cols), channels)
+            if rows[0] > rows[-1]:
+                data = data[::-1]
+            if cols[0] > cols[-1]:
+                data = data[:, ::-1]
+        return data.squeeze(axis=tuple(squeeze)) if squeeze else data
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        data = self[:, :, :]
+        return data if dtype is None else data.astype(dtype, copy=False)
+
+    def iter_chunks(self) -> Iterator[Tuple[Tuple[slice, slice], np.ndarray]]:
+        """Iterates over the native blocks, yielding ((row slice, col slice), data)."""
+        channels = np.arange(self.shape[2])
+        for xoff, yoff, width, height in self.raster_data.block_list:
+            yield ((slice(yoff, yoff + height), slice(xoff, xoff + width)),
+                   self._read(yoff, yoff + height, xoff, xoff + width, channels))
+
+    def _reduce(self, reduction: str, axis: Union[int, Tuple[int, ...], None]) -> Union[np.ndarray, np.generic]:
+        if axis is None:
+            axis = (0, 1, 2)
+        elif not isinstance(axis, tuple):
+            axis = (axis,)
+        axis = tuple(sorted(item % 3 for item in axis))
+        kept = [item for item in range(3) if item not in axis]
+        result_shape = tuple(self.shape[item] for item in kept)
+
+        if reduction in ("sum", "mean"):
+            dtype = np.float64 if reduction == "mean" else np.sum(np.zeros(1, dtype=self.dtype)).dtype
+            result = np.zeros(result_shape, dtype=dtype)
+            combine = np.add
+            function = np.sum
+        else:
+            result = np.full(result_shape, _reduce_identity(reduction, self.dtype), dtype=self.dtype)
+            combine = np.minimum if reduction == "min" else np.maximum
+            function = np.min if reduction == "min" else np.max
+
+        for (rows, cols), data in self.iter_chunks():
+            chunk_result = function(data, axis=axis, dtype=result.dtype) if reduction in ("sum", "mean") \
+                else function(data, axis=axis)
+            # Posição do resultado do bloco no resultado final (apenas os eixos mantidos).
+            target = tuple((rows, cols, slice(None))[item] for item in kept)
+            result[target] = combine(result[target], chunk_result)
+
+        if reduction == "mean":
+            result /= np.prod([self.shape[item] for item in axis])
+        return result[()] if result.ndim == 0 else result
+
+    def sum(self, axis: Union[int, Tuple[int, ...]] = None):
+        """Sum computed block by block, e.g. sum(axis=(0, 1)) for the per channel sum."""
+        return self._reduce("sum", axis)
+
+    def mean(self, axis: Union[int, Tuple[int, ...]] = None):
+        """Mean computed block by block (in float64)."""
+        return self._reduce("mean", axis)
+
+    def min(self, axis: Union[int, Tuple[int, ...]] = None):
+        """Minimum computed block by block."""
+        return self._reduce("min", axis)
+
+    def max(self, axis: Union[int, Tuple[int, ...]] = None):
+        """Maximum computed block by block."""
+        return self._reduce("max", axis)
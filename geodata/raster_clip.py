@@ -0,0 +1,162 @@
+"""Streaming clip of a raster by vector geometries."""
+import math
+from typing import List, Union
+
+import numpy as np
+from osgeo import gdal, gdal_array, ogr, osr
+
+from geodata.instrumentation import count, gdal_call, timed
+from geodata.rasterdata import RasterData
+from geodata.vectordata import VectorData
+
+#: Tile size of the clip outputs.
+CLIP_BLOCK_SIZE = 256
+
+
+def _clip_geometries(raster_data: RasterData, vector: Union[VectorData, ogr.Geometry]) -> List[ogr.Geometry]:
+    """The geometries of the cutline, in the raster SRS."""
+    raster_srs = osr.SpatialReference(raster_data.wkt_srs)
+    if int(gdal.__version__.split('.')[0]) >= 3:
+        raster_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    if isinstance(vector, ogr.Geometry):
+        geometries = [vector.Clone()]
+    elif isinstance(vector, VectorData):
+        # A referência da geometria só é válida enquanto a feature existir, por isso o Clone aqui.
+        geometries = [feature.GetGeometryRef().Clone() for feature in vector.iter_features()
+                      if feature.GetGeometryRef() is not None]
+    else:
+        raise TypeError("The cutline must be a VectorData or an ogr.Geometry.")
+
+    clip_geometries = []
+    for geometry in geometries:
+        if geometry.IsEmpty():
+            continue
+        geometry_srs = geometry.GetSpatialReference()
+        if geometry_srs is not None and raster_data.wkt_srs and not geometry_srs.IsSame(raster_srs):
+            with gdal_call():
+                geometry.TransformTo(raster_srs)
+        clip_geometries.append(geometry)
+    if not clip_geometries:
+        raise ValueError("The cutline has no geometries.")
+    return clip_geometries
+
+
+def clip_raster(raster_data: RasterData, vector: Union[VectorData, ogr.Geometry], out: Union[str, RasterData],
+                crop: bool = True, all_touched: bool = False, nodata: float = None) -> RasterData:
+    """Clips a raster by a cutline, block by block. See RasterData.clip."""
+    geometries = _clip_geometries(raster_data, vector)
+    # Envelopes (minx, maxx, miny, maxy) para descartar blocos sem rasterizar.
+    envelopes = np.array([geometry.GetEnvelope() for geometry in geometries], dtype=np.float64)
+
+    # Janela de pixels que cobre o bbox das geometrias.
+    origin_x, origin_y = raster_data.origem
+    pixel_size = raster_data.pixel_size
+    col0 = max(int(math.floor((envelopes[:, 0].min() - origin_x) / pixel_size)), 0)
+    col1 = min(int(math.ceil((envelopes[:, 1].max() - origin_x) / pixel_size)), raster_data.cols)
+    row0 = max(int(math.floor((origin_y - envelopes[:, 3].max()) / pixel_size)), 0)
+    row1 = min(int(math.ceil((origin_y - envelopes[:, 2].min()) / pixel_size)), raster_data.rows)
+    if col1 <= col0 or row1 <= row0:
+        raise ValueError("The cutline doesn't intersect the raster.")
+    if not crop:
+        out_row0, out_col0, out_rows, out_cols = 0, 0, raster_data.rows, raster_data.cols
+    else:
+        out_row0, out_col0, out_rows, out_cols = row0, col0, row1 - row0, col1 - col0
+
+    source_band = raster_data.gdal_dataset.GetRasterBand(1)
+    if nodata is None:
+        nodata = source_band.GetNoDataValue()
+    if nodata is None:
+        nodata = 0
+    source_dtype = gdal_array.GDALTypeCodeToNumericTypeCode(source_band.DataType)
+
+    if isinstance(out, str):
+        geotiff_options = ["TILED=YES", "SPARSE_OK=TRUE",
+                           "BLOCKXSIZE=" + str(CLIP_BLOCK_SIZE), "BLOCKYSIZE=" + str(CLIP_BLOCK_SIZE)]
+        out_dataset = gdal.GetDriverByName("GTiff").Create(out, out_cols, out_rows, raster_data.n_channels,
+                                                           source_band.DataType, options=geotiff_options)
+        if out_dataset is None:
+            raise IOError("Can't create the file in this location: {}".format(out))
+        geo_transform = list(raster_data.gdal_dataset.GetGeoTransform())
+        geo_transform[0] += out_col0 * geo_transform[1]
+        geo_transform[3] += out_row0 * geo_transform[5]
+        out_dataset.SetGeoTransform(geo_transform)
+        out_dataset.SetProjection(raster_data.gdal_dataset.GetProjection())
+        for item in range(raster_data.n_channels):
+            out_dataset.GetRasterBand(item + 1).SetNoDataValue(nodata)
+        del out_dataset
+        out = RasterData(out, write_enabled=True)
+        created = True
+    elif out.shape != (out_rows, out_cols):
+        raise ValueError("The output raster must have the shape {}.".format((out_rows, out_cols)))
+    else:
+        created = False
+
+    # Camada em memória com as geometrias, o filtro espacial limita a rasterização a cada bloco.
+    memory_source = ogr.GetDriverByName("Memory").CreateDataSource("clip")
+    memory_layer = memory_source.CreateLayer("clip", osr.SpatialReference(raster_data.wkt_srs), ogr.wkbUnknown)
+    for geometry in geometries:
+        feature = ogr.Feature(memory_layer.GetLayerDefn())
+        feature.SetGeometry(geometry)
+        memory_layer.CreateFeature(feature)
+    rasterize_options = ["ALL_TOUCHED=TRUE"] if all_touched else []
+
+    out_bands = [out.gdal_dataset.GetRasterBand(item + 1) for item in range(out.n_channels)]
+    for xoff, yoff, width, height in out.block_list:
+        # Posição do bloco de saída na imagem de origem.
+        out_y0, out_x0 = yoff + out_row0, xoff + out_col0
+        window = (max(out_y0, row0), min(out_y0 + height, row1), max(out_x0, col0), min(out_x0 + width, col1))
+        data = _clip_window(raster_data, memory_layer, envelopes, rasterize_options, nodata, window)
+        y0, y1, x0, x1 = window
+        if data is None:
+            count("clip.skipped_block")
+            # Num arquivo novo o bloco fica sem alocar (lido como nodata), um out existente é preenchido.
+            if created:
+                continue
+            data = np.full((height, width, raster_data.n_channels), nodata, dtype=source_dtype)
+            y0, x0 = out_y0, out_x0
+        elif not created and (y1 - y0, x1 - x0) != (height, width):
+            block = np.full((height, width, data.shape[2]), nodata, dtype=data.dtype)
+            block[y0 - out_y0:y1 - out_y0, x0 - out_x0:x1 - out_x0] = data
+            data, y0, x0 = block, out_y0, out_x0
+        with timed("clip.write") as section:
+            with gdal_call():
+                for item, out_band in enumerate(out_bands):
+                    out_band.WriteArray(data[:, :, item], x0 - out_col0, y0 - out_row0)
+            section.n_bytes = data.nbytes
+    with gdal_call():
+        out.gdal_dataset.FlushCache()
+    count("raster.flush")
+    return out
+
+
+def _clip_window(raster_data: RasterData, memory_layer: ogr.Layer, envelopes: np.ndarray, rasterize_options: list,
+                 nodata: float, window: tuple) -> Union[np.ndarray, None]:
+    """Reads a window of the source with the pixels outside the cutline set to nodata.
+    Returns None if no pixel of the window is inside the cutline, rasterizing only when
+    some geometry envelope touches the window.
+    """
+    y0, y1, x0, x1 = window
+    if y1 <= y0 or x1 <= x0:
+        return None
+    origin_x, origin_y = raster_data.origem
+    pixel_size = raster_data.pixel_size
+    xmin, xmax = origin_x + x0 * pixel_size, origin_x + x1 * pixel_size
+    ymax, ymin = origin_y - y0 * pixel_size, origin_y - y1 * pixel_size
+    touches = ((envelopes[:, 0] <= xmax) & (envelopes[:, 1] >= xmin) &
+               (envelopes[:, 2] <= ymax) & (envelopes[:, 3] >= ymin))
+    if not touches.any():
+        return None
+
+    with timed("clip.rasterize", gdal=True):
+        mask_dataset = gdal.GetDriverByName("MEM").Create("", x1 - x0, y1 - y0, 1, gdal.GDT_Byte)
+        mask_dataset.SetGeoTransform((xmin, pixel_size, 0, ymax, 0, -pixel_size))
+        mask_dataset.SetProjection(raster_data.wkt_srs)
+        memory_layer.SetSpatialFilterRect(xmin, ymin, xmax, ymax)
+        gdal.RasterizeLayer(mask_dataset, [1], memory_layer, burn_values=[1], options=rasterize_options)
+        memory_layer.SetSpatialFilter(None)
+        mask = mask_dataset.ReadAsArray().astype(bool)
+    if not mask.any():
+        return None
+    data = raster_data.read_block_by_coordinates(y0, y1, x0, x1)
+    data[~mask] = nodata
+    return data
@@ -1,22 +1,29 @@
 # Pablo Carreira - 30/05/17
-import collections
+import collections.abc
+from typing import Iterable, Iterator, List, Sequence, Tuple
 
 import numpy as np
 
 from geodata import RasterData
-from geodata.raster_utils import mirror_block, MIRROR_TOP, MIRROR_BOTTOM, MIRROR_LEFT, MIRROR_RIGHT, ArraySampler, \
-    normalize_channel_range
+from geodata.instrumentation import count, gdal_call, timed
+from geodata.raster_utils import ArraySampler, normalize_channel_range, pad_block_into, PAD_SYMMETRIC
 
 
 class RasterBlock:
-    __slots__ = ("block_data", "valid_data_region", "original_block_coordinates", "block_index")
+    __slots__ = ("block_data", "valid_data_region", "original_block_coordinates", "block_index", "nodata")
 
-    def __init__(self, block_data, valid_data_region, original_block_coordinates, block_index):
+    def __init__(self, block_data, valid_data_region, original_block_coordinates, block_index, nodata=None):
         """Represents a single raster block."""
         self.block_data = block_data
         self.valid_data_region = valid_data_region
         self.original_block_coordinates = original_block_coordinates
         self.block_index = block_index
+        self.nodata = nodata
+
+    def __reduce__(self):
+        # Com o protocolo 5 o array contíguo vai fora da banda (PickleBuffer), sem cópias extras.
+        return RasterBlock, (np.ascontiguousarray(self.block_data), self.valid_data_region,
+                             self.original_block_coordinates, self.block_index, self.nodata)
 
     def get_valid_data(self) -> np.ndarray:
         """Returns the data inside the valid region."""
@@ -32,6 +39,15 @@ class RasterBlock:
     def data(self) -> np.ndarray:
         return self.block_data
 
+    @property
+    def masked_data(self) -> np.ma.MaskedArray:
+        """Block data as a masked array, with the nodata pixels masked (a view, no copy)."""
+        if self.nodata is None:
+            return np.ma.MaskedArray(self.block_data)
+        if np.isnan(self.nodata):
+            return np.ma.masked_invalid(self.block_data, copy=False)
+        return np.ma.masked_equal(self.block_data, self.nodata, copy=False)
+
     @property
     def nn_data(self) -> np.ndarray:
         """Block data normalized and in channels first format."""
@@ -40,29 +56,144 @@ class RasterBlock:
         return raster_data
 
 
-class RasterPaddingIterator(collections.Iterator):
-    def __init__(self, raster_data: RasterData, padding: int, infinite: bool = False, sampler: ArraySampler=None):
+class NNBatchBuilder:
+    def __init__(self, batch_size: int, n_channels: int, block_shape: Sequence[int], dtype=np.float32,
+                 mean: Sequence[float] = None, std: Sequence[float] = None,
+                 minimum: Sequence[float] = None, maximum: Sequence[float] = None):
+        """Builds normalized, channels first (B, C, H, W) batches from RasterBlocks.
+
+        Blocks are copied, converted and normalized in a single pass into a contiguous buffer
+        that is reused by every batch. Normalization is (x - mean) / std when mean and std are given,
+        (x - minimum) / (maximum - minimum) when the range is given, otherwise x / 255 like RasterBlock.nn_data.
+        The statistics may be computed with raster_utils.channel_statistics.
+
+        :param batch_size: Maximum number of blocks in a batch.
+        :param n_channels: Number of channels of the blocks.
+        :param block_shape: Blocks (rows, cols).
+        :param dtype: Output dtype, usually np.float32 or np.float16 (normalized in float32 and converted once).
+        :param mean: Per channel mean.
+        :param std: Per channel standard deviation.
+        :param minimum: Per channel minimum.
+        :param maximum: Per channel maximum.
+        """
+        self.batch_size = batch_size
+        self.buffer = np.empty((batch_size, n_channels) + tuple(block_shape), dtype=dtype)
+        # Normalização em pelo menos float32, saídas menores (float16) são convertidas uma vez no final.
+        compute_dtype = np.result_type(dtype, np.float32)
+        self._scratch = None
+        if compute_dtype != self.buffer.dtype:
+            self._scratch = np.empty((n_channels,) + tuple(block_shape), dtype=compute_dtype)
+        if mean is not None and std is not None:
+            offset, factor = mean, 1 / np.asarray(std, dtype=np.float64)
+        elif minimum is not None and maximum is not None:
+            offset = minimum
+            factor = 1 / (np.asarray(maximum, dtype=np.float64) - np.asarray(minimum, dtype=np.float64))
+        else:
+            offset, factor = 0, 1 / 255
+        # Broadcast to (C, 1, 1).
+        self.offset = np.broadcast_to(np.asarray(offset, dtype=compute_dtype), (n_channels,)).reshape(-1, 1, 1)
+        self.factor = np.broadcast_to(np.asarray(factor, dtype=compute_dtype), (n_channels,)).reshape(-1, 1, 1)
+
+    def build(self, blocks: Sequence[RasterBlock]) -> np.ndarray:
+        """Fills the buffer with the blocks and returns the batch (a view on the buffer).
+        The batch is overwritten by the next call, copy it if it must be kept.
+        """
+        if len(blocks) > self.batch_size:
+            raise ValueError("More blocks than the batch size.")
+        for position, block in enumerate(blocks):
+            out = self.buffer[position] if self._scratch is None else self._scratch
+            # Channels last -> channels first, conversion and normalization without temporary arrays.
+            np.subtract(np.moveaxis(block.data, -1, 0), self.offset, out=out, casting="unsafe")
+            np.multiply(out, self.factor, out=out)
+            if self._scratch is not None:
+                np.copyto(self.buffer[position], out, casting="unsafe")
+        return self.buffer[:len(blocks)]
+
+    def batches(self, blocks: Iterable[RasterBlock]) -> Iterator[Tuple[np.ndarray, List[RasterBlock]]]:
+        """Groups the blocks into batches, yields the batch array and its blocks."""
+        batch = []
+        for block in blocks:
+            batch.append(block)
+            if len(batch) == self.batch_size:
+                yield self.build(batch), batch
+                batch = []
+        if batch:
+            yield self.build(batch), batch
+
+
+class RasterPaddingIterator(collections.abc.Iterator):
+    def __init__(self, raster_data: RasterData, padding: int, infinite: bool = False, sampler: ArraySampler=None,
+                 halo_reuse: bool = False, border_mode: str = PAD_SYMMETRIC, constant_value=0,
+                 reuse_buffer: bool = False, shuffle: bool = False, seed: int = 0, rank: int = 0,
+                 world_size: int = 1, skip_empty: bool = False, bands: Sequence[int] = None):
         """Iterates over a single raster, yelds image blocks with an extra padding around it.
 
+        With halo_reuse the blocks are yielded in raster order (row by row) and each native block
+        of the image is read only once: a band of decoded rows is kept in memory and the padded
+        blocks are built from it, instead of reading the padding again for every block.
+
         :param raster_data: The image RasterData.
         :param padding: The size in pixels of the padding.     
         :param infinite: If the iterator should run infinite times.
+        :param halo_reuse: Reads each native block once, yielding the blocks in raster order.
+        :param border_mode: How the padding outside the image is filled, one of the raster_utils PAD_* modes.
+        :param constant_value: Fill value for PAD_CONSTANT, e.g. the nodata value.
+        :param reuse_buffer: Writes every block into the same array, the block data is only valid
+            until the next block is read.
+        :param shuffle: Shuffles the blocks on every epoch, the order depends only on the seed and the epoch.
+        :param seed: Seed for the shuffling, must be the same on every rank.
+        :param rank: Index of this process among world_size processes, each one iterates a disjoint
+            part of the blocks. See also set_worker for data loader workers.
+        :param world_size: Number of processes sharing the blocks.
+        :param skip_empty: Skips the blocks without allocated data (see RasterData.is_window_empty),
+            checked once, without reading them.
+        :param bands: Bands read (starting at 1), all of them by default.
         :returns: The block data (with padding), the valid data region, the block coordinates at the image.
         """
         block_indices = raster_data.get_blocks_array_indices()
+        self.block_coordinates = raster_data.get_blocks_positions_coordinates()
+        if skip_empty:
+            block_indices = [index for index in block_indices
+                             if not raster_data.is_window_empty(*self.block_coordinates[index])]
+        self.skip_empty = skip_empty
 
         if sampler:
             self.block_indices, _ = sampler.sample(block_indices)
         else:
             self.block_indices = block_indices
+        if halo_reuse:
+            if shuffle:
+                raise ValueError("halo_reuse reads the blocks in raster order, it can't be used with shuffle.")
+            self.block_indices = sorted(tuple(index) for index in self.block_indices)
 
+        self.halo_reuse = halo_reuse
+        # Faixa de linhas decodificadas (halo_reuse): strips nativos por índice, primeira linha da faixa e dados.
+        self._strips = {}
+        self._band_start = 0
+        self._band = None
+
+        self.border_mode = border_mode
+        self.constant_value = constant_value
+        self.reuse_buffer = reuse_buffer
+        self._buffer = None
+
+        self.bands = tuple(bands) if bands else None
         self.infinite = infinite
-        self.block_coordinates = raster_data.get_blocks_positions_coordinates()
+        self.nodata = raster_data.nodata
         self.padding = padding
         self.block_size = raster_data.block_size
         self.raster_data = raster_data
 
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.worker_id = 0
+        self.num_workers = 1
+        self.epoch = 0
+        #: Position of the next block in the current epoch (and shard).
         self.index = 0
+        self._epoch_order = None
 
         img_shape = raster_data.shape
 
@@ -90,108 +221,233 @@ class RasterPaddingIterator(collections.Iterator):
         self.expected_shape = (self.block_size[0] + double_padding, self.block_size[1] + double_padding)
 
     def __len__(self) -> int:
-        return len(self.block_indices)
+        """Number of blocks of an epoch in this shard."""
+        return len(self._get_epoch_order())
 
-    def __next__(self) -> RasterBlock:
-        try:
-            self.index += 1
-            row_index, col_index = self.block_indices[self.index]
-        except IndexError:
-            if self.infinite is True:
-                # Se o iterator acaba (IndexError) reinicia a iteração para o caso de infinite=True.
-                self.index = 0
-                row_index, col_index = self.block_indices[self.index]
+    def set_worker(self, worker_id: int, num_workers: int) -> None:
+        """Splits this rank blocks among data loader workers (e.g. from a torch worker_init_fn)."""
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self._epoch_order = None
+
+    def set_epoch(self, epoch: int) -> None:
+        """Moves to the start of an epoch."""
+        self.epoch = epoch
+        self.index = 0
+        self._epoch_order = None
+
+    def _get_epoch_order(self) -> np.ndarray:
+        """Positions in block_indices of the blocks of the current epoch, for this shard."""
+        if self._epoch_order is None:
+            n_blocks = len(self.block_indices)
+            if self.shuffle:
+                order = np.random.default_rng([self.seed, self.epoch]).permutation(n_blocks)
             else:
-                raise StopIteration
+                order = np.arange(n_blocks)
+            # Shards intercalados: cada bloco pertence a exatamente um (rank, worker).
+            n_shards = self.world_size * self.num_workers
+            shard = self.rank * self.num_workers + self.worker_id
+            self._epoch_order = order[shard::n_shards]
+            if self.halo_reuse:
+                self._epoch_order = np.sort(self._epoch_order)
+        return self._epoch_order
+
+    def epoch_block_indices(self) -> list:
+        """Block indices (row, col) of the current epoch, for this shard, in iteration order."""
+        return [self.block_indices[position] for position in self._get_epoch_order()]
+
+    def state_dict(self) -> dict:
+        """Iteration state, to resume with load_state_dict."""
+        return {"epoch": self.epoch, "index": self.index, "seed": self.seed}
+
+    def load_state_dict(self, state: dict) -> None:
+        """Resumes the iteration from a state_dict."""
+        self.seed = state["seed"]
+        self.set_epoch(state["epoch"])
+        self.index = state["index"]
+
+    def window_origin(self, row_index: int, col_index: int):
+        """Image position (y, x) of the top left pixel of a padded block, may be negative.
+        The last row and column are moved back to complete the block size.
+        """
+        y0, _, x0, _ = self.block_coordinates[row_index, col_index]
+        y0, x0 = int(y0) - self.padding, int(x0) - self.padding
+        if row_index + 1 == self.n_block_rows:
+            y0 -= self.dif_last_row
+        if col_index + 1 == self.n_block_cols:
+            x0 -= self.dif_last_col
+        return y0, x0
+
+    def _read_band(self, y0: int, y1: int) -> np.ndarray:
+        """Returns the image rows y0:y1 (all columns), reading each native strip of rows only once.
+        Strips above y0 are dropped, so rows must be requested in increasing order.
+        """
+        strip_height = self.raster_data.block_size[1]
+        first, last = y0 // strip_height, (y1 - 1) // strip_height
+        for strip in [strip for strip in self._strips if strip < first or strip > last]:
+            del self._strips[strip]
+            self._band = None
+        for strip in range(first, last + 1):
+            if strip not in self._strips:
+                strip_y1 = min((strip + 1) * strip_height, self.raster_data.rows)
+                self._strips[strip] = self.raster_data.read_block_by_coordinates(
+                    strip * strip_height, strip_y1, 0, self.raster_data.cols, self.bands)
+                self._band = None
+        if self._band is None:
+            self._band_start = first * strip_height
+            self._band = np.concatenate([self._strips[strip] for strip in sorted(self._strips)])
+        return self._band[y0 - self._band_start:y1 - self._band_start]
+
+    def read_block(self, row_index: int, col_index: int, out: np.ndarray = None) -> RasterBlock:
+        """Reads a single padded block.
+
+        The part of the window inside the image is read once and written, with its borders,
+        into a single array. Borders outside the image are filled according to border_mode.
+
+        :param row_index: Block row.
+        :param col_index: Block column.
+        :param out: Optional array (rows, cols, channels) with the expected shape to receive the data.
+        """
+        wy0, wx0 = self.window_origin(row_index, col_index)
+        rows, cols = self.raster_data.shape
+        y0, y1 = max(wy0, 0), min(wy0 + self.expected_shape[0], rows)
+        x0, x1 = max(wx0, 0), min(wx0 + self.expected_shape[1], cols)
+        if self.halo_reuse:
+            data = self._read_band(y0, y1)[:, x0:x1]
+        else:
+            data = self.raster_data.read_block_by_coordinates(y0, y1, x0, x1, self.bands)
+
+        if out is None:
+            out = self._buffer
+            if out is None or out.dtype != data.dtype:
+                out = np.empty(self.expected_shape + data.shape[2:], dtype=data.dtype)
+                if self.reuse_buffer:
+                    self._buffer = out
+        pad_block_into(out, data, y0 - wy0, x0 - wx0, self.border_mode, self.constant_value)
 
         # Position of the data that is valid for write (excludes padding and block completion).
         # [vy0, vy1, vx0, vx1]
         block_valid_data = [0, self.block_size[0], 0, self.block_size[1]]
-        original_block_coordinates = self.block_coordinates[row_index, col_index]
-        a_block_coordinates = self.block_coordinates[row_index, col_index]
-
-        # Linhas ---------------------
         if row_index + 1 == self.n_block_rows:
-            # Ultima linha. Completa o que falta e pega o padding dos blocos de cima.
-            y0, y1, x0, x1 = a_block_coordinates
-            a_block_coordinates = [y0 - self.dif_last_row - self.padding, y1, x0, x1]
             block_valid_data[0] = self.dif_last_row
-        elif row_index + 2 == self.n_block_rows:
-            # Penultima linha. Verifica se a ultima linha é maior que o padding.
-            if self.padding > self.resto_pixel_rows:
-                # Se for maior, não pode pegar o padding de baixo, pega apenas o que tem disponível, depois
-                # será feito o mirror para completar.
-                y0, y1, x0, x1 = a_block_coordinates
-                a_block_coordinates = [y0 - self.padding, y1 + self.resto_pixel_rows, x0, x1]
-            else:
-                # Se não for maior, procede normalmente pegando o padding de cima e de baixo
-                y0, y1, x0, x1 = a_block_coordinates
-                a_block_coordinates = [y0 - self.padding, y1 + self.padding, x0, x1]
-        elif row_index + 1 != self.n_block_rows and row_index != 0:
-            # Não é ultima linha, nem a primeira, pega o padding do bloco de cima e de baixo.
-            y0, y1, x0, x1 = a_block_coordinates
-            a_block_coordinates = [y0 - self.padding, y1 + self.padding, x0, x1]
-
-        # Colunas |||||||||||||||
         if col_index + 1 == self.n_block_cols:
-            # Ultima coluna, completa e pega o padding do bloco da esquerda.
-            y0, y1, x0, x1 = a_block_coordinates
-            a_block_coordinates = [y0, y1, x0 - self.dif_last_col - self.padding, x1]
             block_valid_data[2] = self.dif_last_col
-        elif col_index + 2 == self.n_block_cols:
-            # Penultima coluna. Verifica se a ultima coluna é maior que o padding.
-            if self.padding > self.resto_pixel_cols:
-                # Se for maior, não pode pegar o padding da direita, pega apenas o que tem disponível, depois
-                # será feito o mirror para completar.
-                y0, y1, x0, x1 = a_block_coordinates
-                a_block_coordinates = [y0, y1, x0 - self.padding, x1 + self.resto_pixel_cols]
-            else:
-                # Se não for maior, procede normalmente pegando o padding da direita e da esquerda.
-                y0, y1, x0, x1 = a_block_coordinates
-                a_block_coordinates = [y0, y1, x0 - self.padding, x1 + self.padding]
-        elif col_index + 1 != self.n_block_cols and col_index != 0:
-            # Nem a ultima, nem a penultima, nem a primeira coluna. Pega o padding do bloco da direita e da esquerda.
-            y0, y1, x0, x1 = a_block_coordinates
-            a_block_coordinates = [y0, y1, x0 - self.padding, x1 + self.padding]
-
-        # Primeira linha e coluna. (talvez juntar como elif acima?)
-        if row_index == 0:
-            # Primeira linha, adiciona o padding do bloco de baixo.
-            y0, y1, x0, x1 = a_block_coordinates
-            a_block_coordinates = [y0, y1 + self.padding, x0, x1]
-        if col_index == 0:
-            # Primeira coluna, adiciona o padding do bloco da direita.
-            y0, y1, x0, x1 = a_block_coordinates
-            a_block_coordinates = [y0, y1, x0, x1 + self.padding]
-
-        # Agora pega o bloco.
-        block_data = self.raster_data.read_block_by_coordinates(*a_block_coordinates)
-
-        # E fazemos os espelhamentos para os casos especificos.
-        # Linhas ------
-        if row_index == 0:  # 1a linha. Espelha para cima.
-            block_data = mirror_block(block_data, self.padding, MIRROR_TOP)
-        elif row_index + 1 == self.n_block_rows:  # Ultima linha. Espelha para baixo.
-            block_data = mirror_block(block_data, self.padding, MIRROR_BOTTOM)
-        elif row_index + 2 == self.n_block_rows:  # Penultima linha, verifica se deve completar com espelhamento.
-            if self.padding > self.resto_pixel_rows:
-                # Se o padding é maior, completa com o espelhamento.
-                block_data = mirror_block(block_data, self.padding - self.resto_pixel_rows, MIRROR_BOTTOM)
-
-        # Colunas |||||||
-        if col_index == 0:  # 1a coluna. Espelha para a esquerda.
-            block_data = mirror_block(block_data, self.padding, MIRROR_LEFT)
-        elif col_index + 1 == self.n_block_cols:  # Ultima coluna. Espelha para a direita.
-            block_data = mirror_block(block_data, self.padding, MIRROR_RIGHT)
-        elif col_index + 2 == self.n_block_cols:  # Penultima coluna, verifica se deve completar com espelhamento.
-            if self.padding > self.resto_pixel_cols:
-                # Se o padding é maior, completa com o espelhamento.
-                block_data = mirror_block(block_data, self.padding - self.resto_pixel_cols, MIRROR_RIGHT)
-
-        # Por segurança verifica se o bloco gerado tem o tamanho correto.
-        if block_data.shape[:2] != self.expected_shape:
-            raise RuntimeError("""
-                       Foi gerado um bloco de tamanho incorreto. 
-                       Esperado: {},  Gerado: {}.""".format(self.expected_shape, block_data.shape[:2]))
-
-        return RasterBlock(block_data, block_valid_data, original_block_coordinates, (row_index, col_index))
+        original_block_coordinates = self.block_coordinates[row_index, col_index]
+        return RasterBlock(out, block_valid_data, original_block_coordinates, (row_index, col_index), self.nodata)
+
+    def __next__(self) -> RasterBlock:
+        order = self._get_epoch_order()
+        if self.index >= len(order):
+            # Fim da época, reinicia a iteração (com nova ordem) para o caso de infinite=True.
+            if self.infinite is not True or len(order) == 0:
+                raise StopIteration
+            self.set_epoch(self.epoch + 1)
+            order = self._get_epoch_order()
+
+        row_index, col_index = self.block_indices[order[self.index]]
+        self.index += 1
+        return self.read_block(row_index, col_index)
+
+
+def common_window_size(rasters: Sequence[RasterData]) -> Tuple[int, int]:
+    """Smallest window (rows, cols) made of whole native blocks of every raster.
+
+    In each direction the window is the least common multiple of the native block sizes,
+    limited to the image size, e.g. scanlines (1 x cols) and 256 x 256 tiles give 256 x cols windows.
+    """
+    rows, cols = rasters[0].shape
+    window_rows, window_cols = 1, 1
+    for raster in rasters:
+        block_x, block_y = raster.block_size
+        window_rows = min(np.lcm(window_rows, block_y), rows)
+        window_cols = min(np.lcm(window_cols, block_x), cols)
+    return int(window_rows), int(window_cols)
+
+
+class AlignedWindow:
+    __slots__ = ("window", "data", "outputs")
+
+    def __init__(self, window, data, outputs):
+        """A window of several aligned rasters.
+
+        :param window: Image position y0, y1, x0, x1.
+        :param data: Tuple with the data (rows, cols, channels) of each input.
+        :param outputs: The output RasterData, written with write.
+        """
+        self.window = window
+        self.data = data
+        self.outputs = outputs
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        y0, y1, x0, x1 = self.window
+        return y1 - y0, x1 - x0
+
+    def write(self, data_array: np.ndarray, output: int = 0, channel: int = None) -> None:
+        """Writes the result of this window to an output.
+
+        :param data_array: Array (rows, cols) or (rows, cols, channels) with the window shape.
+        :param output: Index of the output.
+        :param channel: Band (starting at 1) for 2D arrays, 3D arrays are written to the first bands.
+        """
+        y0, y1, x0, x1 = self.window
+        if data_array.shape[:2] != self.shape:
+            raise ValueError("Array shape {} differs from the window shape {}.".format(data_array.shape[:2],
+                                                                                       self.shape))
+        gdal_dataset = self.outputs[output].gdal_dataset
+        with timed("raster.aligned_write") as section:
+            with gdal_call():
+                if data_array.ndim == 2:
+                    gdal_dataset.GetRasterBand(channel or 1).WriteArray(data_array, x0, y0)
+                else:
+                    for item in range(data_array.shape[2]):
+                        gdal_dataset.GetRasterBand(item + 1).WriteArray(data_array[:, :, item], x0, y0)
+            section.n_bytes = data_array.nbytes
+
+
+class AlignedBlockIterator:
+    def __init__(self, inputs: Sequence[RasterData], outputs: Sequence[RasterData] = (),
+                 window_size: Tuple[int, int] = None):
+        """Iterates over several rasters of the same grid at once, window by window.
+
+        The windows are made of whole native blocks of every raster (see common_window_size),
+        so each input block is decoded once and each output block (e.g. from clone_empty)
+        is written entirely at once, even when scanline inputs feed tiled outputs.
+
+        for window in AlignedBlockIterator([red, nir], [ndvi]):
+            red_data, nir_data = window.data
+            window.write(compute_ndvi(red_data, nir_data))
+
+        :param inputs: Rasters to read.
+        :param outputs: Rasters to write, flushed at the end of the iteration.
+        :param window_size: Window (rows, cols), replaces the common window size.
+        """
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        rasters = self.inputs + self.outputs
+        if not rasters:
+            raise ValueError("At least one raster is required.")
+        for raster in rasters[1:]:
+            if not raster == rasters[0]:
+                raise ValueError("Every raster must have the same grid (shape, origin, pixel size and SRS).")
+        self.window_size = tuple(window_size) if window_size else common_window_size(rasters)
+        self.shape = rasters[0].shape
+
+    def windows(self) -> List[Tuple[int, int, int, int]]:
+        """The windows y0, y1, x0, x1 in raster order."""
+        rows, cols = self.shape
+        window_rows, window_cols = self.window_size
+        return [(y0, min(y0 + window_rows, rows), x0, min(x0 + window_cols, cols))
+                for y0 in range(0, rows, window_rows) for x0 in range(0, cols, window_cols)]
+
+    def __len__(self) -> int:
+        return len(self.windows())
+
+    def __iter__(self) -> Iterator[AlignedWindow]:
+        for window in self.windows():
+            data = tuple(raster.read_block_by_coordinates(*window) for raster in self.inputs)
+            yield AlignedWindow(window, data, self.outputs)
+        for raster in self.outputs:
+            with gdal_call():
+                raster.gdal_dataset.FlushCache()
+            count("raster.flush")
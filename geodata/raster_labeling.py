@@ -0,0 +1,220 @@
+"""Out of core connected component labeling.
+
+Each native block is labeled on its own, the labels touching across block seams are
+merged with a union-find over the block edges, and a second pass writes the final labels.
+The seams are resolved one block row at a time, only the bottom edges of the previous
+block row and the per label statistics are kept in memory.
+"""
+from typing import Tuple, Union
+
+import numpy as np
+
+from geodata.instrumentation import count, gdal_call, timed
+
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+#: Dtype of the component statistics, windows as y0, y1, x0, x1 (end exclusive).
+COMPONENT_STATS_DTYPE = np.dtype([("label", np.int64), ("count", np.int64),
+                                  ("y0", np.int64), ("y1", np.int64), ("x0", np.int64), ("x1", np.int64)])
+
+
+def _neighbour_offsets(connectivity: int):
+    if connectivity == 4:
+        return [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    if connectivity == 8:
+        return [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dy, dx) != (0, 0)]
+    raise ValueError("connectivity must be 4 or 8.")
+
+
+def _label_numpy(mask: np.ndarray, connectivity: int) -> Tuple[np.ndarray, int]:
+    """Labels a 2D mask without scipy: minimum label propagation with pointer jumping."""
+    offsets = _neighbour_offsets(connectivity)
+    rows, cols = mask.shape
+    big = mask.size + 1
+    labels = np.where(mask, np.arange(1, mask.size + 1).reshape(mask.shape), big)
+    while True:
+        padded = np.pad(labels, 1, constant_values=big)
+        new_labels = labels.copy()
+        for dy, dx in offsets:
+            np.minimum(new_labels, padded[1 + dy:1 + dy + rows, 1 + dx:1 + dx + cols], out=new_labels)
+        new_labels[~mask] = big
+        # Pointer jumping: cada pixel assume o rótulo atual do pixel que deu origem ao seu rótulo.
+        flat = new_labels.ravel()
+        new_labels[mask] = flat[new_labels[mask] - 1]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    unique_labels, inverse = np.unique(labels[mask], return_inverse=True)
+    out = np.zeros(mask.shape, dtype=np.int64)
+    out[mask] = inverse + 1
+    return out, len(unique_labels)
+
+
+def label_mask(mask: np.ndarray, connectivity: int = 4) -> Tuple[np.ndarray, int]:
+    """Labels the connected components of a 2D mask, with scipy when available.
+    Returns the labels (0 for the background, 1...n) and the number of components n.
+    """
+    if ndimage is None:
+        return _label_numpy(mask, connectivity)
+    _neighbour_offsets(connectivity)
+    structure = ndimage.generate_binary_structure(2, 1 if connectivity == 4 else 2)
+    labels, n_labels = ndimage.label(mask, structure=structure)
+    return labels.astype(np.int64, copy=False), n_labels
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        # Lista python: acesso a itens isolados é bem mais rápido que num array numpy e cresce amortizado.
+        self.parent = list(range(size))
+
+    def extend(self, size: int) -> None:
+        """Grows to size items, the new items are their own roots."""
+        if size > len(self.parent):
+            self.parent.extend(range(len(self.parent), size))
+
+    def find(self, item: int) -> int:
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, first: int, second: int) -> None:
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            # A menor raiz é mantida, os rótulos finais seguem a ordem da primeira passada.
+            self.parent[max(first, second)] = min(first, second)
+
+    def roots(self) -> np.ndarray:
+        """The root of every item."""
+        parent = np.array(self.parent, dtype=np.int64)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return parent
+            parent = grandparent
+
+
+def _seam_pairs(first: np.ndarray, second: np.ndarray, connectivity: int) -> np.ndarray:
+    """Label pairs (N, 2) of touching pixels of two parallel block edges."""
+    pairs = [np.stack((first, second), axis=1)]
+    if connectivity == 8:
+        pairs.append(np.stack((first[:-1], second[1:]), axis=1))
+        pairs.append(np.stack((first[1:], second[:-1]), axis=1))
+    pairs = np.concatenate(pairs)
+    return pairs[(pairs[:, 0] > 0) & (pairs[:, 1] > 0)]
+
+
+def _block_mask(raster_data, band, block, background) -> np.ndarray:
+    xoff, yoff, width, height = block
+    gdal_band = raster_data.gdal_dataset.GetRasterBand(band)
+    with timed("labeling.read", gdal=True) as section:
+        data = gdal_band.ReadAsArray(xoff, yoff, width, height)
+        section.n_bytes = data.nbytes
+    mask = data != background
+    nodata = gdal_band.GetNoDataValue()
+    if nodata is not None:
+        mask &= data != nodata
+    return mask
+
+
+def label_components(raster_data, band: int = 1, connectivity: int = 4, out=None, out_band: int = 1,
+                     background=0) -> Tuple[Union[np.ndarray, None], np.ndarray]:
+    """Labels the connected components of the pixels different from background (and nodata).
+
+    See RasterData.label_components.
+    """
+    _neighbour_offsets(connectivity)
+    block_list = raster_data.block_list
+    block_x, block_y = raster_data.block_size
+
+    # Primeira passada: rótulos provisórios por bloco, estatísticas e união dos rótulos que se tocam
+    # nas emendas. Os blocos são lidos linha a linha, só as bordas inferiores da linha anterior são mantidas.
+    offsets = {}
+    stats = [np.zeros((1, 5), dtype=np.int64)]
+    n_provisional = 0
+    union_find = _UnionFind(1)
+    previous_bottoms, bottoms = {}, {}
+    current_row, left_edge = None, None
+    for block in sorted(block_list, key=lambda item: (item[1], item[0])):
+        xoff, yoff, width, height = block
+        labels, n_labels = label_mask(_block_mask(raster_data, band, block, background), connectivity)
+        row, col = yoff // block_y, xoff // block_x
+        if row != current_row:
+            previous_bottoms, bottoms = bottoms, {}
+            current_row, left_edge = row, None
+        offsets[(row, col)] = n_provisional
+        global_labels = np.where(labels > 0, labels + n_provisional, 0)
+        top = global_labels[0]
+        bottoms[col] = global_labels[-1].copy()
+
+        seams = []
+        if left_edge is not None:
+            seams.append(_seam_pairs(left_edge, global_labels[:, 0], connectivity))
+        if col in previous_bottoms:
+            seams.append(_seam_pairs(previous_bottoms[col], top, connectivity))
+        if connectivity == 8:
+            if col - 1 in previous_bottoms:
+                seams.append(_seam_pairs(previous_bottoms[col - 1][-1:], top[:1], 4))
+            if col + 1 in previous_bottoms:
+                seams.append(_seam_pairs(previous_bottoms[col + 1][:1], top[-1:], 4))
+        left_edge = global_labels[:, -1].copy()
+        union_find.extend(n_provisional + n_labels + 1)
+        if seams:
+            for first, second in np.unique(np.concatenate(seams), axis=0).tolist():
+                union_find.union(first, second)
+
+        if n_labels:
+            rows, cols = np.nonzero(labels)
+            block_labels = labels[rows, cols]
+            order = np.argsort(block_labels, kind="stable")
+            starts = np.searchsorted(block_labels[order], np.arange(1, n_labels + 1))
+            block_stats = np.empty((n_labels, 5), dtype=np.int64)
+            block_stats[:, 0] = np.bincount(block_labels, minlength=n_labels + 1)[1:]
+            block_stats[:, 1] = np.minimum.reduceat(rows[order], starts) + yoff
+            block_stats[:, 2] = np.maximum.reduceat(rows[order], starts) + yoff + 1
+            block_stats[:, 3] = np.minimum.reduceat(cols[order], starts) + xoff
+            block_stats[:, 4] = np.maximum.reduceat(cols[order], starts) + xoff + 1
+            stats.append(block_stats)
+        n_provisional += n_labels
+    roots = union_find.roots()
+
+    # Rótulos finais consecutivos (1...n) e estatísticas por componente.
+    unique_roots, lookup = np.unique(roots[1:], return_inverse=True)
+    lookup = np.concatenate(([0], lookup + 1))
+    n_components = len(unique_roots)
+    stats = np.concatenate(stats)
+    component_stats = np.zeros(n_components, dtype=COMPONENT_STATS_DTYPE)
+    component_stats["label"] = np.arange(1, n_components + 1)
+    component_stats["y0"] = component_stats["x0"] = np.iinfo(np.int64).max
+    final = lookup[1:] - 1
+    np.add.at(component_stats["count"], final, stats[1:, 0])
+    np.minimum.at(component_stats["y0"], final, stats[1:, 1])
+    np.maximum.at(component_stats["y1"], final, stats[1:, 2])
+    np.minimum.at(component_stats["x0"], final, stats[1:, 3])
+    np.maximum.at(component_stats["x1"], final, stats[1:, 4])
+
+    # Segunda passada: rotula os blocos novamente (determinístico) e escreve os rótulos finais.
+    result = np.zeros(raster_data.shape, dtype=np.int64) if out is None else None
+    if out is not None:
+        out_gdal_band = out.gdal_dataset.GetRasterBand(out_band)
+    for block in block_list:
+        xoff, yoff, width, height = block
+        labels, _ = label_mask(_block_mask(raster_data, band, block, background), connectivity)
+        offset = offsets[(yoff // block_y, xoff // block_x)]
+        final_labels = np.where(labels > 0, lookup[labels + offset], 0)
+        if out is None:
+            result[yoff:yoff + height, xoff:xoff + width] = final_labels
+            continue
+        with timed("labeling.write") as section:
+            with gdal_call():
+                out_gdal_band.WriteArray(final_labels, xoff, yoff)
+            section.n_bytes = final_labels.nbytes
+    if out is not None:
+        with gdal_call():
+            out.gdal_dataset.FlushCache()
+        count("raster.flush")
+    return result, component_stats
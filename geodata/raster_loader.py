@@ -0,0 +1,225 @@
+"""Prefetching of padded raster blocks by worker processes."""
+import multiprocessing
+import queue
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+from typing import Iterator, List, Union
+
+import numpy as np
+from osgeo import gdal_array
+
+from geodata.rasterdata import RasterData
+from geodata.raster_iterator import RasterBlock, RasterPaddingIterator
+
+#: Seconds between checks of the workers health while waiting for blocks.
+WORKER_POLL_INTERVAL = 1.0
+
+
+class SharedSlots:
+    def __init__(self, n_slots: int, slot_shape: tuple, dtype, name: str = None):
+        """A fixed number of equal arrays in a single shared memory segment.
+
+        The process that creates the segment (name=None) owns it and must call unlink.
+
+        :param n_slots: Number of arrays.
+        :param slot_shape: Shape of each array.
+        :param dtype: Arrays dtype.
+        :param name: Name of an existing segment to attach to.
+        """
+        self.n_slots = n_slots
+        self.slot_shape = tuple(slot_shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod((n_slots,) + self.slot_shape)) * self.dtype.itemsize, 1)
+        if name is None:
+            self.shm = SharedMemory(create=True, size=size)
+        else:
+            self.shm = SharedMemory(name=name)
+        self.arrays = np.ndarray((n_slots,) + self.slot_shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def __getitem__(self, slot: int) -> np.ndarray:
+        return self.arrays[slot]
+
+    def close(self) -> None:
+        # Views on the buffer must be released before closing.
+        self.arrays = None
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+def get_worker_result(results, workers: list) -> tuple:
+    """Waits for the next result of worker processes.
+    Workers report errors as (None, None, traceback, ...), which are raised here as RuntimeError.
+    """
+    while True:
+        try:
+            result = results.get(timeout=WORKER_POLL_INTERVAL)
+        except queue.Empty:
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                raise RuntimeError("A worker process died unexpectedly.")
+            continue
+        if result[0] is None:
+            raise RuntimeError("Error in a worker process:\n" + result[2])
+        return result
+
+
+def _loader_worker(src_image: str, padding: int, iterator_kwargs: dict, slots_name: str, n_slots: int,
+                   slot_shape: tuple, dtype, tasks, results):
+    """Worker process, reads the requested blocks straight into the shared slots."""
+    slots = SharedSlots(n_slots, slot_shape, dtype, name=slots_name)
+    try:
+        # Cada processo abre o seu próprio dataset.
+        iterator = RasterPaddingIterator(RasterData(src_image), padding, **iterator_kwargs)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            position, row_index, col_index, slot = task
+            block = iterator.read_block(row_index, col_index, out=slots[slot])
+            results.put((position, slot, block.valid_data_region, block.original_block_coordinates))
+    except Exception:
+        results.put((None, None, traceback.format_exc(), None))
+    finally:
+        slots.close()
+
+
+class PrefetchingLoader:
+    def __init__(self, iterator: RasterPaddingIterator, n_workers: int = 2, prefetch: int = 8,
+                 batch_size: int = None, ordered: bool = True, mp_context: str = "spawn"):
+        """Reads the blocks of a RasterPaddingIterator in worker processes, ahead of the consumer.
+
+        Each worker opens its own dataset from the image path and writes the padded blocks into
+        shared memory, so the arrays are never pickled. At most prefetch blocks are read ahead.
+        Each iteration goes once over the blocks of the iterator current epoch (and shard),
+        even for infinite iterators.
+
+        :param iterator: The iterator that defines the blocks, its raster must be a file.
+        :param n_workers: Number of worker processes.
+        :param prefetch: Number of blocks read ahead (shared memory slots).
+        :param batch_size: Yields lists of batch_size RasterBlocks instead of single blocks.
+        :param ordered: Yields the blocks in the iterator order, otherwise as soon as they are read.
+        :param mp_context: Multiprocessing start method.
+        """
+        self._workers = []
+        self._slots = None
+        src_image = iterator.raster_data.src_image
+        if src_image is None:
+            raise ValueError("The loader requires a raster opened from a file.")
+        self.iterator = iterator
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.n_slots = max(prefetch, batch_size or 1, n_workers)
+        self._context = multiprocessing.get_context(mp_context)
+
+        raster_data = iterator.raster_data
+        data_type = raster_data.gdal_dataset.GetRasterBand(1).DataType
+        self._dtype = gdal_array.GDALTypeCodeToNumericTypeCode(data_type)
+        n_channels = len(iterator.bands) if iterator.bands else raster_data.n_channels
+        self._slot_shape = tuple(iterator.expected_shape) + (n_channels,)
+        self._iterator_kwargs = {"border_mode": iterator.border_mode, "constant_value": iterator.constant_value,
+                                 "bands": iterator.bands}
+
+    def __len__(self) -> int:
+        n_blocks = len(self.iterator)
+        if self.batch_size:
+            return -(-n_blocks // self.batch_size)
+        return n_blocks
+
+    def __enter__(self) -> "PrefetchingLoader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _start(self):
+        self.close()
+        self._slots = SharedSlots(self.n_slots, self._slot_shape, self._dtype)
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        for _ in range(self.n_workers):
+            worker = self._context.Process(target=_loader_worker,
+                                           args=(self.iterator.raster_data.src_image, self.iterator.padding,
+                                                 self._iterator_kwargs, self._slots.name, self.n_slots,
+                                                 self._slot_shape, self._dtype, self._tasks, self._results),
+                                           daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _get_result(self):
+        return get_worker_result(self._results, self._workers)
+
+    def _iter_blocks(self) -> Iterator[RasterBlock]:
+        block_indices = self.iterator.epoch_block_indices()
+        n_blocks = len(block_indices)
+        self._start()
+        free_slots = list(range(self.n_slots))
+        next_task = 0
+        next_position = 0
+        pending = {}
+        try:
+            while next_position < n_blocks:
+                # Cada tarefa já leva o seu slot, assim as tarefas em andamento nunca ficam sem memória.
+                while free_slots and next_task < n_blocks:
+                    row_index, col_index = block_indices[next_task]
+                    self._tasks.put((next_task, int(row_index), int(col_index), free_slots.pop()))
+                    next_task += 1
+
+                position, slot, valid_data_region, block_coordinates = self._get_result()
+                pending[position] = (slot, valid_data_region, block_coordinates)
+                if self.ordered:
+                    ready = []
+                    while next_position + len(ready) in pending:
+                        ready.append(next_position + len(ready))
+                else:
+                    ready = [position]
+
+                for ready_position in ready:
+                    slot, valid_data_region, block_coordinates = pending.pop(ready_position)
+                    data = self._slots[slot].copy()
+                    free_slots.append(slot)
+                    row_index, col_index = block_indices[ready_position]
+                    next_position += 1
+                    yield RasterBlock(data, valid_data_region, block_coordinates, (row_index, col_index),
+                                      self.iterator.nodata)
+        finally:
+            self.close()
+
+    def __iter__(self) -> Iterator[Union[RasterBlock, List[RasterBlock]]]:
+        if not self.batch_size:
+            yield from self._iter_blocks()
+            return
+        batch = []
+        for block in self._iter_blocks():
+            batch.append(block)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def close(self) -> None:
+        """Stops the workers and releases the shared memory. Safe to call more than once."""
+        if self._workers:
+            for _ in self._workers:
+                self._tasks.put(None)
+            for worker in self._workers:
+                worker.join(timeout=WORKER_POLL_INTERVAL)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+            self._workers = []
+            self._tasks.close()
+            self._results.close()
+        if self._slots is not None:
+            self._slots.close()
+            self._slots.unlink()
+            self._slots = None
+
+    def __del__(self):
+        self.close()
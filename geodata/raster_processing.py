@@ -0,0 +1,103 @@
+"""Block processing in worker processes."""
+import multiprocessing
+import traceback
+from typing import Callable, Optional
+
+import numpy as np
+
+from geodata.rasterdata import RasterData
+from geodata.raster_loader import WORKER_POLL_INTERVAL, SharedSlots, get_worker_result
+
+
+def _map_blocks_worker(src_image: str, func: Callable, slots_name: str, n_slots: int, slot_shape: tuple, dtype,
+                       tasks, results):
+    """Worker process, reads blocks from its own dataset and writes func results into shared memory."""
+    slots = SharedSlots(n_slots, slot_shape, dtype, name=slots_name)
+    try:
+        raster = RasterData(src_image)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            block_index, slot, (xoff, yoff, width, height) = task
+            result = np.asarray(func(raster.read_block_by_coordinates(yoff, yoff + height, xoff, xoff + width)))
+            if result.ndim == 2:
+                result = result[..., np.newaxis]
+            if result.shape[:2] != (height, width):
+                raise ValueError("func must keep the block shape, got {} for {}.".format(
+                    result.shape[:2], (height, width)))
+            if slot is None:
+                # Saída com a imagem inteira, cada bloco é uma região disjunta.
+                slots[0][yoff:yoff + height, xoff:xoff + width] = result
+            else:
+                slots[slot][:height, :width] = result
+            results.put((block_index, slot, None))
+    except Exception:
+        results.put((None, None, traceback.format_exc()))
+    finally:
+        slots.close()
+
+
+def map_blocks_processes(raster_data: RasterData, func: Callable, out: RasterData = None, n_workers: int = None,
+                         out_bands: int = 1, out_dtype=np.float32, prefetch: int = None,
+                         mp_context: str = "spawn") -> Optional[np.ndarray]:
+    """Applies func to every block of a raster in worker processes. See RasterData.map_blocks_processes."""
+    if raster_data.src_image is None:
+        raise ValueError("Processing in other processes requires a raster opened from a file.")
+    n_workers = n_workers or multiprocessing.cpu_count()
+    block_list = raster_data.block_list
+    if out is not None:
+        if out.shape != raster_data.shape:
+            raise ValueError("The output raster must have the same shape of the source raster.")
+        out_bands = out.n_channels
+        max_height = max(block[3] for block in block_list)
+        max_width = max(block[2] for block in block_list)
+        # Slots por bloco: o processo principal é o único que escreve no arquivo (gdal não aceita escritas paralelas).
+        n_slots = max(prefetch or 2 * n_workers, 1)
+        slots = SharedSlots(n_slots, (max_height, max_width, out_bands), out_dtype)
+    else:
+        n_slots = 1
+        slots = SharedSlots(1, raster_data.shape + (out_bands,), out_dtype)
+
+    context = multiprocessing.get_context(mp_context)
+    tasks, results = context.Queue(), context.Queue()
+    workers = [context.Process(target=_map_blocks_worker,
+                               args=(raster_data.src_image, func, slots.name, n_slots, slots.slot_shape,
+                                     slots.dtype, tasks, results), daemon=True)
+               for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        if out is None:
+            for block_index, block in enumerate(block_list):
+                tasks.put((block_index, None, block))
+            for _ in block_list:
+                get_worker_result(results, workers)
+            return slots[0].copy()
+
+        free_slots = list(range(n_slots))
+        next_block = 0
+        for _ in block_list:
+            while free_slots and next_block < len(block_list):
+                tasks.put((next_block, free_slots.pop(), block_list[next_block]))
+                next_block += 1
+            block_index, slot, _ = get_worker_result(results, workers)
+            xoff, yoff, width, height = block_list[block_index]
+            for channel in range(out_bands):
+                out.gdal_dataset.GetRasterBand(channel + 1).WriteArray(slots[slot][:height, :width, channel],
+                                                                       xoff, yoff)
+            free_slots.append(slot)
+        out.gdal_dataset.FlushCache()
+        return None
+    finally:
+        for _ in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join(timeout=WORKER_POLL_INTERVAL)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        tasks.close()
+        results.close()
+        slots.close()
+        slots.unlink()
@@ -0,0 +1,169 @@
+"""Time series of co-registered rasters with per-pixel reductions."""
+import warnings
+from typing import Callable, Iterator, Sequence, Tuple, Union
+
+import numpy as np
+from osgeo import gdal
+
+from geodata.instrumentation import count, gdal_call, timed
+from geodata.rasterdata import RasterData
+from geodata.raster_iterator import AlignedBlockIterator, common_window_size
+
+#: Default memory limit of a cube, in bytes.
+DEFAULT_MAX_MEMORY = 256 * 1024 ** 2
+
+
+def trend_slope(cube: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Least squares slope of each pixel along the time axis, ignoring NaN.
+    Pixels with less than 2 valid values are NaN.
+
+    :param cube: Array (T, rows, cols) with NaN for invalid values.
+    :param times: Time of each layer (T,).
+    """
+    valid = ~np.isnan(cube)
+    values = np.where(valid, cube, 0)
+    t = np.asarray(times, dtype=np.float64).reshape(-1, 1, 1)
+    n = valid.sum(axis=0)
+    sum_t = (valid * t).sum(axis=0)
+    sum_tt = (valid * t * t).sum(axis=0)
+    sum_y = values.sum(axis=0)
+    sum_ty = (values * t).sum(axis=0)
+    denominator = n * sum_tt - sum_t * sum_t
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (n * sum_ty - sum_t * sum_y) / denominator
+    slope[(n < 2) | (denominator == 0)] = np.nan
+    return slope
+
+
+class RasterStack:
+    def __init__(self, rasters: Sequence[RasterData], times: Sequence = None, band: int = 1,
+                 max_memory: int = DEFAULT_MAX_MEMORY):
+        """A time series of rasters of the same grid, read as (T, rows, cols) cubes window by window.
+
+        Invalid pixels (nodata, alpha or mask bands) are NaN in the cubes, the reductions ignore them.
+
+        :param rasters: The rasters, all with the same shape, origin, pixel size and SRS.
+        :param times: Time of each raster (numbers, dates or datetime64), the stack is sorted by time.
+            Dates are converted to days. Defaults to the rasters order (0, 1, 2...).
+        :param band: Band read from every raster.
+        :param max_memory: Maximum size in bytes of a cube (float64), limits the window size.
+        """
+        if not rasters:
+            raise ValueError("The stack needs at least one raster.")
+        for raster in rasters[1:]:
+            if not raster == rasters[0]:
+                raise ValueError("Every raster must have the same grid (shape, origin, pixel size and SRS).")
+        if times is None:
+            times = np.arange(len(rasters), dtype=np.float64)
+        else:
+            if len(times) != len(rasters):
+                raise ValueError("There must be one time for each raster.")
+            times = np.asarray(times)
+            if not np.issubdtype(times.dtype, np.number):
+                times = times.astype("datetime64[D]").astype(np.float64)
+        order = np.argsort(times, kind="stable")
+        self.rasters = [rasters[item] for item in order]
+        self.times = times[order].astype(np.float64)
+        self.band = band
+        self.max_memory = max_memory
+        self.shape = rasters[0].shape
+
+    def __len__(self) -> int:
+        return len(self.rasters)
+
+    @property
+    def window_size(self) -> Tuple[int, int]:
+        """Window (rows, cols) made of whole native blocks, as large as max_memory allows."""
+        window_rows, window_cols = common_window_size(self.rasters)
+        pixel_bytes = len(self.rasters) * np.dtype(np.float64).itemsize
+        max_pixels = max(self.max_memory // pixel_bytes, 1)
+        if window_rows * window_cols > max_pixels:
+            # Janela menor que o bloco comum: lê os blocos mais de uma vez, mas respeita a memória.
+            window_cols = min(window_cols, max_pixels)
+            window_rows = max(max_pixels // window_cols, 1)
+        else:
+            # Empilha blocos inteiros enquanto couber na memória.
+            window_rows *= max(max_pixels // (window_rows * window_cols), 1)
+        return min(window_rows, self.shape[0]), window_cols
+
+    def read_cube(self, y0, y1, x0, x1) -> np.ndarray:
+        """Reads a window of every raster into a float64 cube (T, rows, cols), NaN where invalid."""
+        x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+        cube = np.empty((len(self.rasters), y1 - y0, x1 - x0), dtype=np.float64)
+        with timed("stack.read_cube") as section:
+            for position, raster in enumerate(self.rasters):
+                band = raster.gdal_dataset.GetRasterBand(self.band)
+                with gdal_call():
+                    cube[position] = band.ReadAsArray(x0, y0, x1 - x0, y1 - y0)
+                    mask_flags = band.GetMaskFlags()
+                    invalid = None if mask_flags & gdal.GMF_ALL_VALID else band.GetMaskBand().ReadAsArray(
+                        x0, y0, x1 - x0, y1 - y0) == 0
+                if invalid is not None:
+                    cube[position][invalid] = np.nan
+            section.n_bytes = cube.nbytes
+        return cube
+
+    def iter_cubes(self) -> Iterator[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+        """Iterates over the windows, yielding ((y0, y1, x0, x1), cube)."""
+        iterator = AlignedBlockIterator(self.rasters, window_size=self.window_size)
+        for window in iterator.windows():
+            yield window, self.read_cube(*window)
+
+    def reduce(self, function: Callable, out: RasterData = None, out_band: int = 1,
+               fill_value: float = None) -> Union[np.ndarray, None]:
+        """Applies a per pixel reduction to every cube and writes the result.
+
+        :param function: Function that receives a cube (T, rows, cols) and returns an array (rows, cols).
+        :param out: Output raster (e.g. from clone_empty), if not given returns the result as an array.
+        :param out_band: Band of the output.
+        :param fill_value: Value written where the result is NaN, defaults to the output nodata (or 0).
+        :returns: A float64 array (rows, cols) if out is not given.
+        """
+        if out is None:
+            result = np.empty(self.shape, dtype=np.float64)
+        else:
+            if not out == self.rasters[0]:
+                raise ValueError("The output must have the same grid of the stack.")
+            if fill_value is None:
+                fill_value = out.gdal_dataset.GetRasterBand(out_band).GetNoDataValue()
+            if fill_value is None:
+                fill_value = 0
+            band = out.gdal_dataset.GetRasterBand(out_band)
+
+        for (y0, y1, x0, x1), cube in self.iter_cubes():
+            # Pixels sem nenhuma observação válida resultam em NaN, sem avisos.
+            with np.errstate(all="ignore"), warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                window_result = function(cube)
+            if out is None:
+                result[y0:y1, x0:x1] = window_result
+                continue
+            window_result = np.where(np.isnan(window_result), fill_value, window_result)
+            with timed("stack.write") as section:
+                with gdal_call():
+                    band.WriteArray(window_result, x0, y0)
+                section.n_bytes = window_result.nbytes
+        if out is None:
+            return result
+        with gdal_call():
+            out.gdal_dataset.FlushCache()
+        count("raster.flush")
+        return None
+
+    def median(self, out: RasterData = None, **kwargs) -> Union[np.ndarray, None]:
+        """Median composite. See reduce for the parameters."""
+        return self.reduce(lambda cube: np.nanmedian(cube, axis=0), out, **kwargs)
+
+    def percentile(self, q: float, out: RasterData = None, **kwargs) -> Union[np.ndarray, None]:
+        """Percentile q (0 - 100) composite. See reduce for the parameters."""
+        return self.reduce(lambda cube: np.nanpercentile(cube, q, axis=0), out, **kwargs)
+
+    def count_valid(self, out: RasterData = None, **kwargs) -> Union[np.ndarray, None]:
+        """Number of valid observations of each pixel. See reduce for the parameters."""
+        return self.reduce(lambda cube: np.count_nonzero(~np.isnan(cube), axis=0).astype(np.float64), out, **kwargs)
+
+    def trend(self, out: RasterData = None, **kwargs) -> Union[np.ndarray, None]:
+        """Least squares slope of each pixel, in value units per time unit (days for dates).
+        See reduce for the parameters.
+        """
+        return self.reduce(lambda cube: trend_slope(cube, self.times), out, **kwargs)
@@ -1,6 +1,6 @@
 # Pablo Carreira - 30/05/17
-from random import Random
-from typing import Sequence
+import hashlib
+from typing import Sequence, Tuple
 
 import numpy as np
 
@@ -10,6 +10,13 @@ MIRROR_LEFT = "left"
 MIRROR_RIGHT = "right"
 MIRROR_ERROR_MESSAGE = "Padding bigger than block dimension."
 
+# Border modes, same meaning as in numpy.pad.
+PAD_SYMMETRIC = "symmetric"
+PAD_REFLECT = "reflect"
+PAD_EDGE = "edge"
+PAD_CONSTANT = "constant"
+PAD_MODES = (PAD_SYMMETRIC, PAD_REFLECT, PAD_EDGE, PAD_CONSTANT)
+
 SAMPLER_RATIO_METHOD = "ratio"
 SAMPLER_METHOD_N_SAMPLES = "n_samples"
 
@@ -28,8 +35,8 @@ class ArraySampler:
         :param ratio: The ratio of selected / not selected elements (0 < ratio < 1), 
             required if method=SAMPLER_RATIO_METHOD        
         :param n_samples: Number of samples, required if method=SAMPLER_METHOD_N_SAMPLES
-        :param random_seed: A string to be used as the seed for the pseudo random generator, providing the same seed
-            ensure that the same samples will be obteined on every call.
+        :param random_seed: A string (or int) to be used as the seed for the pseudo random generator, providing
+            the same seed ensure that the same samples will be obteined on every call.
         """
         self.method = method
         self.random_seed = random_seed
@@ -58,24 +65,119 @@ class ArraySampler:
             raise ValueError("Invalid method.")
         return n_selected, n_blocks_total - n_selected
 
+    def _generator(self) -> np.random.Generator:
+        """A new generator seeded from random_seed, so every call gives the same samples."""
+        if isinstance(self.random_seed, int):
+            return np.random.default_rng(self.random_seed)
+        digest = hashlib.sha256(str(self.random_seed).encode("utf-8")).digest()
+        return np.random.default_rng(int.from_bytes(digest[:8], "little"))
+
+    @staticmethod
+    def _take(array: Sequence, indices: np.ndarray) -> Sequence:
+        if isinstance(array, np.ndarray):
+            return array[indices]
+        return [array[index] for index in indices]
+
+    @staticmethod
+    def _complement(n_items: int, selected: np.ndarray) -> np.ndarray:
+        """Indices not in selected, in their original order."""
+        mask = np.ones(n_items, dtype=bool)
+        mask[selected] = False
+        return np.flatnonzero(mask)
+
+    def sample_indices(self, n_items: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Samples the positions 0:n_items.
+
+        :returns: Arrays with the selected positions (in random order) and the not selected positions (in order).
+        """
+        n_selected, _ = self._calculate_output_length(n_items)
+        selected = self._generator().permutation(n_items)[:n_selected]
+        return selected, self._complement(n_items, selected)
+
     def sample(self, array: Sequence) -> Sequence:
         """Take samples from a sequence using the defined method.
 
         :param array: The list of indices.
         :returns: A tuple containing a alist of selected elements and a list of not selected elements.
+            Arrays are returned when array is a numpy array.
         """
-        n_blocks = len(array)
-        n_selected, n_not_selected = self._calculate_output_length(n_blocks)
-        random_generator = Random(self.random_seed)
-        # Obs: Para otimização, é possível copiar e reproduzir a função sample,
-        # separando os selecionados e não selecionados.
-        selected = random_generator.sample(array, n_selected)
-        # Agora calcula os não selecionados:
-        not_selected = []
-        for item in array:
-            if item not in selected:
-                not_selected.append(item)
-        return selected, not_selected
+        selected, not_selected = self.sample_indices(len(array))
+        return self._take(array, selected), self._take(array, not_selected)
+
+    def stratified_sample(self, array: Sequence, labels: np.ndarray) -> Sequence:
+        """Take samples keeping the proportion of each stratum.
+
+        The stratum of each element is its label or, for label histograms, the most frequent label.
+        The total number of samples is the same of sample(), distributed among the strata by the
+        largest remainder, so predict_samples_sizes remains valid.
+
+        :param array: The list of indices.
+        :param labels: Label of each element (n,) or label histogram of each element (n, n_labels).
+        :returns: A tuple containing the selected elements and the not selected elements.
+        """
+        labels = np.asarray(labels)
+        if len(labels) != len(array):
+            raise ValueError("Must provide one label (or histogram) for each element.")
+        strata = labels.argmax(axis=1) if labels.ndim == 2 else labels
+        n_items = len(array)
+        n_selected, _ = self._calculate_output_length(n_items)
+
+        stratum_values, strata, counts = np.unique(strata, return_inverse=True, return_counts=True)
+        quotas = counts * (n_selected / n_items) if n_items else counts.astype(np.float64)
+        n_per_stratum = np.floor(quotas).astype(np.int64)
+        missing = n_selected - n_per_stratum.sum()
+        # Largest remainder, ties go to the first strata.
+        n_per_stratum[np.argsort(n_per_stratum - quotas, kind="stable")[:missing]] += 1
+
+        # Random order inside each stratum, strata kept together.
+        order = self._generator().permutation(n_items)
+        order = order[np.argsort(strata[order], kind="stable")]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        selected = np.concatenate([order[start:start + n] for start, n in zip(starts, n_per_stratum)] or
+                                  [np.empty(0, dtype=np.int64)])
+        return self._take(array, selected), self._take(array, self._complement(n_items, selected))
+
+    def spatial_split(self, block_indices: Sequence, group_size: int, buffer: int = 0) -> Sequence:
+        """Splits blocks in spatial groups, so neighbour blocks end up in the same split.
+
+        Blocks are grouped in squares of group_size x group_size blocks and whole groups are
+        selected, until the number of selected blocks reaches the number defined by the method
+        (the last group may exceed it, so predict_samples_sizes is only approximate here).
+
+        :param block_indices: Block indices (row, col), as in RasterData.get_blocks_array_indices.
+        :param group_size: Side of the groups, in blocks.
+        :param buffer: Not selected blocks closer than buffer blocks to a selected block are discarded.
+        :returns: A tuple containing the selected block indices and the not selected block indices.
+        """
+        positions = np.asarray(block_indices, dtype=np.int64).reshape(-1, 2)
+        n_items = len(positions)
+        n_selected, _ = self._calculate_output_length(n_items)
+
+        _, groups, group_counts = np.unique(positions // group_size, axis=0, return_inverse=True,
+                                            return_counts=True)
+        groups = groups.reshape(-1)
+        group_order = self._generator().permutation(len(group_counts))
+        cumulative = np.cumsum(group_counts[group_order])
+        n_groups = int(np.searchsorted(cumulative, n_selected)) + 1 if n_selected else 0
+        selected_groups = np.zeros(len(group_counts), dtype=bool)
+        selected_groups[group_order[:n_groups]] = True
+
+        selected_mask = selected_groups[groups]
+        not_selected_mask = ~selected_mask
+        if buffer and n_items:
+            # Dilata a grade de blocos selecionados e descarta os não selecionados que ficam perto deles.
+            grid = np.zeros(tuple(positions.max(axis=0) + 1 + 2 * buffer), dtype=bool)
+            grid[positions[selected_mask, 0] + buffer, positions[selected_mask, 1] + buffer] = True
+            near = np.zeros_like(grid)
+            for dy in range(-buffer, buffer + 1):
+                for dx in range(-buffer, buffer + 1):
+                    near[buffer:-buffer, buffer:-buffer] |= grid[buffer + dy:grid.shape[0] - buffer + dy,
+                                                                 buffer + dx:grid.shape[1] - buffer + dx]
+            not_selected_mask &= ~near[positions[:, 0] + buffer, positions[:, 1] + buffer]
+
+        selected = np.flatnonzero(selected_mask)
+        not_selected = np.flatnonzero(not_selected_mask)
+        return self._take(block_indices, selected), self._take(block_indices, not_selected)
 
     def predict_samples_sizes(self, img_shape, block_size: Sequence):
         """Given an src_img shape and a block size, predict the size of selected and not selected samples list."""
@@ -104,28 +206,88 @@ def mirror_block(block_data: np.ndarray, padding: int, direction: str):
     elif padding < 0:
         raise ValueError("Padding must be positive.")
 
+    top = bottom = left = right = 0
     if direction == MIRROR_TOP:
-        if padding > block_data.shape[0]:
-            raise ValueError(MIRROR_ERROR_MESSAGE)
-        mirrored = np.flipud(block_data[:padding])
-        return np.vstack((mirrored, block_data))
+        top = padding
     elif direction == MIRROR_BOTTOM:
-        if padding > block_data.shape[0]:
-            raise ValueError(MIRROR_ERROR_MESSAGE)
-        mirrored = np.flipud(block_data[-padding:])
-        return np.vstack((block_data, mirrored))
+        bottom = padding
     elif direction == MIRROR_LEFT:
-        if padding > block_data.shape[1]:
-            raise ValueError(MIRROR_ERROR_MESSAGE)
-        mirrored = np.fliplr(block_data[:, :padding])
-        return np.hstack((mirrored, block_data))
+        left = padding
     elif direction == MIRROR_RIGHT:
-        if padding > block_data.shape[1]:
-            raise ValueError(MIRROR_ERROR_MESSAGE)
-        mirrored = np.fliplr(block_data[:, -padding:])
-        return np.hstack((block_data, mirrored))
+        right = padding
     else:
-        AttributeError('Direction must be one of [top, bottom, left, right] got: {}.'.format(direction))
+        raise AttributeError('Direction must be one of [top, bottom, left, right] got: {}.'.format(direction))
+    if max(top, bottom) > block_data.shape[0] or max(left, right) > block_data.shape[1]:
+        raise ValueError(MIRROR_ERROR_MESSAGE)
+
+    out = np.empty((block_data.shape[0] + top + bottom, block_data.shape[1] + left + right) + block_data.shape[2:],
+                   dtype=block_data.dtype)
+    return pad_block_into(out, block_data, top, left, PAD_SYMMETRIC)
+
+
+def padding_positions(start: int, size: int, length: int, mode: str = PAD_SYMMETRIC) -> np.ndarray:
+    """Maps the positions start:start + size of a padded axis to positions of the valid data (0:length).
+
+    Positions outside the valid data are mapped according to the border mode, for PAD_CONSTANT they are -1.
+    Paddings bigger than the data are repeated, like numpy.pad does.
+    """
+    positions = np.arange(start, start + size)
+    if mode == PAD_SYMMETRIC:
+        positions = np.mod(positions, 2 * length)
+        return np.where(positions < length, positions, 2 * length - 1 - positions)
+    elif mode == PAD_REFLECT:
+        if length == 1:
+            return np.zeros(size, dtype=positions.dtype)
+        period = 2 * (length - 1)
+        positions = np.mod(positions, period)
+        return np.where(positions < length, positions, period - positions)
+    elif mode == PAD_EDGE:
+        return np.clip(positions, 0, length - 1)
+    elif mode == PAD_CONSTANT:
+        return np.where((positions >= 0) & (positions < length), positions, -1)
+    raise ValueError("Border mode must be one of {}, got: {}.".format(PAD_MODES, mode))
+
+
+def pad_block_into(out: np.ndarray, block_data: np.ndarray, top: int, left: int, mode: str = PAD_SYMMETRIC,
+                   constant_value=0) -> np.ndarray:
+    """Writes a block and its padding into an existing array, without intermediate copies of the block.
+
+    The result is the same as numpy.pad(block_data, ((top, bottom), (left, right), ...), mode),
+    bottom and right are what is left of the out shape.
+
+    :param out: Output array, (rows, cols) or (rows, cols, channels).
+    :param block_data: The valid data.
+    :param top: Padding rows above the data.
+    :param left: Padding columns at the left of the data.
+    :param mode: One of PAD_SYMMETRIC, PAD_REFLECT, PAD_EDGE or PAD_CONSTANT.
+    :param constant_value: Value used by PAD_CONSTANT (e.g. the nodata value).
+    :returns: out.
+    """
+    rows, cols = block_data.shape[:2]
+    bottom, right = top + rows, left + cols
+    if top < 0 or left < 0 or bottom > out.shape[0] or right > out.shape[1]:
+        raise ValueError("Block doesn't fit in the output array.")
+    out[top:bottom, left:right] = block_data
+
+    if mode == PAD_CONSTANT:
+        out[:top] = constant_value
+        out[bottom:] = constant_value
+        out[top:bottom, :left] = constant_value
+        out[top:bottom, right:] = constant_value
+        return out
+
+    # As bordas são copiadas da própria região válida, primeiro as linhas e depois as colunas (altura toda).
+    row_positions = padding_positions(-top, out.shape[0], rows, mode) + top
+    col_positions = padding_positions(-left, out.shape[1], cols, mode) + left
+    if top:
+        np.take(out, row_positions[:top], axis=0, out=out[:top], mode="clip")
+    if bottom < out.shape[0]:
+        np.take(out, row_positions[bottom:], axis=0, out=out[bottom:], mode="clip")
+    if left:
+        np.take(out, col_positions[:left], axis=1, out=out[:, :left], mode="clip")
+    if right < out.shape[1]:
+        np.take(out, col_positions[right:], axis=1, out=out[:, right:], mode="clip")
+    return out
 
 
 def normalize_channel_range(x: np.ndarray) -> np.ndarray:
@@ -136,3 +298,14 @@ def normalize_channel_range(x: np.ndarray) -> np.ndarray:
 
 def normalize_by_mean(x: np.ndarray) -> np.ndarray:
     pass
+
+
+def channel_statistics(raster_data, approx: bool = True) -> np.ndarray:
+    """Per channel statistics of a RasterData, computed by GDAL (and cached in .aux.xml when possible).
+
+    :param raster_data: The RasterData.
+    :param approx: Allows the statistics to be computed from overviews or a subset of the blocks.
+    :returns: An array (channels, 4) with minimum, maximum, mean and standard deviation.
+    """
+    return np.array([raster_data.gdal_dataset.GetRasterBand(band + 1).GetStatistics(approx, True)
+                     for band in range(raster_data.n_channels)], dtype=np.float64)
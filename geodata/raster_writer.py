@@ -0,0 +1,116 @@
+"""Streaming writers for model outputs of padded raster blocks."""
+import numpy as np
+
+from geodata.rasterdata import RasterData
+from geodata.raster_iterator import RasterBlock, RasterPaddingIterator
+
+BLEND_UNIFORM = "uniform"
+BLEND_COSINE = "cosine"
+BLEND_GAUSSIAN = "gaussian"
+
+
+def blend_weights(shape, method: str = BLEND_COSINE, sigma: float = 0.25) -> np.ndarray:
+    """Weights for blending overlapping blocks, higher in the center of the block.
+
+    :param shape: Block (rows, cols).
+    :param method: One of BLEND_UNIFORM, BLEND_COSINE or BLEND_GAUSSIAN.
+    :param sigma: Gaussian standard deviation as a fraction of the block side.
+    """
+    axes = []
+    for size in shape:
+        position = np.arange(size, dtype=np.float64) + 0.5
+        if method == BLEND_UNIFORM:
+            axes.append(np.ones(size))
+        elif method == BLEND_COSINE:
+            axes.append(np.sin(np.pi * position / size) ** 2)
+        elif method == BLEND_GAUSSIAN:
+            axes.append(np.exp(-0.5 * ((position - size / 2) / (sigma * size)) ** 2))
+        else:
+            raise ValueError("Invalid blend method: {}.".format(method))
+    return np.outer(axes[0], axes[1])
+
+
+class OverlapBlendWriter:
+    def __init__(self, out_raster: RasterData, iterator: RasterPaddingIterator, method: str = BLEND_COSINE,
+                 sigma: float = 0.25, fill_value: float = 0):
+        """Writes predictions for the padded blocks of a RasterPaddingIterator, blending the overlaps.
+
+        Each prediction covers the whole padded block, overlapping regions are the weighted mean of
+        the predictions. Only a band of rows with the height of a padded block is kept in memory,
+        so the blocks must be added in raster order (RasterPaddingIterator with halo_reuse=True or
+        without sampler). Rows are written as soon as no other block can reach them.
+
+        :param out_raster: Output RasterData, with the grid of the iterator raster and one band per prediction channel.
+        :param iterator: The iterator that produced the blocks.
+        :param method: One of BLEND_UNIFORM, BLEND_COSINE or BLEND_GAUSSIAN.
+        :param sigma: Gaussian standard deviation as a fraction of the block side.
+        :param fill_value: Value for pixels not covered by any block.
+        """
+        if out_raster.shape != iterator.raster_data.shape:
+            raise ValueError("The output raster must have the same shape of the iterator raster.")
+        self.out_raster = out_raster
+        self.iterator = iterator
+        self.fill_value = fill_value
+        self.weights = blend_weights(iterator.expected_shape, method, sigma)
+        band_rows = iterator.expected_shape[0]
+        self._sums = np.zeros((band_rows, out_raster.cols, out_raster.n_channels), dtype=np.float64)
+        self._weight_sums = np.zeros((band_rows, out_raster.cols), dtype=np.float64)
+        # Primeira linha da imagem guardada na faixa.
+        self._band_start = 0
+
+    def __enter__(self) -> "OverlapBlendWriter":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+
+    def _flush(self, until_row: int):
+        """Writes the rows band_start:until_row and moves the band down."""
+        n_rows = min(until_row, self.out_raster.rows) - self._band_start
+        if n_rows <= 0:
+            return
+        weight_sums = self._weight_sums[:n_rows]
+        covered = weight_sums > 0
+        values = np.full(self._sums[:n_rows].shape, self.fill_value, dtype=np.float64)
+        np.divide(self._sums[:n_rows], weight_sums[..., np.newaxis], out=values, where=covered[..., np.newaxis])
+        for channel in range(self.out_raster.n_channels):
+            self.out_raster.gdal_dataset.GetRasterBand(channel + 1).WriteArray(values[..., channel], 0,
+                                                                               self._band_start)
+
+        # As linhas restantes sobem para o início da faixa.
+        remaining = len(self._weight_sums) - n_rows
+        self._sums[:remaining] = self._sums[n_rows:]
+        self._sums[remaining:] = 0
+        self._weight_sums[:remaining] = self._weight_sums[n_rows:]
+        self._weight_sums[remaining:] = 0
+        self._band_start += n_rows
+
+    def add(self, block: RasterBlock, prediction: np.ndarray) -> None:
+        """Accumulates the prediction for a block.
+
+        :param block: A block from the iterator.
+        :param prediction: Prediction with the padded block shape, (rows, cols) or (rows, cols, channels).
+        """
+        if prediction.ndim == 2:
+            prediction = prediction[..., np.newaxis]
+        if prediction.shape[:2] != tuple(self.iterator.expected_shape):
+            raise ValueError("Prediction must have the padded block shape {}.".format(self.iterator.expected_shape))
+
+        wy0, wx0 = self.iterator.window_origin(*block.block_index)
+        y0, y1 = max(wy0, 0), min(wy0 + prediction.shape[0], self.out_raster.rows)
+        x0, x1 = max(wx0, 0), min(wx0 + prediction.shape[1], self.out_raster.cols)
+        if y0 < self._band_start:
+            raise ValueError("Blocks must be added in raster order, rows above {} were already written.".format(
+                self._band_start))
+        self._flush(y0)
+
+        weights = self.weights[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+        rows = slice(y0 - self._band_start, y1 - self._band_start)
+        self._sums[rows, x0:x1] += prediction[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0] * weights[..., np.newaxis]
+        self._weight_sums[rows, x0:x1] += weights
+
+    def close(self) -> None:
+        """Writes the remaining rows."""
+        self._flush(self.out_raster.rows)
+        self.out_raster.gdal_dataset.FlushCache()
@@ -1,10 +1,19 @@
 # Pablo Carreira - 08/03/17
-from typing import Iterator, List, Tuple, Union, Sequence
+import asyncio
+import collections
+import numbers
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, List, Tuple, Union, Sequence
 
 import numpy as np
-from osgeo import gdal, osr
+from osgeo import gdal, gdal_array, osr
 
+from geodata.aio import AsyncHandles
 from geodata.geo_objects import BBox, RasterDefinition
+from geodata.handle_pool import DatasetPool, get_default_pool
+from geodata.instrumentation import count, gdal_call, instrumented, timed
+from geodata.lazy_array import LazyRasterArray
+from geodata.raster_labeling import label_components
 from geodata.srs_utils import create_osr_srs
 
 
@@ -19,12 +28,25 @@ class RasterData:
     proj = None
     origem = None
     pixel_size = None
-    gdal_dataset = None
-
-    def __init__(self, img_file: Union[str, gdal.Dataset], write_enabled: bool = False, verbose: bool = False):
+    _gdal_dataset = None
+    #: DatasetPool that provides the dataset handles, one per thread (see handle_pool).
+    handle_pool = None
+    #: Maximum concurrent requests of the async API, each one uses its own dataset handle.
+    #: Only read only rasters opened from files can use more than one.
+    async_concurrency = 1
+    _async_handles = None
+    #: Skips writing blocks that are entirely nodata (or 0 without nodata) and were never written, see clone_empty.
+    sparse_writes = False
+    #: Set by close, the dataset is never reopened afterwards.
+    closed = False
+
+    def __init__(self, img_file: Union[str, gdal.Dataset], write_enabled: bool = False, verbose: bool = False,
+                 handle_pool: Union[DatasetPool, bool] = None):
         """
         :param img_file: Caminho para o arquivo tiff da imagem ou um gdal dataset.
         :param write_enabled: Habilita a escrita para o arquivo. 
+        :param handle_pool: A DatasetPool (or True for the default pool) providing a handle per thread,
+            so the raster can be read from many threads. Only for read only rasters opened from files.
         """
         #: Caminho para o arquivo tiff da imagem (fonte de dados).
         self.verbose = verbose
@@ -39,8 +61,62 @@ class RasterData:
         else:
             raise TypeError("Wrong type for img_file, must be str or gdal.Dataset.")
 
+        # Um pool vazio é falso (__len__), por isso a verificação explícita.
+        if handle_pool is True or isinstance(handle_pool, DatasetPool):
+            if self.src_image is None or write_enabled:
+                raise ValueError("Handle pools are only for read only rasters opened from files.")
+            self.handle_pool = get_default_pool() if handle_pool is True else handle_pool
+
         self._load_metadata()  # May be lazy?
 
+    @property
+    def gdal_dataset(self) -> gdal.Dataset:
+        """The gdal dataset, with a handle pool it is the handle of the current thread."""
+        if self.closed:
+            raise ValueError("The raster was closed: {}".format(self.src_image))
+        if self.handle_pool is not None:
+            return self.handle_pool.get(self.src_image)
+        if self._gdal_dataset is None and self.src_image is not None:
+            # Reaberto sob demanda, por exemplo depois de ser recebido de outro processo (pickle).
+            self._gdal_dataset = self._open_dataset()
+        return self._gdal_dataset
+
+    @gdal_dataset.setter
+    def gdal_dataset(self, gdal_dataset: gdal.Dataset):
+        self._gdal_dataset = gdal_dataset
+
+    def close(self) -> None:
+        """Closes the dataset, the raster can't be used afterwards (the file isn't reopened)."""
+        self._gdal_dataset = None
+        self._async_handles = None
+        if self.handle_pool is not None:
+            self.handle_pool.close_path(self.src_image)
+        self.closed = True
+
+    def _open_dataset(self) -> gdal.Dataset:
+        gdal_dataset = gdal.Open(self.src_image, gdal.GA_Update if self.write_enabled else gdal.GA_ReadOnly)
+        if not gdal_dataset:
+            raise IOError("Erro ao abrir o arquivo ou arquivo inexistente: " + self.src_image)
+        return gdal_dataset
+
+    #: Attributes sent when pickling, the dataset is reopened from src_image by the receiving process.
+    _PICKLED_ATTRIBUTES = ("src_image", "img_file", "write_enabled", "verbose", "cols", "rows", "n_channels",
+                           "proj", "origem", "pixel_size", "block_size", "sparse_writes", "async_concurrency")
+
+    def __getstate__(self) -> dict:
+        if self.src_image is None:
+            raise TypeError("Only rasters opened from files can be pickled, not in memory datasets.")
+        state = {name: getattr(self, name) for name in self._PICKLED_ATTRIBUTES}
+        state["handle_pool"] = self.handle_pool is not None
+        return state
+
+    def __setstate__(self, state: dict):
+        state = dict(state)
+        # Pools não atravessam processos, o processo que recebe usa o seu pool padrão.
+        if state.pop("handle_pool"):
+            self.handle_pool = get_default_pool()
+        self.__dict__.update(state)
+
     @property
     def raster_definition(self):
         """Retorna o objeto RasterDefinition com as características deste raster."""
@@ -109,11 +185,14 @@ class RasterData:
             raise ValueError("Must provide an output image name for gtiff.")
         return RasterData(gdal.Warp(out_image, self.gdal_dataset, options=options))
 
+    @instrumented("raster.read_all")
     def read_all(self) -> np.ndarray:
         """Reads the entire data into an array."""
-        return self.gdal_dataset.ReadAsArray()
+        with gdal_call():
+            return self.gdal_dataset.ReadAsArray()
 
-    def read_block_by_coordinates(self, y0, y1, x0, x1):
+    @instrumented("raster.read_block")
+    def read_block_by_coordinates(self, y0, y1, x0, x1, bands: Sequence[int] = None):
         """Get a block by image coordinates.
         Returns a RGB block.
         
@@ -123,19 +202,74 @@ class RasterData:
         :param y1: Y end.
         :param x0: X start.
         :param x1: X end.         
+        :param bands: Bands read (starting at 1), all of them by default.
         """
+        return self._read_window(self.gdal_dataset, y0, y1, x0, x1, bands)
+
+    def _read_window(self, gdal_dataset: gdal.Dataset, y0, y1, x0, x1, bands: Sequence[int] = None) -> np.ndarray:
+        """Reads a block (rows, cols, channels) from a handle of this raster dataset."""
         # Make sure the params are ints otherwise gdal won't accept them.
         x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
         # Gdal takes offset and size instead of start and end, so we convert the parameters.
         x_size = x1 - x0
         y_size = y1 - y0
-        channels_count = range(self.n_channels)
+        if bands is None:
+            bands = range(1, self.n_channels + 1)
         channels_blocks = []
-        for item in channels_count:
-            channel = self.gdal_dataset.GetRasterBand(item + 1)
-            channels_blocks.append(channel.ReadAsArray(x0, y0, x_size, y_size))
+        for band in bands:
+            channel = gdal_dataset.GetRasterBand(int(band))
+            with gdal_call():
+                channels_blocks.append(channel.ReadAsArray(x0, y0, x_size, y_size))
         return np.dstack(channels_blocks)
 
+    @property
+    def nodata(self) -> Union[float, None]:
+        """The nodata value of the first band, None if not set."""
+        return self.gdal_dataset.GetRasterBand(1).GetNoDataValue()
+
+    def is_window_empty(self, y0, y1, x0, x1) -> bool:
+        """Checks, without reading, if a window has no data allocated in any band (e.g. sparse files).
+        Drivers that can't tell the coverage report the window as not empty.
+        """
+        x0, y0 = int(x0), int(y0)
+        x_size, y_size = int(x1) - x0, int(y1) - y0
+        for item in range(self.n_channels):
+            with gdal_call():
+                flags, _ = self.gdal_dataset.GetRasterBand(item + 1).GetDataCoverageStatus(x0, y0, x_size, y_size)
+            if flags != gdal.GDAL_DATA_COVERAGE_STATUS_EMPTY:
+                return False
+        return True
+
+    def read_mask_by_coordinates(self, y0, y1, x0, x1) -> Union[np.ndarray, None]:
+        """Reads the invalid pixels (rows, cols, channels) of a window, from nodata, alpha or mask bands.
+        Returns None when every pixel of the window is valid.
+        """
+        x0, y0 = int(x0), int(y0)
+        x_size, y_size = int(x1) - x0, int(y1) - y0
+        masks = []
+        for item in range(self.n_channels):
+            band = self.gdal_dataset.GetRasterBand(item + 1)
+            if band.GetMaskFlags() & gdal.GMF_ALL_VALID:
+                masks.append(np.zeros((y_size, x_size), dtype=bool))
+                continue
+            with gdal_call():
+                masks.append(band.GetMaskBand().ReadAsArray(x0, y0, x_size, y_size) == 0)
+        if not any(mask.any() for mask in masks):
+            return None
+        return np.dstack(masks)
+
+    def read_masked_block_by_coordinates(self, y0, y1, x0, x1) -> np.ma.MaskedArray:
+        """Like read_block_by_coordinates, but returns a masked array with the invalid pixels masked."""
+        data = self.read_block_by_coordinates(y0, y1, x0, x1)
+        mask = self.read_mask_by_coordinates(y0, y1, x0, x1)
+        return np.ma.MaskedArray(data, mask=np.ma.nomask if mask is None else mask)
+
+    def lazy(self) -> LazyRasterArray:
+        """Returns a lazy array (rows, cols, channels) of this raster, read only when indexed or reduced.
+        Reductions (sum, mean, min, max) are computed block by block, e.g. raster.lazy().mean(axis=(0, 1)).
+        """
+        return LazyRasterArray(self)
+
     def get_bbox_position_within_image(self, other_bbox: BBox, allow_partial: bool=False, allow_any_srs=False):
         """Claculate the position of a bbox within the image (in pixels).
 
@@ -215,7 +349,7 @@ class RasterData:
         # (lembre-se que a o sistema de referência (SR) da imagem tem origem no canto superior esquerdo e o geográfico
         # no canto inferior esquerdo.
 
-        block_width = int((obb_xmax - origin_x) / pixel_size) - 1  # FIXME: -1 Mágico.
+        block_width = int((obb_xmax - origin_x) / pixel_size)
         block_height = int((origin_y - obb_ymin) / pixel_size)
 
         # origem_y = origem_y - altura_px_pedaco * tamanho_pixel  # no topo esquedo, correto.
@@ -240,6 +374,112 @@ class RasterData:
         # tx = coords[3] - coords[2]
         return self.read_block_by_coordinates(*coords)
 
+    def get_bboxes_windows(self, bboxes: Union[Sequence[BBox], np.ndarray],
+                           size: Union[int, Sequence[int]] = None) -> np.ndarray:
+        """Calculates the pixel windows of many bboxes at once.
+
+        When size is given every window has exactly that size and is centered on its bbox,
+        otherwise the window covers the bbox extent (rounded to whole pixels).
+        Windows may be partially or totally out of the image.
+
+        :param bboxes: A sequence of BBox in this image SRS or an array (N, 4) of xmin, ymin, xmax, ymax.
+        :param size: Window size in pixels (rows, cols) or a single int for square windows.
+        :returns: An int array (N, 4) with the windows as x0, y0, width, height.
+        """
+        if isinstance(bboxes, np.ndarray):
+            extents = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        else:
+            # O SRS é comparado apenas uma vez para cada wkt diferente.
+            this_srs = osr.SpatialReference(self.wkt_srs)
+            for wkt in {bbox.wkt_srs for bbox in bboxes if bbox.wkt_srs}:
+                if not this_srs.IsSame(osr.SpatialReference(wkt)):
+                    raise RuntimeError("Must be in the same SRS.")
+            extents = np.array([bbox.as_tuple() for bbox in bboxes], dtype=np.float64).reshape(-1, 4)
+
+        origin_x, origin_y = self.origem
+        cols0 = (extents[:, 0] - origin_x) / self.pixel_size
+        cols1 = (extents[:, 2] - origin_x) / self.pixel_size
+        rows0 = (origin_y - extents[:, 3]) / self.pixel_size
+        rows1 = (origin_y - extents[:, 1]) / self.pixel_size
+
+        windows = np.empty((len(extents), 4), dtype=np.int64)
+        if size is None:
+            windows[:, 0] = np.round(cols0)
+            windows[:, 1] = np.round(rows0)
+            windows[:, 2] = np.round(cols1) - windows[:, 0]
+            windows[:, 3] = np.round(rows1) - windows[:, 1]
+        else:
+            if isinstance(size, numbers.Integral):
+                size = (size, size)
+            windows[:, 0] = np.round((cols0 + cols1 - size[1]) / 2)
+            windows[:, 1] = np.round((rows0 + rows1 - size[0]) / 2)
+            windows[:, 2] = size[1]
+            windows[:, 3] = size[0]
+        return windows
+
+    @instrumented("raster.extract_chips")
+    def extract_chips(self, bboxes: Union[Sequence[BBox], np.ndarray], size: Union[int, Sequence[int]] = None,
+                      bands: Sequence[int] = None, fill_value=0, workers: int = 4) -> np.ndarray:
+        """Reads one chip for each bbox into a single array.
+
+        Chips are read grouped by the native block that contains them, by several threads,
+        each one with its own gdal dataset. Parts of the chips outside the image are filled with fill_value.
+
+        :param bboxes: A sequence of BBox in this image SRS or an array (N, 4) of xmin, ymin, xmax, ymax.
+        :param size: Chip size in pixels (rows, cols) or a single int for square chips, centered on the bboxes.
+            If not given, all bboxes must have the same size in pixels.
+        :param bands: Bands to read (starting at 1), defaults to all bands.
+        :param fill_value: Value for the pixels outside the image.
+        :param workers: Number of reading threads. In memory datasets are always read by a single thread.
+        :returns: An array (N, rows, cols, channels).
+        """
+        windows = self.get_bboxes_windows(bboxes, size)
+        if bands is None:
+            bands = range(1, self.n_channels + 1)
+        bands = list(bands)
+        if len(windows) == 0:
+            chip_shape = (0, 0) if size is None else ((size, size) if isinstance(size, numbers.Integral) else tuple(size))
+        else:
+            chip_shape = (int(windows[0, 3]), int(windows[0, 2]))
+            if np.any(windows[:, 3] != chip_shape[0]) or np.any(windows[:, 2] != chip_shape[1]):
+                raise ValueError("Bboxes have different sizes, define the chips size.")
+
+        dtype = gdal_array.GDALTypeCodeToNumericTypeCode(self.gdal_dataset.GetRasterBand(bands[0]).DataType)
+        chips = np.full((len(windows),) + chip_shape + (len(bands),), fill_value, dtype=dtype)
+
+        # Clip the windows to the image.
+        x0 = np.clip(windows[:, 0], 0, self.cols)
+        y0 = np.clip(windows[:, 1], 0, self.rows)
+        x1 = np.clip(windows[:, 0] + windows[:, 2], 0, self.cols)
+        y1 = np.clip(windows[:, 1] + windows[:, 3], 0, self.rows)
+        inside = np.flatnonzero((x1 > x0) & (y1 > y0))
+
+        # Ordena as leituras pelo bloco nativo, chips vizinhos aproveitam o cache de blocos do gdal.
+        blk_width, blk_height = self.block_size
+        order = inside[np.lexsort((x0[inside] // blk_width, y0[inside] // blk_height))]
+
+        def read_chips(chip_indices: np.ndarray):
+            if self.src_image is None or self.handle_pool is not None:
+                dataset = self.gdal_dataset
+            else:
+                dataset = gdal.Open(self.src_image, gdal.GA_ReadOnly)
+            gdal_bands = [dataset.GetRasterBand(band) for band in bands]
+            for index in chip_indices:
+                cx0, cy0, cx1, cy1 = int(x0[index]), int(y0[index]), int(x1[index]), int(y1[index])
+                dx, dy = cx0 - windows[index, 0], cy0 - windows[index, 1]
+                for channel, gdal_band in enumerate(gdal_bands):
+                    with gdal_call():
+                        chip_data = gdal_band.ReadAsArray(cx0, cy0, cx1 - cx0, cy1 - cy0)
+                    chips[index, dy:dy + cy1 - cy0, dx:dx + cx1 - cx0, channel] = chip_data
+
+        if self.src_image is None or workers <= 1:
+            read_chips(order)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # Contiguous groups, so each thread keeps reading neighbour blocks.
+                list(executor.map(read_chips, np.array_split(order, workers)))
+        return chips
+
     # noinspection PyTypeChecker
     @property
     def block_indices(self) -> np.ndarray:
@@ -263,12 +503,10 @@ class RasterData:
 
     def _load_metadata(self):
         """Lê meta informações do arquivo."""
-        if isinstance(self.gdal_dataset, gdal.Dataset):
+        if isinstance(self._gdal_dataset, gdal.Dataset) or self.handle_pool is not None:
             gdal_dataset = self.gdal_dataset
         else:
-            gdal_dataset = gdal.Open(self.src_image, gdal.GA_Update if self.write_enabled else gdal.GA_ReadOnly)
-            if not gdal_dataset:
-                raise IOError("Erro ao abrir o arquivo ou arquivo inexistente: " + self.src_image)
+            gdal_dataset = self._open_dataset()
             self.gdal_dataset = gdal_dataset
 
         # Informacoes gerais.
@@ -349,9 +587,28 @@ class RasterData:
         src_band = self.gdal_dataset.GetRasterBand(banda)
         for block in blocks_list:
             # print("Block from list: {}".format(block))
-            block_data = src_band.ReadAsArray(*block)
+            with timed("raster.iterator_read", gdal=True) as section:
+                block_data = src_band.ReadAsArray(*block)
+                section.n_bytes = block_data.nbytes
             yield block_data
 
+    def get_valid_iterator(self) -> Iterator[Tuple[int, np.ma.MaskedArray]]:
+        """Iterates over the native blocks that have valid data, yielding (block_index, masked block).
+
+        Blocks without allocated data are skipped without reading them, and blocks with
+        every pixel invalid (nodata or masked) are skipped after reading. The block index
+        can be used with write_block. Blocks are masked arrays (rows, cols, channels).
+        """
+        for block_index, (xoff, yoff, width, height) in enumerate(self.block_list):
+            if self.is_window_empty(yoff, yoff + height, xoff, xoff + width):
+                count("raster.skipped_block")
+                continue
+            block_data = self.read_masked_block_by_coordinates(yoff, yoff + height, xoff, xoff + width)
+            if np.ma.getmask(block_data) is not np.ma.nomask and block_data.mask.all():
+                count("raster.skipped_block")
+                continue
+            yield block_index, block_data
+
     def get_rgb_iterator(self, stack: bool = True) -> Iterator:
         """Retorna um iterator sobre os 3 canais (RGB)
         
@@ -364,15 +621,18 @@ class RasterData:
         blue_channel = self.gdal_dataset.GetRasterBand(3)
 
         for block in blocks_list:
-            red_block_data = red_channel.ReadAsArray(*block)
-            green_block_data = green_channel.ReadAsArray(*block)
-            blue_block_data = blue_channel.ReadAsArray(*block)
+            with timed("raster.iterator_read", gdal=True) as section:
+                red_block_data = red_channel.ReadAsArray(*block)
+                green_block_data = green_channel.ReadAsArray(*block)
+                blue_block_data = blue_channel.ReadAsArray(*block)
+                section.n_bytes = red_block_data.nbytes * 3
             if stack:
                 yield np.dstack((red_block_data, green_block_data, blue_block_data))
             else:
                 yield red_block_data, green_block_data, blue_block_data
 
-    def clone_empty(self, new_img_file: str, bandas: int = 0, data_type=gdal.GDT_Byte, bits=None) -> 'RasterData':
+    def clone_empty(self, new_img_file: str, bandas: int = 0, data_type=gdal.GDT_Byte, bits=None,
+                    sparse: bool = False, nodata: float = None) -> 'RasterData':
         """Cria uma nova imagem RasterData com as mesmas características desta imagem,
         a nova imagem é vazia e pronta para a escrita.
         A finalidade é criar imagens para a saída de processamentos.
@@ -383,6 +643,11 @@ class RasterData:
         Não é possível determinar o block size das camadas de saída, portanto a escrita
         ocorre de forma menos eficiente nas imagens criadas quando iteradas com imagens
         obtidas que não possuem tamanho padrão de block (tiled vs. scanline).
+        Nesse caso use raster_iterator.AlignedBlockIterator, que lê e escreve janelas alinhadas aos dois layouts.
+
+        :param sparse: Creates a sparse GeoTIFF (SPARSE_OK), blocks are only allocated when written
+            and write_block skips blocks entirely filled with nodata.
+        :param nodata: Nodata value of every band, also the value read from unallocated blocks.
         """
         # Criado na unha para poder ajustar parâmetros.
 
@@ -408,6 +673,8 @@ class RasterData:
             geotiff_options = ["TILED=YES",
                                "BLOCKXSIZE=" + str(out_block_size[0]),
                                "BLOCKYSIZE=" + str(out_block_size[1])]
+        if sparse:
+            geotiff_options.append("SPARSE_OK=TRUE")
 
         new_dataset = gdal_driver.Create(new_img_file,
                                          self.cols, self.rows,
@@ -418,9 +685,15 @@ class RasterData:
         # Copia as informações georreferenciadas.
         new_dataset.SetProjection(self.gdal_dataset.GetProjection())
         new_dataset.SetGeoTransform(self.gdal_dataset.GetGeoTransform())
+        if nodata is not None:
+            for item in range(bandas):
+                new_dataset.GetRasterBand(item + 1).SetNoDataValue(nodata)
 
         new_dataset.FlushCache()  # Garante a escrita no disco.
-        return RasterData(new_img_file, write_enabled=True)
+        count("raster.flush")
+        new_raster = RasterData(new_img_file, write_enabled=True)
+        new_raster.sparse_writes = sparse
+        return new_raster
 
     def get_blocks_positions_coordinates(self) -> np.ndarray:
         """Creates an array containing the coordinates for the position (in image pixels) of each block.        
@@ -437,7 +710,7 @@ class RasterData:
         if resto_pixel_cols != 0:
             n_block_cols += 1
         # Primeiro, cria a matriz de escrita, o bloco tem o tamanho do blk_size.
-        coord_array = np.empty((n_block_rows, n_block_cols, 4), dtype=np.uint16)
+        coord_array = np.empty((n_block_rows, n_block_cols, 4), dtype=np.int64)
         for row_index in range(n_block_rows):
             y0 = row_index * self.block_size[0]
             if row_index + 1 == n_block_rows:  # Last row.
@@ -475,13 +748,147 @@ class RasterData:
         :param block_index: O índice do bloco para escrever.
         """
         block_position = self.block_list[block_index]
-        self.gdal_dataset.GetRasterBand(channel).WriteArray(data_array, block_position[0], block_position[1])
-        self.gdal_dataset.FlushCache()
+        if self.sparse_writes and self._is_sparse_skip(data_array, channel, block_position):
+            count("raster.skipped_write")
+            return
+        with timed("raster.write_block") as section:
+            with gdal_call():
+                self.gdal_dataset.GetRasterBand(channel).WriteArray(data_array, block_position[0], block_position[1])
+                self.gdal_dataset.FlushCache()
+            section.n_bytes = data_array.nbytes
+        count("raster.flush")
+
+    def _is_sparse_skip(self, data_array: np.ndarray, channel: int, block_position: tuple) -> bool:
+        """Checks if writing the array would only store nodata in an unallocated region."""
+        band = self.gdal_dataset.GetRasterBand(channel)
+        fill_value = band.GetNoDataValue()
+        if fill_value is None:
+            fill_value = 0
+        if np.isnan(fill_value):
+            if not np.isnan(data_array).all():
+                return False
+        elif np.any(data_array != fill_value):
+            return False
+        # Um bloco já escrito precisa ser sobrescrito mesmo que seja só nodata.
+        xoff, yoff = block_position[0], block_position[1]
+        rows, cols = data_array.shape[:2]
+        with gdal_call():
+            flags, _ = band.GetDataCoverageStatus(xoff, yoff, cols, rows)
+        return flags == gdal.GDAL_DATA_COVERAGE_STATUS_EMPTY
 
     def write_all(self, data_array: np.ndarray, channel: int = 1):
         """Write an array to the image starting from the first position."""
-        self.gdal_dataset.GetRasterBand(channel).WriteArray(data_array)
-        self.gdal_dataset.FlushCache()
+        with timed("raster.write_all") as section:
+            with gdal_call():
+                self.gdal_dataset.GetRasterBand(channel).WriteArray(data_array)
+                self.gdal_dataset.FlushCache()
+            section.n_bytes = data_array.nbytes
+        count("raster.flush")
+
+    def map_blocks_processes(self, func: Callable, out: "RasterData" = None, n_workers: int = None,
+                             out_bands: int = 1, out_dtype=np.float32, prefetch: int = None,
+                             mp_context: str = "spawn") -> Union[np.ndarray, None]:
+        """Applies func to every native block in worker processes, for CPU bound python functions.
+
+        Each worker opens its own dataset from the image path, reads the blocks it receives and
+        writes func results into shared memory, so blocks are never pickled. This process only
+        coordinates (and writes to out, since gdal files can't be written by several processes).
+
+        :param func: Picklable function (e.g. defined at module level) that receives a block
+            (rows, cols, channels) and returns an array (rows, cols) or (rows, cols, bands).
+        :param out: Output RasterData with the same shape, if not given the result is returned as an array.
+        :param n_workers: Number of worker processes, defaults to the number of CPUs.
+        :param out_bands: Number of output bands when out is not given.
+        :param out_dtype: Dtype of the results.
+        :param prefetch: Number of blocks processed ahead of the writes to out.
+        :param mp_context: Multiprocessing start method.
+        :returns: An array (rows, cols, out_bands) if out is not given.
+        """
+        # Importado aqui, raster_processing depende deste módulo.
+        from geodata.raster_processing import map_blocks_processes
+        return map_blocks_processes(self, func, out, n_workers, out_bands, out_dtype, prefetch, mp_context)
+
+    def label_components(self, band: int = 1, connectivity: int = 4, out: "RasterData" = None,
+                         out_band: int = 1, background=0) -> Tuple[Union[np.ndarray, None], np.ndarray]:
+        """Labels the connected components of a band, block by block, without loading the raster.
+
+        Pixels different from background (and from nodata) are labeled 1...n. Components crossing
+        block seams are merged and a second pass writes the final labels.
+
+        :param band: Band to label.
+        :param connectivity: 4 or 8.
+        :param out: Raster for the labels, e.g. clone_empty(..., bandas=1, data_type=gdal.GDT_UInt32).
+            If not given the labels are returned as an array.
+        :param out_band: Band of out.
+        :param background: Value of the pixels that are not part of any component.
+        :returns: The labels array (None if out is given) and a structured array with the label,
+            pixel count and pixel window (y0, y1, x0, x1) of each component.
+        """
+        return label_components(self, band, connectivity, out, out_band, background)
+
+    def clip(self, vector, out: Union[str, "RasterData"], crop: bool = True, all_touched: bool = False,
+             nodata: float = None) -> "RasterData":
+        """Clips this raster by a cutline, streaming block by block.
+
+        The cutline is rasterized only for the output blocks that intersect its bbox, the other
+        blocks are skipped and stay unallocated in the (sparse, tiled) output. An existing out
+        RasterData is written entirely, skipped blocks are filled with nodata.
+
+        :param vector: VectorData (all features of the first layer) or ogr.Geometry, reprojected
+            to this raster srs if it has another one.
+        :param out: Path of the new GeoTiff, or a RasterData with the output shape.
+        :param crop: Crop the output to the cutline window, otherwise it has the shape of this raster.
+        :param all_touched: Keep every pixel touched by the cutline, not only the ones with the center inside.
+        :param nodata: Value of the pixels outside the cutline, defaults to this raster nodata or 0.
+        :returns: The output RasterData.
+        """
+        # Importado aqui, raster_clip depende deste módulo.
+        from geodata.raster_clip import clip_raster
+        return clip_raster(self, vector, out, crop, all_touched, nodata)
+
+    def _get_async_handles(self) -> AsyncHandles:
+        if self._async_handles is None:
+            if self.src_image is None or self.write_enabled:
+                self._async_handles = AsyncHandles(self.gdal_dataset)
+            else:
+                self._async_handles = AsyncHandles(self.gdal_dataset,
+                                                   lambda: gdal.Open(self.src_image, gdal.GA_ReadOnly),
+                                                   self.async_concurrency)
+        return self._async_handles
+
+    async def read_window(self, y0, y1, x0, x1) -> np.ndarray:
+        """Async version of read_block_by_coordinates, the read runs in the geodata.aio executor."""
+        return await self._get_async_handles().run(self._read_window, y0, y1, x0, x1)
+
+    async def aiter_blocks(self, banda: int = 1, prefetch: int = 1) -> AsyncIterator[np.ndarray]:
+        """Async version of get_iterator.
+
+        :param banda: Banda da imagem para gerar o iterator.
+        :param prefetch: Number of blocks read ahead while the current block is consumed.
+        """
+        handles = self._get_async_handles()
+
+        def read_block(gdal_dataset: gdal.Dataset, block: tuple) -> np.ndarray:
+            with timed("raster.iterator_read", gdal=True) as section:
+                block_data = gdal_dataset.GetRasterBand(banda).ReadAsArray(*block)
+                section.n_bytes = block_data.nbytes
+            return block_data
+
+        pending = collections.deque()
+        blocks = iter(self.block_list)
+        try:
+            while True:
+                while len(pending) <= prefetch:
+                    block = next(blocks, None)
+                    if block is None:
+                        break
+                    pending.append(asyncio.ensure_future(handles.run(read_block, block)))
+                if not pending:
+                    return
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
 
     def set_srs(self, srs: Union[osr.SpatialReference, int, str]):
         """Set the spatial reference system for this instance."""
@@ -500,7 +907,7 @@ class RasterData:
 
         :param out_image:
         :param dst_srs:
-        :param memory: Use memory driver.
+        :param memory: Use memory driver (no size limit, see scratch.ScratchWorkspace for a memory budget).
         """
         # Ver docstring para mais opções.
         srs = create_osr_srs(dst_srs)
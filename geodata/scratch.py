@@ -0,0 +1,156 @@
+"""Scratch workspace for intermediate rasters, in /vsimem up to a memory budget and on disk beyond it."""
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from typing import Union
+
+from osgeo import gdal, osr
+
+from geodata.instrumentation import count, gdal_call
+from geodata.rasterdata import RasterData
+from geodata.srs_utils import create_osr_srs
+
+#: Default memory budget of a workspace, in bytes.
+DEFAULT_MEMORY_BUDGET = 512 * 1024 ** 2
+
+
+def raster_size(rows: int, cols: int, bands: int, data_type: int) -> int:
+    """Uncompressed size in bytes of a raster."""
+    return rows * cols * bands * max(gdal.GetDataTypeSize(data_type) // 8, 1)
+
+
+class ScratchWorkspace:
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, temp_dir: str = None, prefix: str = "geodata"):
+        """Creates intermediate rasters of a pipeline stage and frees all of them at the end.
+
+        Rasters go to /vsimem (GDAL in memory files) while the estimated uncompressed size of the
+        rasters in memory fits the budget, the next ones spill to a temporary directory on disk.
+        Unlike the MEM driver, the memory used is bounded.
+
+        with ScratchWorkspace(memory_budget=2 * 1024 ** 3) as workspace:
+            reprojected = workspace.reproject(raster, 4326)
+            mask = workspace.clone_empty(reprojected, bandas=1)
+            ...
+
+        :param memory_budget: Maximum bytes in /vsimem.
+        :param temp_dir: Parent of the spill directory, defaults to the system temporary directory.
+        :param prefix: Prefix of the file names.
+        """
+        self.memory_budget = memory_budget
+        self.temp_dir = temp_dir
+        self.prefix = prefix
+        self.used_memory = 0
+        self.memory_dir = "/vsimem/{}_{}".format(prefix, uuid.uuid4().hex)
+        self._spill_dir = None
+        self._files = {}
+        self._rasters = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ScratchWorkspace":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def new_path(self, n_bytes: int, suffix: str = ".tif") -> str:
+        """Reserves a path for a file of about n_bytes, in memory if it fits the budget."""
+        name = "{}_{}{}".format(self.prefix, uuid.uuid4().hex, suffix)
+        with self._lock:
+            if self.used_memory + n_bytes <= self.memory_budget:
+                path = "{}/{}".format(self.memory_dir, name)
+                self.used_memory += n_bytes
+                self._files[path] = n_bytes
+                count("scratch.memory")
+                return path
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix=self.prefix + "_", dir=self.temp_dir)
+            path = os.path.join(self._spill_dir, name)
+            self._files[path] = 0
+        count("scratch.spill")
+        return path
+
+    def is_in_memory(self, raster_data: RasterData) -> bool:
+        return (raster_data.src_image or "").startswith(self.memory_dir)
+
+    def _register(self, raster_data: RasterData) -> RasterData:
+        with self._lock:
+            self._rasters.append(raster_data)
+        return raster_data
+
+    def create(self, rows: int, cols: int, pixel_size: Union[int, float, tuple], xmin: float, ymax: float,
+               bands: int = 1, data_type=gdal.GDT_Float32) -> RasterData:
+        """Like RasterData.create, in the workspace."""
+        path = self.new_path(raster_size(rows, cols, bands, data_type))
+        return self._register(RasterData.create(path, rows, cols, pixel_size, xmin, ymax, bands, data_type))
+
+    def clone_empty(self, raster_data: RasterData, bandas: int = 0, data_type=gdal.GDT_Byte, **kwargs) -> RasterData:
+        """Like RasterData.clone_empty, in the workspace."""
+        n_bytes = raster_size(raster_data.rows, raster_data.cols, bandas or raster_data.n_channels, data_type)
+        path = self.new_path(n_bytes)
+        return self._register(raster_data.clone_empty(path, bandas, data_type, **kwargs))
+
+    def reproject(self, raster_data: RasterData, dst_srs: Union[osr.SpatialReference, int, str]) -> RasterData:
+        """Like RasterData.reproject, in the workspace. The output size is the one suggested by GDAL
+        (the same used by gdal.Warp), the size of the written file is accounted afterwards.
+        """
+        srs = create_osr_srs(dst_srs)
+        with gdal_call():
+            warped = gdal.AutoCreateWarpedVRT(raster_data.gdal_dataset, None, srs.ExportToWkt())
+        if warped is None:
+            raise RuntimeError("Can't reproject the raster: {}".format(raster_data.src_image))
+        data_type = raster_data.gdal_dataset.GetRasterBand(1).DataType
+        path = self.new_path(raster_size(warped.RasterYSize, warped.RasterXSize, raster_data.n_channels, data_type))
+        del warped
+        reprojected = raster_data.reproject(path, srs)
+        self._account(path)
+        return self._register(reprojected)
+
+    def _account(self, path: str) -> None:
+        """Replaces the reserved size of a file in memory by its real size."""
+        stat = gdal.VSIStatL(path) if path.startswith("/vsimem/") else None
+        if stat is None:
+            return
+        with self._lock:
+            if path in self._files:
+                self.used_memory += stat.size - self._files[path]
+                self._files[path] = stat.size
+
+    @staticmethod
+    def _close_raster(raster_data: RasterData) -> None:
+        # O arquivo só pode ser removido depois que o dataset for fechado, e não pode ser reaberto.
+        raster_data.close()
+
+    def _remove(self, path: str) -> None:
+        n_bytes = self._files.pop(path, 0)
+        if path.startswith("/vsimem/"):
+            gdal.Unlink(path)
+            self.used_memory -= n_bytes
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def release(self, raster_data: RasterData) -> None:
+        """Closes and deletes one raster of the workspace, freeing its share of the budget."""
+        with self._lock:
+            if raster_data.src_image not in self._files:
+                raise ValueError("Raster not created by this workspace: {}".format(raster_data.src_image))
+            self._rasters = [raster for raster in self._rasters if raster is not raster_data]
+            self._close_raster(raster_data)
+            self._remove(raster_data.src_image)
+
+    def close(self) -> None:
+        """Closes and deletes every raster of the workspace. The rasters can't be used afterwards."""
+        with self._lock:
+            for raster_data in self._rasters:
+                self._close_raster(raster_data)
+            self._rasters = []
+            for path in list(self._files):
+                self._remove(path)
+            # Arquivos auxiliares criados pelo gdal (.aux.xml, .ovr).
+            for name in gdal.ReadDir(self.memory_dir) or []:
+                gdal.Unlink("{}/{}".format(self.memory_dir, name))
+            if self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+            self.used_memory = 0
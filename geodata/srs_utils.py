@@ -3,7 +3,10 @@ from typing import Union
 
 from osgeo import osr
 
+from geodata.instrumentation import instrumented
 
+
+@instrumented("srs.create")
 def create_osr_srs(in_srs: Union[osr.SpatialReference, int, str]) -> osr.SpatialReference:
     """Creates an osr.SpatialReference object either from an EPSG code or a Wkt.
     If the srs is already an osr.SpatialReference, return a clone.
@@ -1,7 +1,9 @@
 # Pablo Carreira - 08/03/17
 import hashlib
 import os
-from collections import Iterator
+from collections.abc import Iterator
+
+import numpy as np
 
 from geodata.rasterdata import RasterData
 from geodata.srs_utils import create_osr_srs
@@ -86,6 +88,118 @@ def test_read_all():
     assert array.shape == (3, 400, 400)
 
 
+def test_extract_chips():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    ox, oy = source_raster.origem
+    ps = source_raster.pixel_size
+    # Two 10x10 px boxes, the second one partially out of the image.
+    bboxes = np.array([[ox + 20 * ps, oy - 30 * ps, ox + 30 * ps, oy - 20 * ps],
+                       [ox - 5 * ps, oy - 10 * ps, ox + 5 * ps, oy]])
+    chips = source_raster.extract_chips(bboxes, workers=2)
+    assert chips.shape == (2, 10, 10, 3)
+    expected = source_raster.read_block_by_coordinates(20, 30, 20, 30)
+    assert np.array_equal(chips[0], expected)
+    assert np.all(chips[1, :, :5] == 0)
+    assert np.array_equal(chips[1, :, 5:], source_raster.read_block_by_coordinates(0, 10, 0, 5))
+
+
+
+def test_get_bboxes_windows_numpy_size():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    ox, oy = source_raster.origem
+    ps = source_raster.pixel_size
+    bboxes = np.array([[ox + 20 * ps, oy - 30 * ps, ox + 30 * ps, oy - 20 * ps]])
+    windows = source_raster.get_bboxes_windows(bboxes, np.int32(6))
+    assert windows.tolist() == [[22, 22, 6, 6]]
+    assert np.array_equal(windows, source_raster.get_bboxes_windows(bboxes, 6))
+    assert source_raster.extract_chips(bboxes[:0], size=np.int64(6)).shape == (0, 6, 6, 3)
+
+def _sum_channels(block):
+    return block.sum(axis=2)
+
+
+def test_map_blocks_processes():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    result = source_raster.map_blocks_processes(_sum_channels, n_workers=2, out_dtype=np.float64)
+    assert result.shape == (400, 400, 1)
+    expected = source_raster.read_block_by_coordinates(0, 400, 0, 400).sum(axis=2)
+    assert np.array_equal(result[..., 0], expected)
+
+
+def test_get_valid_iterator():
+    source_raster = RasterData.create("MEM", 10, 20, 1, 0, 0, memoria=True)
+    band = source_raster.gdal_dataset.GetRasterBand(1)
+    band.SetNoDataValue(0)
+    data = np.zeros((10, 20), dtype=np.float32)
+    data[2:4, 2:4] = 1
+    band.WriteArray(data)
+    source_raster.block_size = [10, 10]
+    blocks = list(source_raster.get_valid_iterator())
+    # The second block is all nodata.
+    assert [block_index for block_index, _ in blocks] == [0]
+    assert blocks[0][1].count() == 4
+
+
+def test_clone_empty_sparse(tmp_path):
+    new_raster = raster_data.clone_empty(str(tmp_path / "imagem_sparse.tiff"), bandas=1, sparse=True, nodata=0)
+    assert new_raster.nodata == 0
+    assert new_raster.sparse_writes
+    block = new_raster.block_list[0]
+    new_raster.write_block(np.zeros((block[3], block[2]), dtype=np.uint8), 0)
+    assert new_raster.is_window_empty(block[1], block[1] + block[3], block[0], block[0] + block[2])
+    new_raster.write_block(np.ones((block[3], block[2]), dtype=np.uint8), 0)
+    assert not new_raster.is_window_empty(block[1], block[1] + block[3], block[0], block[0] + block[2])
+
+
+def test_lazy():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    lazy = source_raster.lazy()
+    assert lazy.shape == (400, 400, 3)
+    expected = source_raster.read_block_by_coordinates(0, 400, 0, 400)
+    assert np.array_equal(lazy[10:20, 5:50:5, 1], expected[10:20, 5:50:5, 1])
+    assert np.array_equal(lazy.max(axis=(0, 1)), expected.max(axis=(0, 1)))
+    assert np.allclose(lazy.mean(axis=2), expected.mean(axis=2))
+
+
+def test_lazy_strided():
+    from geodata.instrumentation import collect
+    source_raster = RasterData("tests/data/imagem.tiff")
+    lazy = source_raster.lazy()
+    expected = source_raster.read_block_by_coordinates(0, 400, 0, 400)
+    for key in [np.s_[::100, ::100], np.s_[390:3:-70, 5:50:5, 1], np.s_[3:200:2, ::-1], np.s_[::-1, 7, ::2]]:
+        assert np.array_equal(lazy[key], expected[key])
+    with collect() as stats:
+        lazy[::100, ::100]
+    # Só as linhas pedidas são lidas, não a janela inteira.
+    assert stats.as_dict()["raster.lazy_read"]["bytes"] == 4 * 301 * 3
+
+
+def test_aligned_block_iterator(tmp_path):
+    from geodata.raster_iterator import AlignedBlockIterator, common_window_size
+    source_raster = RasterData("tests/data/imagem.tiff")
+    out_raster = source_raster.clone_empty(str(tmp_path / "imagem_aligned.tiff"), bandas=1)
+    # Janela feita de blocos inteiros dos dois rasters: mmc dos blocos, limitado ao tamanho da imagem.
+    (source_x, source_y), (out_x, out_y) = source_raster.block_size, out_raster.block_size
+    expected_window = (min(np.lcm(source_y, out_y), source_raster.rows),
+                       min(np.lcm(source_x, out_x), source_raster.cols))
+    assert common_window_size([source_raster, out_raster]) == expected_window
+    iterator = AlignedBlockIterator([source_raster], [out_raster])
+    assert iterator.window_size == expected_window
+    for window in iterator:
+        window.write(window.data[0][:, :, 0])
+    assert np.array_equal(out_raster.read_all(), source_raster.read_all()[0])
+
+
+def test_pickle():
+    import pickle
+    source_raster = RasterData("tests/data/imagem.tiff")
+    restored = pickle.loads(pickle.dumps(source_raster))
+    assert restored._gdal_dataset is None
+    assert restored == source_raster
+    assert np.array_equal(restored.read_block_by_coordinates(0, 10, 0, 10),
+                          source_raster.read_block_by_coordinates(0, 10, 0, 10))
+
+
 if __name__ == '__main__':
     test_clone()
     # test_read_all()
@@ -0,0 +1,112 @@
+import asyncio
+import gc
+import threading
+
+import numpy as np
+from osgeo import ogr
+
+from geodata.aio import AsyncHandles
+from geodata.rasterdata import RasterData
+from geodata.vectordata import VectorData
+from geodata.vector_utils import GeometryArray, WKB_POINT
+
+
+def test_cancel_while_running():
+    handles = AsyncHandles("handle")
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow(handle):
+        started.set()
+        finish.wait(5)
+        return handle
+
+    async def main():
+        task = asyncio.create_task(handles.run(slow))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        # A chamada cancelada ainda usa o handle, o próximo pedido espera por ele.
+        second = asyncio.create_task(handles.run(lambda handle: handle))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+        finish.set()
+        return await second
+
+    assert asyncio.run(main()) == "handle"
+    assert handles._n_handles == 1
+
+
+def test_max_handles_across_loops():
+    opened = []
+    handles = AsyncHandles("first", lambda: opened.append(1) or "other", max_handles=2)
+    in_use = []
+    peak = []
+    lock = threading.Lock()
+
+    def read(handle):
+        with lock:
+            in_use.append(handle)
+            peak.append(len(in_use))
+        threading.Event().wait(0.01)
+        with lock:
+            in_use.remove(handle)
+
+    async def main():
+        await asyncio.gather(*[handles.run(read) for _ in range(10)])
+
+    threads = [threading.Thread(target=asyncio.run, args=(main(),)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
+    assert len(opened) == 1
+
+
+def test_semaphores_of_closed_loops():
+    handles = AsyncHandles("handle")
+    for _ in range(3):
+        assert asyncio.run(handles.run(lambda handle: handle)) == "handle"
+    gc.collect()
+    assert len(handles._semaphores) == 0
+
+
+def test_raster_read_window():
+    raster_data = RasterData("tests/data/imagem.tiff")
+    raster_data.async_concurrency = 2
+    windows = [(0, 10, 0, 10), (50, 120, 30, 400), (390, 400, 0, 400), (0, 400, 0, 400)]
+
+    async def main():
+        return await asyncio.gather(*[raster_data.read_window(*window) for window in windows])
+
+    for window, data in zip(windows, asyncio.run(main())):
+        assert np.array_equal(data, raster_data.read_block_by_coordinates(*window))
+
+
+def test_raster_aiter_blocks():
+    raster_data = RasterData("tests/data/imagem.tiff")
+
+    async def main():
+        return [block async for block in raster_data.aiter_blocks(banda=2, prefetch=2)]
+
+    blocks = asyncio.run(main())
+    expected = list(raster_data.get_iterator(banda=2))
+    assert len(blocks) == len(expected) == len(raster_data.block_list)
+    for block, expected_block in zip(blocks, expected):
+        assert np.array_equal(block, expected_block)
+
+
+def test_vector_aiter_features(tmp_path):
+    vector = VectorData.create(str(tmp_path / "points.gpkg"), "GPKG", srs=4326, geom_type=ogr.wkbPoint)
+    points = [[item, 2 * item] for item in range(5)]
+    vector.write_geometries(GeometryArray.from_lists(WKB_POINT, points), [{"ID": item} for item in range(5)])
+
+    async def main():
+        return [(feature.GetField("ID"), feature.GetGeometryRef().ExportToWkt())
+                async for feature in vector.aiter_features(batch_size=2)]
+
+    expected = [(feature.GetField("ID"), feature.GetGeometryRef().ExportToWkt())
+                for feature in vector.get_features_iterator()]
+    assert asyncio.run(main()) == expected
+    # Uma nova iteração recomeça do início.
+    assert asyncio.run(main()) == expected
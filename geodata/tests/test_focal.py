@@ -0,0 +1,47 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from geodata.focal import focal_filter, focal_max, focal_mean, focal_min, focal_median, hillshade
+from geodata.instrumentation import collect
+from geodata.rasterdata import RasterData
+
+
+def _reference(data, radius, function):
+    windows = sliding_window_view(data.astype(np.float64), (2 * radius + 1, 2 * radius + 1))
+    return function(windows, axis=(-2, -1))
+
+
+def test_focal_kernels():
+    data = np.random.RandomState(0).randint(0, 255, (30, 40)).astype(np.uint8)
+    assert np.allclose(focal_mean(data, 2), _reference(data, 2, np.mean))
+    assert np.array_equal(focal_min(data, 3), _reference(data, 3, np.min))
+    assert np.array_equal(focal_max(data, 1), _reference(data, 1, np.max))
+    assert np.array_equal(focal_median(data, 2), _reference(data, 2, np.median))
+
+
+def test_hillshade_flat():
+    assert np.allclose(hillshade(np.zeros((5, 5)), altitude=45), 255 * np.cos(np.radians(45)))
+
+
+def test_focal_filter_raster():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    result = focal_filter(source_raster, "max", radius=2)
+    data = source_raster.read_block_by_coordinates(0, 400, 0, 400)[:, :, 0]
+    expected = _reference(np.pad(data, 2, "symmetric"), 2, np.max)
+    assert np.array_equal(result, expected)
+
+
+def test_focal_bool_mask():
+    mask = np.random.RandomState(0).rand(30, 40) > 0.7
+    assert np.array_equal(focal_max(mask, 2), _reference(mask, 2, np.max).astype(bool))
+    assert np.array_equal(focal_min(mask, 1), _reference(mask, 1, np.min).astype(bool))
+
+
+def test_focal_reads_only_the_band():
+    source_raster = RasterData("tests/data/imagem.tiff")
+    with collect() as stats:
+        result = focal_filter(source_raster, "mean", radius=3, band=2)
+    # Cada strip nativo é lido uma vez e só da banda pedida.
+    assert stats.as_dict()["raster.read_block"]["bytes"] == 400 * 400
+    data = source_raster.read_block_by_coordinates(0, 400, 0, 400, bands=[2])[:, :, 0]
+    assert np.allclose(result, _reference(np.pad(data, 3, "symmetric"), 3, np.mean))
@@ -1,7 +1,9 @@
 # Pablo Carreira
+import pickle
+
 from osgeo import osr
 
-from geodata.geo_objects import BBox
+from geodata.geo_objects import BBox, RasterDefinition
 
 
 def test_bbox_as_ogr_geometry():
@@ -36,5 +38,25 @@ def test_bbox_transform_srs():
     assert int(b_utm22.xmax) == 802092
     assert int(b_utm22.ymax) == 7600000
 
+
+def test_bbox_pickle():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    bbox = BBox(1, 2, 3, 4, wkt_srs=srs.ExportToWkt())
+    restored = pickle.loads(pickle.dumps(bbox))
+    assert restored.as_tuple() == bbox.as_tuple()
+    assert restored.wkt_srs == bbox.wkt_srs
+
+
+def test_raster_definition_pickle():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    definition = RasterDefinition(10, 20, -48.5, -21.5, 0.001, -0.002, srs.ExportToWkt())
+    restored = pickle.loads(pickle.dumps(definition))
+    assert isinstance(restored, RasterDefinition)
+    for name in RasterDefinition.__slots__:
+        assert getattr(restored, name) == getattr(definition, name)
+
+
 if __name__ == '__main__':
     test_bbox_transform_srs()
@@ -0,0 +1,80 @@
+import threading
+
+import numpy as np
+
+from geodata.handle_pool import DatasetPool
+from geodata.rasterdata import RasterData
+
+
+def test_pool_per_thread_handles():
+    pool = DatasetPool(max_open=2)
+    raster = RasterData("tests/data/imagem.tiff", handle_pool=pool)
+    handles = []
+    thread = threading.Thread(target=lambda: handles.append(raster.gdal_dataset))
+    thread.start()
+    thread.join()
+    assert raster.gdal_dataset is raster.gdal_dataset
+    assert handles[0] is not raster.gdal_dataset
+    assert raster.read_block_by_coordinates(0, 10, 0, 10).shape == (10, 10, 3)
+
+
+def test_pool_eviction():
+    pool = DatasetPool(max_open=1)
+    first = pool.get("tests/data/imagem.tiff")
+    pool.get("tests/data/imagem_clone.tiff")
+    assert len(pool) == 1
+    assert pool.get("tests/data/imagem.tiff") is not first
+    assert pool.misses == 3
+
+
+def test_pool_read_after_eviction():
+    pool = DatasetPool(max_open=1)
+    raster = RasterData("tests/data/imagem.tiff", handle_pool=pool)
+    expected = raster.read_block_by_coordinates(0, 10, 0, 10)
+    pool.get("tests/data/imagem_clone.tiff")
+    assert len(pool) == 1
+    assert np.array_equal(raster.read_block_by_coordinates(0, 10, 0, 10), expected)
+
+
+def test_pool_evicts_other_threads():
+    pool = DatasetPool(max_open=2)
+    opened, done = threading.Event(), threading.Event()
+
+    def worker():
+        pool.get("tests/data/imagem.tiff")
+        pool.get("tests/data/imagem_clone.tiff")
+        opened.set()
+        done.wait()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    opened.wait()
+    try:
+        pool.get("tests/data/imagem_copy.tiff")
+        # O handle menos usado da outra thread é descartado, o que ela está usando fica.
+        assert len(pool) == 2
+        assert pool.get("tests/data/imagem_copy.tiff") is pool.get("tests/data/imagem_copy.tiff")
+        assert pool.misses == 3
+        keys = set(pool._handles)
+        assert ("tests/data/imagem_clone.tiff", thread.ident) in keys
+        assert ("tests/data/imagem.tiff", thread.ident) not in keys
+    finally:
+        done.set()
+        thread.join()
+
+
+def test_pool_short_lived_threads():
+    pool = DatasetPool(max_open=2)
+    for _ in range(6):
+        thread = threading.Thread(target=lambda: pool.get("tests/data/imagem.tiff"))
+        thread.start()
+        thread.join()
+        assert len(pool) <= pool.max_open
+    threads = [threading.Thread(target=lambda: pool.get("tests/data/imagem.tiff")) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.get("tests/data/imagem.tiff")
+    # Os handles das threads encerradas são descartados.
+    assert len(pool) <= pool.max_open
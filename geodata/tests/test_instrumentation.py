@@ -0,0 +1,51 @@
+import numpy as np
+
+from geodata import instrumentation
+from geodata.instrumentation import collect, count, gdal_call, instrumented
+
+
+@instrumented("test.read")
+def read_array():
+    with gdal_call():
+        array = np.zeros(10, dtype=np.uint8)
+    return array
+
+
+def test_collect():
+    with collect() as stats:
+        read_array()
+        read_array()
+        count("test.flush")
+    read_array()
+    result = stats.as_dict()
+    assert result["test.read"]["calls"] == 2
+    assert result["test.read"]["bytes"] == 20
+    assert result["test.read"]["gdal_seconds"] <= result["test.read"]["seconds"]
+    assert result["test.flush"]["calls"] == 1
+    assert not instrumentation.is_enabled()
+
+
+def test_callback():
+    events = []
+
+    def callback(event, calls, seconds, gdal_seconds, n_bytes):
+        events.append((event, n_bytes))
+
+    instrumentation.add_callback(callback)
+    try:
+        read_array()
+    finally:
+        instrumentation.remove_callback(callback)
+    read_array()
+    assert events == [("test.read", 10)]
+
+
+def test_disabled_is_a_flag_check(monkeypatch):
+    # Desabilitado, o wrapper só testa a flag e chama a função, sem criar seções nem registrar eventos.
+    def no_section(*args, **kwargs):
+        raise AssertionError("A section was created with instrumentation disabled")
+
+    monkeypatch.setattr(instrumentation, "_Section", no_section)
+    monkeypatch.setattr(instrumentation, "record", no_section)
+    assert not instrumentation.is_enabled()
+    assert read_array().nbytes == 10
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from osgeo import gdal, ogr, osr
+
+from geodata.rasterdata import RasterData
+from geodata.vectordata import VectorData
+
+
+@pytest.fixture
+def source_raster(tmp_path) -> RasterData:
+    raster = RasterData.create(str(tmp_path / "source.tif"), 600, 500, 10, -4800000, -2600000)
+    raster.set_srs(3857)
+    raster.write_all(np.arange(1, 600 * 500 + 1, dtype=np.float32).reshape((600, 500)))
+    return raster
+
+
+def _polygon(raster: RasterData, points) -> ogr.Geometry:
+    """Polygon from (row, col) image positions."""
+    ox, oy = raster.origem
+    size = raster.pixel_size
+    coordinates = ", ".join("{} {}".format(ox + col * size, oy - row * size) for row, col in points + points[:1])
+    return ogr.CreateGeometryFromWkt("POLYGON (({}))".format(coordinates))
+
+
+# Triângulo nas linhas 100 a 300 e colunas 50 a 150, nenhum centro de pixel fica sobre a hipotenusa.
+TRIANGLE = [(100, 50), (100, 150), (300, 50)]
+
+
+def _triangle_mask() -> np.ndarray:
+    rows, cols = np.mgrid[100:300, 50:150] + 0.5
+    return 2 * (cols - 50) + (rows - 100) <= 200
+
+
+def test_clip_crop(tmp_path, source_raster):
+    clipped = source_raster.clip(_polygon(source_raster, TRIANGLE), str(tmp_path / "clip.tif"), nodata=-1)
+    assert clipped.shape == (200, 100)
+    assert clipped.origem == (-4800000 + 50 * 10, -2600000 - 100 * 10)
+    assert clipped.nodata == -1
+    expected = np.where(_triangle_mask(), source_raster.read_block_by_coordinates(100, 300, 50, 150)[:, :, 0], -1)
+    assert np.array_equal(clipped.read_block_by_coordinates(0, 200, 0, 100)[:, :, 0], expected)
+
+
+def test_clip_all_touched(tmp_path, source_raster):
+    cutline = _polygon(source_raster, TRIANGLE)
+    centers = source_raster.clip(cutline, str(tmp_path / "centers.tif"), nodata=-1).read_all() != -1
+    touched = source_raster.clip(cutline, str(tmp_path / "touched.tif"), all_touched=True, nodata=-1).read_all() != -1
+    assert np.array_equal(centers, _triangle_mask())
+    assert (touched >= centers).all()
+    # Tocado pela hipotenusa, mas com o centro fora do triângulo.
+    assert touched[199, 0] and not centers[199, 0]
+
+
+def test_clip_reprojected_cutline(tmp_path, source_raster):
+    cutline = _polygon(source_raster, [(100.25, 50.25), (100.25, 149.75), (299.75, 149.75), (299.75, 50.25)])
+    expected = source_raster.clip(cutline, str(tmp_path / "expected.tif")).read_all()
+    mercator, geographic = osr.SpatialReference(), osr.SpatialReference()
+    mercator.ImportFromEPSG(3857)
+    geographic.ImportFromEPSG(4326)
+    for srs in (mercator, geographic):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    cutline.AssignSpatialReference(mercator)
+    cutline.TransformTo(geographic)
+    clipped = source_raster.clip(cutline, str(tmp_path / "clip.tif"))
+    assert np.array_equal(clipped.read_all(), expected)
+
+
+def test_clip_vector_data(tmp_path, source_raster):
+    cutline = _polygon(source_raster, TRIANGLE)
+    vector = VectorData.create(str(tmp_path / "cutline.gpkg"), "GPKG", srs=3857, geom_type=ogr.wkbPolygon)
+    vector.add_feature_to_layer(cutline, {"ID": 1})
+    expected = source_raster.clip(cutline, str(tmp_path / "expected.tif")).read_all()
+    assert np.array_equal(source_raster.clip(vector, str(tmp_path / "clip.tif")).read_all(), expected)
+
+
+def test_clip_skipped_blocks(tmp_path, source_raster):
+    cutline = _polygon(source_raster, [(10, 10), (10, 20), (20, 20), (20, 10)])
+    clipped = source_raster.clip(cutline, str(tmp_path / "clip.tif"), crop=False, nodata=-1)
+    assert clipped.shape == source_raster.shape
+    assert not clipped.is_window_empty(0, 256, 0, 256)
+    # Blocos fora da geometria não são alocados.
+    assert clipped.is_window_empty(256, 600, 256, 500)
+    assert (clipped.read_block_by_coordinates(256, 600, 256, 500) == -1).all()
+
+
+def test_clip_existing_out(tmp_path, source_raster):
+    out = source_raster.clone_empty(str(tmp_path / "out.tif"), data_type=gdal.GDT_Float32)
+    out.write_all(np.full(out.shape, 7, dtype=np.float32))
+    cutline = _polygon(source_raster, [(10, 10), (10, 20), (20, 20), (20, 10)])
+    source_raster.clip(cutline, out, crop=False, nodata=-1)
+    expected = np.full(out.shape, -1, dtype=np.float32)
+    expected[10:20, 10:20] = source_raster.read_block_by_coordinates(10, 20, 10, 20)[:, :, 0]
+    assert np.array_equal(out.read_all(), expected)
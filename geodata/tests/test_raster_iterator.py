@@ -0,0 +1,132 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from geodata.rasterdata import RasterData
+from geodata.raster_iterator import NNBatchBuilder, RasterBlock, RasterPaddingIterator
+from geodata.raster_utils import PAD_MODES
+
+
+@pytest.fixture
+def tiled_raster(tmp_path) -> RasterData:
+    """Copy of the test image with 256 x 64 blocks, two rows of blocks."""
+    source_raster = RasterData("tests/data/imagem.tiff")
+    raster = source_raster.clone_empty(str(tmp_path / "tiled.tiff"))
+    data = source_raster.read_all()
+    for channel in range(raster.n_channels):
+        raster.write_all(data[channel], channel + 1)
+    return raster
+
+
+@pytest.mark.parametrize("border_mode", PAD_MODES)
+def test_halo_reuse_same_blocks(tiled_raster, border_mode):
+    default = RasterPaddingIterator(tiled_raster, 20, border_mode=border_mode)
+    halo = RasterPaddingIterator(tiled_raster, 20, border_mode=border_mode, halo_reuse=True)
+    default_blocks = sorted(default, key=lambda block: block.block_index)
+    halo_blocks = list(halo)
+    assert len(halo_blocks) == len(default_blocks) == 14
+    for expected, block in zip(default_blocks, halo_blocks):
+        assert block.block_index == expected.block_index
+        assert block.valid_data_region == expected.valid_data_region
+        assert np.array_equal(block.block_data, expected.block_data)
+
+
+def _block(data: np.ndarray) -> RasterBlock:
+    rows, cols = data.shape[:2]
+    return RasterBlock(data, [0, rows, 0, cols], [0, rows, 0, cols], (0, 0))
+
+
+def test_nn_batch_builder_default():
+    data = np.random.default_rng(0).integers(0, 256, (2, 8, 6, 3), dtype=np.uint8)
+    builder = NNBatchBuilder(4, 3, (8, 6))
+    batch = builder.build([_block(block) for block in data])
+    assert batch.shape == (2, 3, 8, 6)
+    for position, block in enumerate(data):
+        assert np.allclose(batch[position], _block(block).nn_data[0])
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float16])
+def test_nn_batch_builder_statistics(dtype):
+    # Valores acima do máximo do float16 (65504), a normalização não pode estourar.
+    data = np.random.default_rng(0).integers(60000, 65536, (8, 6, 2)).astype(np.uint16)
+    mean, std = np.array([62767.5, 1234.5]), np.array([1000.0, 3.0])
+    batch = NNBatchBuilder(1, 2, (8, 6), dtype, mean=mean, std=std).build([_block(data)])
+    expected = (np.moveaxis(data, -1, 0) - mean[:, np.newaxis, np.newaxis]) / std[:, np.newaxis, np.newaxis]
+    assert batch.dtype == dtype
+    assert np.allclose(batch[0], expected, rtol=1e-3)
+
+    minimum, maximum = np.array([60000, 0]), np.array([65535, 65535])
+    batch = NNBatchBuilder(1, 2, (8, 6), dtype, minimum=minimum, maximum=maximum).build([_block(data)])
+    expected = (np.moveaxis(data, -1, 0) - minimum[:, np.newaxis, np.newaxis]) / \
+        (maximum - minimum)[:, np.newaxis, np.newaxis]
+    assert np.allclose(batch[0], expected, rtol=1e-3, atol=1e-3)
+
+
+def test_first_block_not_skipped(tiled_raster):
+    iterator = RasterPaddingIterator(tiled_raster, 20)
+    blocks = [block.block_index for block in iterator]
+    assert blocks[0] == tuple(iterator.block_indices[0])
+    assert sorted(blocks) == sorted(tuple(index) for index in iterator.block_indices)
+    assert len(blocks) == len(iterator) == 14
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_shards_cover_blocks(tiled_raster, shuffle):
+    shards = []
+    for rank in range(2):
+        for worker_id in range(2):
+            iterator = RasterPaddingIterator(tiled_raster, 0, shuffle=shuffle, seed=3, rank=rank, world_size=2)
+            iterator.set_worker(worker_id, 2)
+            blocks = [block.block_index for block in iterator]
+            assert blocks == [tuple(index) for index in iterator.epoch_block_indices()]
+            shards.append(blocks)
+    all_blocks = [index for shard in shards for index in shard]
+    assert len(all_blocks) == len(set(all_blocks)) == 14
+
+
+def test_shuffle_seed(tiled_raster):
+    def epoch_order(seed, epoch):
+        iterator = RasterPaddingIterator(tiled_raster, 0, shuffle=True, seed=seed)
+        iterator.set_epoch(epoch)
+        return [tuple(index) for index in iterator.epoch_block_indices()]
+
+    assert epoch_order(3, 0) == epoch_order(3, 0)
+    assert epoch_order(3, 1) == epoch_order(3, 1)
+    assert epoch_order(3, 0) != epoch_order(3, 1)
+    assert epoch_order(3, 0) != epoch_order(4, 0)
+    assert sorted(epoch_order(3, 0)) == sorted(epoch_order(4, 0))
+
+
+def test_load_state_dict_resumes(tiled_raster):
+    iterator = RasterPaddingIterator(tiled_raster, 0, shuffle=True, seed=3, infinite=True)
+    iterator.set_epoch(2)
+    for _ in range(5):
+        next(iterator)
+    state = iterator.state_dict()
+    expected = [next(iterator).block_index for _ in range(12)]
+
+    resumed = RasterPaddingIterator(tiled_raster, 0, shuffle=True, infinite=True)
+    resumed.load_state_dict(state)
+    assert [next(resumed).block_index for _ in range(12)] == expected
+    # A época termina e a próxima começa com uma nova ordem.
+    assert resumed.epoch == 3
+
+
+def test_raster_block_pickle_out_of_band():
+    data = np.arange(2 * 64 * 48 * 3, dtype=np.uint16).reshape((2, 64, 48, 3))
+    # Um bloco contíguo e uma view com passo, que é copiada para um array contíguo.
+    for block_data, shares_memory in ((data[0], True), (data[1, :, ::2], False)):
+        block = RasterBlock(block_data, [1, 63, 0, 48], np.array([0, 64, 0, 48]), (1, 2), nodata=0)
+        buffers = []
+        dumped = pickle.dumps(block, protocol=5, buffer_callback=buffers.append)
+        # Os arrays (dados e coordenadas) vão fora da banda, não no fluxo do pickle.
+        assert len(buffers) == 2
+        assert len(dumped) < block_data.nbytes
+        restored = pickle.loads(dumped, buffers=buffers)
+        assert np.array_equal(restored.block_data, block_data)
+        assert restored.block_data.dtype == block_data.dtype
+        assert np.shares_memory(restored.block_data, block_data) == shares_memory
+        assert restored.valid_data_region == block.valid_data_region
+        assert np.array_equal(restored.original_block_coordinates, block.original_block_coordinates)
+        assert restored.block_index == (1, 2) and restored.nodata == 0
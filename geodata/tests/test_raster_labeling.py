@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from geodata.rasterdata import RasterData
+from geodata.raster_labeling import _label_numpy
+
+
+def test_label_numpy():
+    mask = np.array([[1, 0, 1],
+                     [0, 1, 0],
+                     [1, 0, 0]], dtype=bool)
+    assert _label_numpy(mask, 4)[1] == 4
+    labels, n_labels = _label_numpy(mask, 8)
+    assert n_labels == 1
+    assert np.all(labels[mask] == 1)
+
+
+def test_label_components_across_blocks():
+    data = np.zeros((20, 20), dtype=np.uint8)
+    data[2:18, 9:11] = 1  # Crosses the block seams.
+    data[0, 0] = 1
+    raster = RasterData.create("MEM", 20, 20, 1, 0, 0, data_type=1, memoria=True)
+    raster.gdal_dataset.GetRasterBand(1).WriteArray(data)
+    raster.block_size = [10, 10]
+    labels, stats = raster.label_components(connectivity=4)
+    assert len(stats) == 2
+    assert labels[0, 0] == 1 and labels[2, 9] == 2
+    assert stats[1]["count"] == 32
+    assert (stats[1]["y0"], stats[1]["y1"], stats[1]["x0"], stats[1]["x1"]) == (2, 18, 9, 11)
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+def test_label_components_matches_whole_image(connectivity):
+    data = (np.random.default_rng(0).random((37, 45)) > 0.55).astype(np.uint8)
+    raster = RasterData.create("MEM", 37, 45, 1, 0, 0, data_type=1, memoria=True)
+    raster.gdal_dataset.GetRasterBand(1).WriteArray(data)
+    raster.block_size = [10, 8]
+    labels, stats = raster.label_components(connectivity=connectivity)
+    expected, n_labels = _label_numpy(data.astype(bool), connectivity)
+    assert len(stats) == n_labels
+    # Mesma partição: cada componente esperado corresponde a exatamente um rótulo e vice-versa.
+    pairs = np.unique(np.stack((expected[data > 0], labels[data > 0])), axis=1)
+    assert pairs.shape[1] == n_labels
+    assert len(np.unique(pairs[1])) == n_labels
+    assert (labels[data == 0] == 0).all()
+    assert stats["count"].sum() == data.sum()
@@ -0,0 +1,76 @@
+import gc
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from geodata.rasterdata import RasterData
+from geodata.raster_iterator import RasterPaddingIterator
+from geodata.raster_loader import PrefetchingLoader
+
+
+@pytest.fixture
+def iterator() -> RasterPaddingIterator:
+    return RasterPaddingIterator(RasterData("tests/data/imagem.tiff"), 10, shuffle=True, seed=1)
+
+
+def _assert_same_blocks(blocks, expected_blocks):
+    assert len(blocks) == len(expected_blocks)
+    for block, expected in zip(blocks, expected_blocks):
+        assert block.block_index == expected.block_index
+        assert block.valid_data_region == expected.valid_data_region
+        assert np.array_equal(block.original_block_coordinates, expected.original_block_coordinates)
+        assert np.array_equal(block.block_data, expected.block_data)
+
+
+def test_loader_same_blocks(iterator):
+    expected = list(iterator)
+    iterator.set_epoch(0)
+    with PrefetchingLoader(iterator, n_workers=2, prefetch=3) as loader:
+        assert len(loader) == len(expected)
+        _assert_same_blocks(list(loader), expected)
+
+        blocks = list(PrefetchingLoader(iterator, n_workers=2, prefetch=3, ordered=False))
+        _assert_same_blocks(sorted(blocks, key=lambda block: block.block_index),
+                            sorted(expected, key=lambda block: block.block_index))
+
+        batches = list(PrefetchingLoader(iterator, n_workers=2, batch_size=4))
+        assert [len(batch) for batch in batches] == [4, 3]
+        _assert_same_blocks([block for batch in batches for block in batch], expected)
+
+
+def _assert_released(workers, slots_name):
+    assert not any(worker.is_alive() for worker in workers)
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=slots_name)
+
+
+def test_loader_close(iterator):
+    loader = PrefetchingLoader(iterator, n_workers=2, prefetch=2)
+    blocks = iter(loader)
+    next(blocks)
+    workers, slots_name = list(loader._workers), loader._slots.name
+    assert all(worker.is_alive() for worker in workers)
+    loader.close()
+    _assert_released(workers, slots_name)
+    loader.close()
+    assert loader._workers == [] and loader._slots is None
+
+
+def test_loader_del(iterator):
+    loader = PrefetchingLoader(iterator, n_workers=2, prefetch=2)
+    blocks = iter(loader)
+    next(blocks)
+    workers, slots_name = list(loader._workers), loader._slots.name
+    del loader, blocks
+    gc.collect()
+    _assert_released(workers, slots_name)
+
+
+def test_loader_worker_error():
+    # O modo de borda só é usado (e validado) pelos processos ao preencher o padding.
+    iterator = RasterPaddingIterator(RasterData("tests/data/imagem.tiff"), 10, border_mode="nope")
+    loader = PrefetchingLoader(iterator, n_workers=2)
+    with pytest.raises(RuntimeError, match="Border mode"):
+        list(loader)
+    assert loader._workers == [] and loader._slots is None
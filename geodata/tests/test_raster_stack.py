@@ -0,0 +1,30 @@
+import numpy as np
+
+from geodata.rasterdata import RasterData
+from geodata.raster_stack import RasterStack
+
+
+def _memory_raster(data: np.ndarray, nodata: float = None) -> RasterData:
+    raster = RasterData.create("MEM", data.shape[0], data.shape[1], 1, 0, 0, memoria=True)
+    raster.set_srs(4326)
+    band = raster.gdal_dataset.GetRasterBand(1)
+    if nodata is not None:
+        band.SetNoDataValue(nodata)
+    band.WriteArray(data)
+    return raster
+
+
+def test_raster_stack_reductions():
+    layers = [np.full((20, 30), value, dtype=np.float32) for value in (1, 2, 4)]
+    layers[2][0, 0] = -1
+    stack = RasterStack([_memory_raster(layer, nodata=-1) for layer in layers], times=[0, 1, 2],
+                        max_memory=3 * 8 * 30 * 4)
+    assert stack.window_size == (4, 30)
+    median = stack.median()
+    assert median[0, 0] == 1.5
+    assert median[5, 5] == 2
+    assert stack.count_valid()[0, 0] == 2
+    assert np.isclose(stack.trend()[5, 5], 1.5)
+    out = _memory_raster(np.zeros((20, 30), dtype=np.float32))
+    stack.percentile(100, out=out)
+    assert out.read_all()[5, 5] == 4
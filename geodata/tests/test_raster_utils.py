@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from geodata.raster_utils import pad_block_into, mirror_block, ArraySampler, PAD_MODES, MIRROR_TOP, MIRROR_RIGHT, \
+    SAMPLER_RATIO_METHOD
+
+
+@pytest.mark.parametrize("mode", PAD_MODES)
+def test_pad_block_into(mode):
+    block = np.arange(5 * 4 * 3).reshape((5, 4, 3))
+    out = np.empty((5 + 3 + 7, 4 + 2 + 6, 3), dtype=block.dtype)
+    pad_block_into(out, block, 3, 2, mode, constant_value=-1)
+    kwargs = {"constant_values": -1} if mode == "constant" else {}
+    assert np.array_equal(out, np.pad(block, ((3, 7), (2, 6), (0, 0)), mode=mode, **kwargs))
+
+
+def test_mirror_block():
+    block = np.arange(20).reshape((5, 4))
+    assert np.array_equal(mirror_block(block, 2, MIRROR_TOP), np.vstack((np.flipud(block[:2]), block)))
+    assert np.array_equal(mirror_block(block, 3, MIRROR_RIGHT), np.hstack((block, np.fliplr(block[:, -3:]))))
+
+
+def test_array_sampler():
+    sampler = ArraySampler(SAMPLER_RATIO_METHOD, ratio=0.3)
+    indices = [(row, col) for row in range(40) for col in range(50)]
+    selected, not_selected = sampler.sample(indices)
+    assert (len(selected), len(not_selected)) == sampler.predict_samples_sizes((400, 500), (10, 10))
+    assert set(selected).isdisjoint(not_selected)
+    assert set(selected) | set(not_selected) == set(indices)
+    assert sampler.sample(indices)[0] == selected
+
+
+def test_array_sampler_stratified():
+    sampler = ArraySampler(SAMPLER_RATIO_METHOD, ratio=0.5)
+    labels = np.array([0] * 10 + [1] * 6)
+    selected, not_selected = sampler.stratified_sample(np.arange(16), labels)
+    assert len(selected) == 8
+    assert np.sum(selected < 10) == 5
+
+
+def test_array_sampler_spatial_split():
+    sampler = ArraySampler(SAMPLER_RATIO_METHOD, ratio=0.3)
+    indices = [(row, col) for row in range(20) for col in range(20)]
+    selected, not_selected = sampler.spatial_split(indices, group_size=4, buffer=1)
+    selected = set(selected)
+    for row, col in not_selected:
+        assert all((row + dy, col + dx) not in selected for dy in (-1, 0, 1) for dx in (-1, 0, 1))
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from osgeo import gdal
+
+from geodata.rasterdata import RasterData
+from geodata.raster_iterator import RasterPaddingIterator
+from geodata.raster_writer import BLEND_COSINE, BLEND_GAUSSIAN, BLEND_UNIFORM, OverlapBlendWriter, blend_weights
+
+
+def test_blend_weights():
+    assert np.array_equal(blend_weights((4, 6), BLEND_UNIFORM), np.ones((4, 6)))
+    for method in (BLEND_COSINE, BLEND_GAUSSIAN):
+        weights = blend_weights((8, 10), method)
+        assert weights.shape == (8, 10)
+        assert (weights > 0).all()
+        # Simétrico e maior no centro.
+        assert np.allclose(weights, weights[::-1, ::-1])
+        assert weights[4, 5] > weights[0, 5] > weights[0, 0]
+    with pytest.raises(ValueError):
+        blend_weights((4, 4), "linear")
+
+
+@pytest.mark.parametrize("method", [BLEND_UNIFORM, BLEND_COSINE])
+def test_overlap_blend_identity(tmp_path, method):
+    source_raster = RasterData("tests/data/imagem.tiff")
+    out_raster = source_raster.clone_empty(str(tmp_path / "blend.tiff"), data_type=gdal.GDT_Float32)
+    iterator = RasterPaddingIterator(source_raster, 16, halo_reuse=True)
+    with OverlapBlendWriter(out_raster, iterator, method) as writer:
+        for block in iterator:
+            writer.add(block, block.block_data.astype(np.float32))
+    expected = source_raster.read_block_by_coordinates(0, source_raster.rows, 0, source_raster.cols)
+    assert np.allclose(out_raster.read_block_by_coordinates(0, source_raster.rows, 0, source_raster.cols), expected)
+
+
+def test_overlap_blend_out_of_order(tmp_path):
+    # Clone com blocos de 256 x 64, duas linhas de blocos.
+    source_raster = RasterData("tests/data/imagem.tiff").clone_empty(str(tmp_path / "tiled.tiff"))
+    out_raster = source_raster.clone_empty(str(tmp_path / "blend.tiff"), data_type=gdal.GDT_Float32)
+    iterator = RasterPaddingIterator(source_raster, 16)
+    writer = OverlapBlendWriter(out_raster, iterator)
+    second_row = iterator.read_block(1, 0)
+    writer.add(second_row, second_row.block_data.astype(np.float32))
+    first_row = iterator.read_block(0, 0)
+    with pytest.raises(ValueError):
+        writer.add(first_row, first_row.block_data.astype(np.float32))
+
+
+def test_window_origin_large_offsets():
+    # Blocos de uma linha, offsets acima de 65535.
+    raster = RasterData.create("", 70000, 1, 1, 0, 70000, memoria=True)
+    iterator = RasterPaddingIterator(raster, 0)
+    assert iterator.window_origin(69999, 0) == (69999, 0)
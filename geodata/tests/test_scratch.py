@@ -0,0 +1,52 @@
+import os
+
+import pytest
+from osgeo import gdal
+
+from geodata.rasterdata import RasterData
+from geodata.scratch import ScratchWorkspace
+
+
+def test_scratch_workspace_spill():
+    with ScratchWorkspace(memory_budget=10 * 10 * 4) as workspace:
+        in_memory = workspace.create(10, 10, 1, 0, 10)
+        on_disk = workspace.create(10, 10, 1, 0, 10)
+        assert workspace.is_in_memory(in_memory)
+        assert not workspace.is_in_memory(on_disk)
+        assert workspace.used_memory == 400
+        paths = in_memory.src_image, on_disk.src_image
+        workspace.release(in_memory)
+        assert workspace.used_memory == 0
+        assert gdal.VSIStatL(paths[0]) is None
+    assert not os.path.exists(paths[1])
+
+
+def test_scratch_release_foreign_raster():
+    raster_data = RasterData("tests/data/imagem.tiff")
+    with ScratchWorkspace() as workspace:
+        with pytest.raises(ValueError):
+            workspace.release(raster_data)
+    assert os.path.exists("tests/data/imagem.tiff")
+
+
+def test_scratch_released_raster_not_reopened():
+    with ScratchWorkspace() as workspace:
+        raster_data = workspace.create(10, 10, 1, 0, 10)
+        closed = workspace.create(10, 10, 1, 0, 10)
+        workspace.release(raster_data)
+        with pytest.raises(ValueError):
+            raster_data.read_all()
+    with pytest.raises(ValueError):
+        closed.read_all()
+    assert gdal.VSIStatL(closed.src_image) is None
+
+
+def test_scratch_reproject_real_size():
+    with ScratchWorkspace() as workspace:
+        source = workspace.create(100, 200, 1000, -2000000, 1000000)
+        source.set_srs(3857)
+        source_bytes = workspace.used_memory
+        reprojected = workspace.reproject(source, 4326)
+        assert workspace.is_in_memory(reprojected)
+        # O orçamento conta o arquivo escrito, não o tamanho da origem.
+        assert workspace.used_memory == source_bytes + gdal.VSIStatL(reprojected.src_image).size
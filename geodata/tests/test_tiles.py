@@ -0,0 +1,108 @@
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+
+from geodata.geo_objects import BBox
+from geodata.instrumentation import collect
+from geodata.rasterdata import RasterData
+from geodata.tiles import (DiskTileCache, MemoryTileCache, TileRenderer, create_tile_server, tile_bounds,
+                           tiles_range, WEB_MERCATOR_ORIGIN)
+
+
+@pytest.fixture
+def mercator_raster(tmp_path) -> RasterData:
+    """Covers exactly the tile 1/0/0 with 512 x 512 pixels, 0 on the left half and 200 on the right."""
+    raster = RasterData.create(str(tmp_path / "mercator.tif"), 512, 512, WEB_MERCATOR_ORIGIN / 512,
+                               -WEB_MERCATOR_ORIGIN, WEB_MERCATOR_ORIGIN, data_type=1)
+    raster.set_srs(3857)
+    data = np.zeros((512, 512), dtype=np.uint8)
+    data[:, 256:] = 200
+    raster.write_all(data)
+    return raster
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0) == (-WEB_MERCATOR_ORIGIN, -WEB_MERCATOR_ORIGIN, WEB_MERCATOR_ORIGIN, WEB_MERCATOR_ORIGIN)
+    xmin, ymin, xmax, ymax = tile_bounds(1, 1, 0)
+    assert (xmin, ymin, xmax, ymax) == (0, 0, WEB_MERCATOR_ORIGIN, WEB_MERCATOR_ORIGIN)
+
+
+def test_tiles_range():
+    bbox = BBox(-10, -10, 10, 10)
+    assert tiles_range(bbox, 0) == (0, 0, 0, 0)
+    assert tiles_range(bbox, 1) == (0, 0, 1, 1)
+    assert tiles_range(BBox(1, 1, 10, 10), 1) == (1, 0, 1, 0)
+
+
+def test_memory_tile_cache_eviction():
+    cache = MemoryTileCache(max_tiles=2)
+    cache.put((0, 0, 0), b"a")
+    cache.put((1, 0, 0), b"b")
+    cache.get((0, 0, 0))
+    cache.put((1, 1, 0), b"c")
+    assert (1, 0, 0) not in cache
+    assert cache.get((0, 0, 0)) == b"a"
+    assert len(cache) == 2
+
+
+def test_render(mercator_raster):
+    renderer = TileRenderer(mercator_raster, stretch=(0, 200), nodata=0, resampling="average")
+    rgba = renderer.render_array(1, 0, 0)
+    assert rgba.shape == (4, 256, 256)
+    assert (rgba[:3, :, 128:] == 255).all()
+    assert (rgba[3, :, :128] == 0).all() and (rgba[3, :, 128:] == 255).all()
+    assert renderer.render(1, 0, 0).startswith(b"\x89PNG")
+    for key in [(1, 2, 0), (1, 0, -1), (-1, 0, 0), (31, 0, 0)]:
+        with pytest.raises(IndexError):
+            renderer.render(*key)
+
+
+def test_disk_tile_cache(tmp_path, mercator_raster):
+    cache = DiskTileCache(str(tmp_path / "cache"), max_bytes=10)
+    renderer = TileRenderer(mercator_raster, stretch=(0, 200), cache=cache)
+    with collect() as stats:
+        data = renderer.render(1, 0, 0)
+        assert renderer.render(1, 0, 0) == data
+    assert stats.as_dict()["tiles.cache_hit"]["calls"] == 1
+    with open(cache.tile_path((1, 0, 0)), "rb") as tile_file:
+        assert tile_file.read() == data
+    # O índice é reconstruído a partir dos arquivos.
+    assert (1, 0, 0) in DiskTileCache(str(tmp_path / "cache"))
+
+    cache.put((1, 1, 0), b"12345678")
+    # max_bytes excedido, o tile mais antigo é removido.
+    assert (1, 0, 0) not in cache and cache.get((1, 0, 0)) is None
+    assert cache.get((1, 1, 0)) == b"12345678"
+    renderer.invalidate()
+    assert len(cache) == 0
+
+
+def test_tile_server(mercator_raster):
+    renderer = TileRenderer(mercator_raster, stretch=(0, 200))
+    server = create_tile_server(renderer)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:{}/".format(server.server_address[1])
+    try:
+        with urllib.request.urlopen(url + "1/0/0.png") as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"] == "image/png"
+            assert response.read() == renderer.render(1, 0, 0)
+        for path, status in [("1/2/0.png", 404), ("nope", 404)]:
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(url + path)
+            assert error.value.code == status
+
+        def fail(*args):
+            raise RuntimeError("render error")
+
+        renderer.render_array = fail
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + "1/1/0.png")
+        assert error.value.code == 500
+    finally:
+        server.shutdown()
+        server.server_close()
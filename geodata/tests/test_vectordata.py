@@ -1,27 +1,31 @@
 # Pablo Carreira - 22/06/17
 import os
-from tempfile import NamedTemporaryFile
+import types
+from pathlib import Path
+from tempfile import mkdtemp
 
-import ogr
-from vectordata import VectorData
+import numpy as np
+import pytest
+from osgeo import ogr
 
-from geodata.vector_utils import create_ogr_linestring_from_list
+from geodata.instrumentation import collect
+from geodata.vectordata import VectorData
+from geodata.vector_utils import GeometryArray, WKB_POLYGON, create_ogr_geom, create_ogr_linestring_from_list
 
+POLYGONS = [[[[0, 0], [1, 0], [1, 1], [0, 0]]],
+            [[[0, 0], [2, 0], [2, 2], [0, 0]], [[1, 1], [1, 2], [2, 2], [1, 1]]]]
 
-def test_create_vectordata_gpkg():
-    src_file = "/home/pablo/Desktop/geo_array/tests/data/vector.gpkg"
-    try:
-        os.remove(src_file)
-    except FileNotFoundError:
-        pass
-    vector = VectorData(src_file, "GPKG", srs=4326, overwrite=True)
+
+def test_create_vectordata_gpkg(tmp_path):
+    src_file = str(tmp_path / "vector.gpkg")
+    vector = VectorData.create(src_file, "GPKG", srs=4326, overwrite=True)
     assert os.path.isfile(src_file)
 
 
-def test_create_vectordata_shape():
-    with NamedTemporaryFile() as tf:
-        vector = VectorData.create(tf, "ESRI Shapefile", srs=4326, overwrite=True)
-        assert os.path.isfile(tf)
+def test_create_vectordata_shape(tmp_path):
+    src_file = str(tmp_path / "vector.shp")
+    vector = VectorData.create(src_file, "ESRI Shapefile", srs=4326, overwrite=True)
+    assert os.path.isfile(src_file)
 
 
 def test_create_ogr_linestring():
@@ -30,6 +34,62 @@ def test_create_ogr_linestring():
     assert isinstance(geom, ogr.Geometry)
 
 
+def test_geometry_array_wkb():
+    geometries = GeometryArray.from_lists(WKB_POLYGON, POLYGONS)
+    wkbs = geometries.to_wkb_list()
+    assert ogr.CreateGeometryFromWkb(wkbs[1]).GetGeometryCount() == 2
+    decoded = GeometryArray.from_wkb([ogr.CreateGeometryFromWkb(wkb).ExportToWkb() for wkb in wkbs])
+    assert (decoded.coords == geometries.coords).all()
+    assert (decoded.ring_offsets == geometries.ring_offsets).all()
+
+
+def test_create_ogr_geom_bytes_like():
+    wkb = ogr.CreateGeometryFromWkt("POINT (1 2)").ExportToWkb()
+    for geom in (wkb, bytearray(wkb), memoryview(wkb), np.frombuffer(wkb, dtype=np.uint8)):
+        assert create_ogr_geom(geom).ExportToWkb() == wkb
+    assert create_ogr_geom("POINT (1 2)").ExportToWkb() == wkb
+    with pytest.raises(TypeError):
+        create_ogr_geom(1)
+
+
+def test_read_write_geometries(tmp_path):
+    vector = VectorData.create(str(tmp_path / "polygons.gpkg"), "GPKG", srs=4326, geom_type=ogr.wkbPolygon)
+    assert len(vector.read_geometries()) == 0
+    assert vector.read_geometries().geom_type == WKB_POLYGON
+    vector.write_geometries(GeometryArray.from_lists(WKB_POLYGON, POLYGONS), [{"ID": 1}, {"ID": 2}])
+    geometries = vector.read_geometries()
+    assert (geometries.coords == GeometryArray.from_lists(WKB_POLYGON, POLYGONS).coords).all()
+    assert list(geometries.geom_offsets) == [0, 1, 3]
+    assert [feature.GetField("ID") for feature in vector.get_features_iterator()] == [1, 2]
+
+
+def test_write_geometries_rollback(tmp_path):
+    vector = VectorData.create(str(tmp_path / "polygons.gpkg"), "GPKG", srs=4326, geom_type=ogr.wkbPolygon)
+    with pytest.raises(KeyError):
+        vector.write_geometries(GeometryArray.from_lists(WKB_POLYGON, POLYGONS), [{"ID": 1}, {"NOPE": 2}])
+    assert vector.get_layer().GetFeatureCount() == 0
+
+
+def test_read_geometries_without_geometry(tmp_path):
+    vector = VectorData.create(str(tmp_path / "polygons.gpkg"), "GPKG", srs=4326, geom_type=ogr.wkbPolygon)
+    vector.add_feature_to_layer(None, {"ID": 1})
+    with pytest.raises(ValueError):
+        vector.read_geometries()
+
+
+def test_features_iterator_instrumented(tmp_path):
+    vector = VectorData.create(str(tmp_path / "polygons.gpkg"), "GPKG", srs=4326, geom_type=ogr.wkbPolygon)
+    vector.write_geometries(GeometryArray.from_lists(WKB_POLYGON, POLYGONS), [{"ID": 1}, {"ID": 2}])
+    assert isinstance(vector.get_features_iterator(), ogr.Layer)
+    assert [feature.GetField("ID") for feature in vector.iter_features()] == [1, 2]
+    with collect() as stats:
+        assert isinstance(vector.get_features_iterator(), ogr.Layer)
+        features = vector.iter_features()
+        assert isinstance(features, types.GeneratorType)
+        assert [feature.GetField("ID") for feature in features] == [1, 2]
+    assert stats.as_dict()["vector.read_feature"]["calls"] == 3
+
+
 # def test_create_srs():
 #     srs_string = 'PROJCS["WGS 84 / UTM zone 23S",GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433],AUTHORITY["EPSG","4326"]],PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",0],PARAMETER["central_meridian",-45],PARAMETER["scale_factor",0.9996],PARAMETER["false_easting",500000],PARAMETER["false_northing",10000000],UNIT["metre",1,AUTHORITY["EPSG","9001"]],AUTHORITY["EPSG","32723"]]'
 #     srs = osr.SpatialReference()
@@ -38,6 +98,6 @@ def test_create_ogr_linestring():
 
 
 if __name__ == '__main__':
-    test_create_vectordata_shape()
+    test_create_vectordata_shape(Path(mkdtemp()))
     # test_create_srs()
     # test_create_ogr_linestring()
\ No newline at end of file
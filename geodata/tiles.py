@@ -0,0 +1,468 @@
+"""Web mercator XYZ tile rendering for RasterData.
+
+Tiles follow the XYZ (Google/OSM/Leaflet) scheme: EPSG:3857, origin at the top left
+corner and ``y`` growing to the south.
+"""
+import math
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from osgeo import gdal
+
+from geodata.geo_objects import BBox
+from geodata.instrumentation import count, gdal_call, instrumented, timed
+from geodata.rasterdata import RasterData
+from geodata.srs_utils import create_osr_srs
+
+WEB_MERCATOR_EPSG = 3857
+#: Half of the earth circumference in web mercator meters.
+WEB_MERCATOR_ORIGIN = 20037508.342789244
+
+TILE_FORMAT_PNG = "PNG"
+TILE_FORMAT_WEBP = "WEBP"
+TILE_FORMATS = {TILE_FORMAT_PNG: "png", TILE_FORMAT_WEBP: "webp"}
+
+TileKey = Tuple[int, int, int]
+
+#: Deepest zoom level rendered, tiles of less than 4 cm at the equator.
+MAX_ZOOM = 30
+
+_RASTERIO_RESAMPLING = {"near": gdal.GRIORA_NearestNeighbour,
+                        "bilinear": gdal.GRIORA_Bilinear,
+                        "cubic": gdal.GRIORA_Cubic,
+                        "cubicspline": gdal.GRIORA_CubicSpline,
+                        "lanczos": gdal.GRIORA_Lanczos,
+                        "average": gdal.GRIORA_Average,
+                        "mode": gdal.GRIORA_Mode}
+
+
+def tile_size_meters(zoom: int) -> float:
+    """Size of the side of a tile in web mercator meters at a zoom level."""
+    return 2 * WEB_MERCATOR_ORIGIN / (2 ** zoom)
+
+
+def tile_bounds(zoom: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Bounds of a XYZ tile in web mercator (xmin, ymin, xmax, ymax)."""
+    size = tile_size_meters(zoom)
+    xmin = -WEB_MERCATOR_ORIGIN + x * size
+    ymax = WEB_MERCATOR_ORIGIN - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def tile_bbox(zoom: int, x: int, y: int) -> BBox:
+    """BBox of a XYZ tile in web mercator."""
+    return BBox(*tile_bounds(zoom, x, y), wkt_srs=create_osr_srs(WEB_MERCATOR_EPSG).ExportToWkt())
+
+
+def tiles_range(bbox: BBox, zoom: int) -> Tuple[int, int, int, int]:
+    """Range of tiles (x0, y0, x1, y1), end inclusive, that covers a web mercator bbox at a zoom level."""
+    size = tile_size_meters(zoom)
+    last = 2 ** zoom - 1
+    x0 = int(math.floor((bbox.xmin + WEB_MERCATOR_ORIGIN) / size))
+    x1 = int(math.ceil((bbox.xmax + WEB_MERCATOR_ORIGIN) / size)) - 1
+    y0 = int(math.floor((WEB_MERCATOR_ORIGIN - bbox.ymax) / size))
+    y1 = int(math.ceil((WEB_MERCATOR_ORIGIN - bbox.ymin) / size)) - 1
+    return max(x0, 0), max(y0, 0), min(max(x1, x0), last), min(max(y1, y0), last)
+
+
+class MemoryTileCache:
+    def __init__(self, max_tiles: int = 1024):
+        """Keeps rendered tiles in memory, the least recently used tiles are evicted first.
+
+        :param max_tiles: Maximum number of tiles kept.
+        """
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def __contains__(self, key: TileKey) -> bool:
+        return key in self._tiles
+
+    def get(self, key: TileKey) -> Optional[bytes]:
+        with self._lock:
+            data = self._tiles.get(key)
+            if data is not None:
+                self._tiles.move_to_end(key)
+            return data
+
+    def put(self, key: TileKey, data: bytes) -> None:
+        with self._lock:
+            self._tiles[key] = data
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tiles.clear()
+
+
+class DiskTileCache:
+    def __init__(self, directory: str, extension: str = "png", max_bytes: int = 512 * 1024 ** 2):
+        """Keeps rendered tiles on disk as directory/z/x/y.extension.
+        When max_bytes is exceeded the least recently used tiles are removed.
+
+        :param directory: Root directory of the cache, created if it doesn't exists.
+        :param extension: Tile files extension.
+        :param max_bytes: Maximum size of the cache in bytes.
+        """
+        self.directory = directory
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def __contains__(self, key: TileKey) -> bool:
+        return key in self._sizes
+
+    def tile_path(self, key: TileKey) -> str:
+        zoom, x, y = key
+        return os.path.join(self.directory, str(zoom), str(x), "{}.{}".format(y, self.extension))
+
+    def _load_index(self):
+        """Rebuilds the index from the tiles already on disk, oldest first."""
+        found = []
+        suffix = "." + self.extension
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    zoom, x = (int(part) for part in os.path.relpath(root, self.directory).split(os.sep))
+                    key = (zoom, x, int(name[:-len(suffix)]))
+                except ValueError:
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self._sizes[key] = size
+            self._total_bytes += size
+
+    def get(self, key: TileKey) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._sizes:
+                return None
+            self._sizes.move_to_end(key)
+        try:
+            with open(self.tile_path(key), "rb") as tile_file:
+                return tile_file.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._total_bytes -= self._sizes.pop(key, 0)
+            return None
+
+    def put(self, key: TileKey, data: bytes) -> None:
+        path = self.tile_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Escreve em um arquivo temporário para que leitores nunca vejam um tile incompleto.
+        tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        with open(tmp_path, "wb") as tile_file:
+            tile_file.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._total_bytes += len(data) - self._sizes.pop(key, 0)
+            self._sizes[key] = len(data)
+            while self._total_bytes > self.max_bytes and len(self._sizes) > 1:
+                old_key, old_size = self._sizes.popitem(last=False)
+                self._total_bytes -= old_size
+                try:
+                    os.remove(self.tile_path(old_key))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in self._sizes:
+                try:
+                    os.remove(self.tile_path(key))
+                except FileNotFoundError:
+                    pass
+            self._sizes.clear()
+            self._total_bytes = 0
+
+
+def apply_color_ramp(band_data: np.ndarray, color_ramp: Sequence) -> np.ndarray:
+    """Colors a single band array using a color ramp.
+
+    :param band_data: A 2D array.
+    :param color_ramp: A sequence of stops (value, (r, g, b)) or (value, (r, g, b, a)), sorted by value.
+        Values between stops are linearly interpolated.
+    :returns: An uint8 array (4, rows, cols) in RGBA.
+    """
+    values = np.asarray([stop[0] for stop in color_ramp], dtype=np.float64)
+    colors = np.asarray([tuple(stop[1]) + (255,) * (4 - len(stop[1])) for stop in color_ramp], dtype=np.float64)
+    rgba = np.empty((4,) + band_data.shape, dtype=np.uint8)
+    for channel in range(4):
+        rgba[channel] = np.interp(band_data, values, colors[:, channel])
+    return rgba
+
+
+def apply_stretch(data: np.ndarray, minimum: Sequence, maximum: Sequence) -> np.ndarray:
+    """Linear stretch of a (bands, rows, cols) array to uint8 using per band minimum and maximum."""
+    minimum = np.asarray(minimum, dtype=np.float64).reshape(-1, 1, 1)
+    maximum = np.asarray(maximum, dtype=np.float64).reshape(-1, 1, 1)
+    scale = 255 / np.where(maximum > minimum, maximum - minimum, 1)
+    stretched = (data - minimum) * scale
+    # Arredonda, truncar levaria o máximo para 254 (erro de ponto flutuante).
+    np.rint(stretched, out=stretched)
+    return np.clip(stretched, 0, 255, out=stretched).astype(np.uint8)
+
+
+def _read_vsimem(path: str) -> bytes:
+    """Reads and removes a file from GDAL's /vsimem/."""
+    stat = gdal.VSIStatL(path)
+    vsi_file = gdal.VSIFOpenL(path, "rb")
+    try:
+        return gdal.VSIFReadL(1, stat.size, vsi_file)
+    finally:
+        gdal.VSIFCloseL(vsi_file)
+        gdal.Unlink(path)
+
+
+def encode_tile(rgba: np.ndarray, image_format: str = TILE_FORMAT_PNG) -> bytes:
+    """Encodes an RGBA uint8 array (4, rows, cols) as PNG or WEBP."""
+    if image_format not in TILE_FORMATS:
+        raise ValueError("Tile format must be one of {}.".format(list(TILE_FORMATS)))
+    mem_dataset = gdal.GetDriverByName("MEM").Create("", rgba.shape[2], rgba.shape[1], 4, gdal.GDT_Byte)
+    for channel in range(4):
+        mem_dataset.GetRasterBand(channel + 1).WriteArray(rgba[channel])
+    # Nome único, tiles podem ser gerados em paralelo.
+    path = "/vsimem/tile_{}.{}".format(uuid.uuid4().hex, TILE_FORMATS[image_format])
+    gdal.GetDriverByName(image_format).CreateCopy(path, mem_dataset, strict=0)
+    return _read_vsimem(path)
+
+
+class TileRenderer:
+    def __init__(self, raster_data: RasterData, bands: Sequence[int] = None, color_ramp: Sequence = None,
+                 stretch: Sequence = None, nodata: float = None, tile_size: int = 256,
+                 image_format: str = TILE_FORMAT_PNG, resampling: str = "bilinear",
+                 cache: Union[MemoryTileCache, DiskTileCache] = None):
+        """Renders a RasterData as web mercator XYZ tiles.
+
+        Tiles are read through GDAL with the output size set to the tile size, so overviews
+        are used when present and only the window under the tile is decoded.
+
+        :param raster_data: The raster to be rendered.
+        :param bands: Bands used for the RGB channels, or a single band for color ramps.
+            Defaults to (1, 2, 3) for 3+ band images and (1,) otherwise.
+        :param color_ramp: Color ramp for single band rendering, see apply_color_ramp.
+        :param stretch: (minimum, maximum) for the linear stretch, scalars or one value per band.
+            Defaults to the bands statistics.
+        :param nodata: Value rendered as transparent, defaults to the first band nodata value.
+        :param tile_size: Tile side in pixels.
+        :param image_format: One of TILE_FORMAT_PNG or TILE_FORMAT_WEBP.
+        :param resampling: GDAL resampling algorithm name.
+        :param cache: Optional tile cache.
+        """
+        if image_format not in TILE_FORMATS:
+            raise ValueError("Tile format must be one of {}.".format(list(TILE_FORMATS)))
+        if bands is None:
+            bands = (1,) if color_ramp is not None or raster_data.n_channels < 3 else (1, 2, 3)
+        if color_ramp is not None and len(bands) != 1:
+            raise ValueError("A color ramp requires a single band.")
+
+        self.raster_data = raster_data
+        self.bands = tuple(bands)
+        self.color_ramp = color_ramp
+        self.tile_size = tile_size
+        self.image_format = image_format
+        self.resampling = resampling
+        self.cache = cache
+        if nodata is None:
+            nodata = raster_data.gdal_dataset.GetRasterBand(self.bands[0]).GetNoDataValue()
+        self.nodata = nodata
+        if stretch is None and color_ramp is None:
+            stretch = self._bands_statistics()
+        self.stretch = stretch
+
+        self._mercator_srs = create_osr_srs(WEB_MERCATOR_EPSG)
+        raster_srs = create_osr_srs(raster_data.wkt_srs)
+        self._same_srs = bool(raster_srs.IsSame(self._mercator_srs))
+        self._bbox = raster_data.get_bbox() if self._same_srs else raster_data.get_bbox().transform_srs(
+            WEB_MERCATOR_EPSG)
+        # Gdal datasets can't be shared among threads, each thread opens its own.
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _bands_statistics(self) -> Tuple[list, list]:
+        minimum, maximum = [], []
+        for band in self.bands:
+            band_min, band_max, _, _ = self.raster_data.gdal_dataset.GetRasterBand(band).GetStatistics(True, True)
+            minimum.append(band_min)
+            maximum.append(band_max)
+        return minimum, maximum
+
+    @property
+    def bbox(self) -> BBox:
+        """Raster extent in web mercator."""
+        return self._bbox
+
+    def tiles(self, zoom: int) -> Iterator[TileKey]:
+        """Iterates over the tiles that cover the raster at a zoom level."""
+        x0, y0, x1, y1 = tiles_range(self._bbox, zoom)
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                yield zoom, x, y
+
+    def _dataset(self) -> gdal.Dataset:
+        """A gdal dataset for the current thread."""
+        if self.raster_data.src_image is None:
+            return self.raster_data.gdal_dataset
+        dataset = getattr(self._local, "dataset", None)
+        if dataset is None:
+            dataset = gdal.Open(self.raster_data.src_image, gdal.GA_ReadOnly)
+            self._local.dataset = dataset
+        return dataset
+
+    def _window(self, bounds: Tuple[float, float, float, float]) -> Optional[Tuple[int, int, int, int]]:
+        """Pixel window (xoff, yoff, xsize, ysize) for the bounds when it is fully inside the raster."""
+        xmin, ymin, xmax, ymax = bounds
+        origin_x, origin_y = self.raster_data.origem
+        pixel_size = self.raster_data.pixel_size
+        x0 = int(round((xmin - origin_x) / pixel_size))
+        x1 = int(round((xmax - origin_x) / pixel_size))
+        y0 = int(round((origin_y - ymax) / pixel_size))
+        y1 = int(round((origin_y - ymin) / pixel_size))
+        if x0 < 0 or y0 < 0 or x1 > self.raster_data.cols or y1 > self.raster_data.rows or x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _read_tile(self, bounds: Tuple[float, float, float, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """Reads the tile data (bands, size, size) and its validity mask (size, size)."""
+        size = self.tile_size
+        dataset = self._dataset()
+        window = self._window(bounds) if self._same_srs else None
+        if window is not None:
+            # Leitura direta, o gdal usa as overviews ao reduzir a janela para o tamanho do tile.
+            resample_alg = _RASTERIO_RESAMPLING.get(self.resampling, gdal.GRIORA_NearestNeighbour)
+            with gdal_call():
+                data = np.stack([dataset.GetRasterBand(band).ReadAsArray(*window, buf_xsize=size, buf_ysize=size,
+                                                                          resample_alg=resample_alg)
+                                 for band in self.bands])
+            valid = np.ones((size, size), dtype=bool)
+        else:
+            with gdal_call():
+                warped = gdal.Warp("", dataset, format="MEM", outputBounds=bounds, width=size, height=size,
+                                   dstSRS=self._mercator_srs.ExportToWkt(), resampleAlg=self.resampling,
+                                   srcBands=list(self.bands), dstAlpha=True)
+                data = np.stack([warped.GetRasterBand(index + 1).ReadAsArray() for index in range(len(self.bands))])
+                valid = warped.GetRasterBand(len(self.bands) + 1).ReadAsArray() > 0
+        if self.nodata is not None:
+            valid &= np.all(data != self.nodata, axis=0)
+        return data, valid
+
+    @instrumented("tiles.render")
+    def render_array(self, zoom: int, x: int, y: int) -> np.ndarray:
+        """Renders a tile as an RGBA uint8 array (4, size, size)."""
+        data, valid = self._read_tile(tile_bounds(zoom, x, y))
+        if self.color_ramp is not None:
+            rgba = apply_color_ramp(data[0], self.color_ramp)
+        else:
+            colors = apply_stretch(data, *self.stretch)
+            if colors.shape[0] == 1:
+                colors = np.repeat(colors, 3, axis=0)
+            rgba = np.empty((4,) + valid.shape, dtype=np.uint8)
+            rgba[:3] = colors
+            rgba[3] = 255
+        rgba[3][~valid] = 0
+        return rgba
+
+    def render(self, zoom: int, x: int, y: int) -> bytes:
+        """Renders an encoded tile, using the cache when available.
+        Raises IndexError for zoom levels or tiles outside the XYZ grid.
+        """
+        if not 0 <= zoom <= MAX_ZOOM or not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+            raise IndexError("Tile {}/{}/{} out of the XYZ grid (zoom 0 to {}).".format(zoom, x, y, MAX_ZOOM))
+        key = (zoom, x, y)
+        if self.cache is not None:
+            data = self.cache.get(key)
+            if data is not None:
+                count("tiles.cache_hit")
+                return data
+            count("tiles.cache_miss")
+        if self.raster_data.src_image is None:
+            # Datasets em memória não podem ser reabertos por thread.
+            with self._lock:
+                rgba = self.render_array(zoom, x, y)
+        else:
+            rgba = self.render_array(zoom, x, y)
+        with timed("tiles.encode", gdal=True) as section:
+            data = encode_tile(rgba, self.image_format)
+            section.n_bytes = len(data)
+        if self.cache is not None:
+            self.cache.put(key, data)
+        return data
+
+    def seed(self, zooms: Sequence[int], workers: int = 4) -> int:
+        """Renders every tile of the zoom levels into the cache, in parallel.
+
+        :param zooms: Zoom levels, e.g. range(0, 15).
+        :param workers: Number of rendering threads.
+        :returns: The number of tiles rendered or found in the cache.
+        """
+        if self.cache is None:
+            raise AttributeError("Seeding requires a tile cache.")
+        keys = [key for zoom in zooms for key in self.tiles(zoom)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(lambda key: self.render(*key), keys):
+                pass
+        return len(keys)
+
+    def invalidate(self) -> None:
+        """Drops the cached tiles, use it when the source raster is updated."""
+        if self.cache is not None:
+            self.cache.clear()
+
+
+class _TileRequestHandler(BaseHTTPRequestHandler):
+    renderer = None  # type: TileRenderer
+
+    def do_GET(self):
+        try:
+            zoom, x, name = self.path.strip("/").split("/")
+            y = name.split(".")[0]
+            key = int(zoom), int(x), int(y)
+        except ValueError:
+            self.send_error(404, "Expected /z/x/y.{}".format(TILE_FORMATS[self.renderer.image_format]))
+            return
+        try:
+            data = self.renderer.render(*key)
+        except IndexError as error:
+            self.send_error(404, "Tile out of range", str(error))
+            return
+        except Exception as error:
+            # O detalhe vai no corpo da resposta, mensagens do gdal podem ter quebras de linha.
+            self.send_error(500, "Error rendering the tile", str(error))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/" + TILE_FORMATS[self.renderer.image_format])
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def create_tile_server(renderer: TileRenderer, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Creates a local HTTP server for /z/x/y tiles, useful for tests and previews.
+    Call serve_forever() (in a thread) to start it, port=0 picks a free port.
+    """
+    handler = type("TileRequestHandler", (_TileRequestHandler,), {"renderer": renderer})
+    return ThreadingHTTPServer((host, port), handler)
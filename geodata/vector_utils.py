@@ -1,15 +1,206 @@
 # Pablo Carreira - 22/06/17
+from typing import List, Sequence, Tuple
 
-import json
-
+import numpy as np
 from osgeo import ogr, osr
 
+from geodata.instrumentation import instrumented
+
 ogr.UseExceptions()
 
+#: WKB geometry types supported by the numpy codec (2D only).
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+
+# Ponto WKB completo: byte order, tipo e coordenadas, sem alinhamento.
+_WKB_POINT_DTYPE = {"<": np.dtype([("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")]),
+                    ">": np.dtype([("order", "u1"), ("type", ">u4"), ("x", ">f8"), ("y", ">f8")])}
+
+
+class GeometryArray:
+    __slots__ = ("geom_type", "coords", "geom_offsets", "ring_offsets")
+
+    def __init__(self, geom_type: int, coords: np.ndarray, geom_offsets: np.ndarray = None,
+                 ring_offsets: np.ndarray = None):
+        """Many geometries of the same type as flat coordinates plus offsets.
+
+        Points: coords (N, 2). Lines: the coordinates of line i are coords[geom_offsets[i]:geom_offsets[i + 1]].
+        Polygons: the rings of polygon i are geom_offsets[i]:geom_offsets[i + 1] and the coordinates
+        of ring j are coords[ring_offsets[j]:ring_offsets[j + 1]].
+
+        :param geom_type: WKB_POINT, WKB_LINESTRING or WKB_POLYGON.
+        :param coords: Array (M, 2) of x, y.
+        :param geom_offsets: Offsets (N + 1) of each geometry in coords (lines) or in the rings (polygons).
+        :param ring_offsets: Offsets (R + 1) of each ring in coords, polygons only.
+        """
+        if geom_type not in (WKB_POINT, WKB_LINESTRING, WKB_POLYGON):
+            raise ValueError("Unsupported geometry type: {}.".format(geom_type))
+        self.geom_type = geom_type
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.geom_offsets = None if geom_offsets is None else np.asarray(geom_offsets, dtype=np.int64)
+        self.ring_offsets = None if ring_offsets is None else np.asarray(ring_offsets, dtype=np.int64)
+
+    def __len__(self) -> int:
+        if self.geom_type == WKB_POINT:
+            return len(self.coords)
+        return len(self.geom_offsets) - 1
+
+    @classmethod
+    def from_lists(cls, geom_type: int, geometries: Sequence) -> "GeometryArray":
+        """Builds the array from nested lists, e.g. [[x, y], ...] for each line."""
+        if geom_type == WKB_POINT:
+            return cls(geom_type, np.asarray(geometries, dtype=np.float64))
+        if geom_type == WKB_LINESTRING:
+            parts = [np.asarray(line, dtype=np.float64).reshape(-1, 2) for line in geometries]
+            offsets = np.concatenate(([0], np.cumsum([len(part) for part in parts])))
+            coords = np.concatenate(parts) if parts else np.empty((0, 2))
+            return cls(geom_type, coords, offsets)
+        rings = [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for polygon in geometries for ring in polygon]
+        ring_offsets = np.concatenate(([0], np.cumsum([len(ring) for ring in rings])))
+        geom_offsets = np.concatenate(([0], np.cumsum([len(polygon) for polygon in geometries])))
+        coords = np.concatenate(rings) if rings else np.empty((0, 2))
+        return cls(geom_type, coords, geom_offsets, ring_offsets)
+
+    def to_wkb(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Encodes every geometry as little endian WKB in a single buffer.
+
+        :returns: The buffer (uint8) and the byte offsets (N + 1) of each geometry.
+        """
+        n_geoms = len(self)
+        if self.geom_type == WKB_POINT:
+            points = np.empty(n_geoms, dtype=_WKB_POINT_DTYPE["<"])
+            points["order"] = 1
+            points["type"] = WKB_POINT
+            points["x"], points["y"] = self.coords[:, 0], self.coords[:, 1]
+            return points.view(np.uint8), np.arange(n_geoms + 1, dtype=np.int64) * points.dtype.itemsize
+
+        coord_bytes = self.coords.astype("<f8", copy=False).view(np.uint8).ravel()
+        if self.geom_type == WKB_LINESTRING:
+            # Número de pontos de cada linha.
+            counts = np.diff(self.geom_offsets)
+            sizes = 9 + 16 * counts
+        else:
+            # Número de anéis de cada polígono, cada anel tem 4 bytes (número de pontos) e as coordenadas.
+            counts = np.diff(self.geom_offsets)
+            ring_counts = np.diff(self.ring_offsets)
+            ring_ends = np.concatenate(([0], np.cumsum(4 + 16 * ring_counts)))
+            sizes = 9 + ring_ends[self.geom_offsets[1:]] - ring_ends[self.geom_offsets[:-1]]
+        offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        buffer = np.empty(offsets[-1], dtype=np.uint8)
+
+        # Cabeçalhos das geometrias: byte order, tipo e número de pontos (linhas) ou de anéis (polígonos).
+        header = np.empty((n_geoms, 9), dtype=np.uint8)
+        header[:, 0] = 1
+        header[:, 1:5] = _uint32_bytes(np.full(n_geoms, self.geom_type))
+        header[:, 5:9] = _uint32_bytes(counts)
+        header_index = [(offsets[:-1, np.newaxis] + np.arange(9)).ravel()]
+        header_values = [header.ravel()]
+        if self.geom_type == WKB_POLYGON:
+            geom_of_ring = np.repeat(np.arange(n_geoms), counts)
+            ring_positions = (offsets[geom_of_ring] + 9 + ring_ends[:-1] -
+                              ring_ends[self.geom_offsets[geom_of_ring]])
+            header_index.append((ring_positions[:, np.newaxis] + np.arange(4)).ravel())
+            header_values.append(_uint32_bytes(ring_counts).ravel())
+        header_index = np.concatenate(header_index)
+        is_header = np.zeros(len(buffer), dtype=bool)
+        is_header[header_index] = True
+        buffer[header_index] = np.concatenate(header_values)
+        # Tudo que não é cabeçalho são coordenadas, na mesma ordem do array.
+        buffer[~is_header] = coord_bytes
+        return buffer, offsets
+
+    def to_wkb_list(self) -> List[bytes]:
+        """Encodes every geometry as a WKB bytes object."""
+        return split_wkb(*self.to_wkb())
+
+    @classmethod
+    def from_wkb(cls, wkbs: Sequence[bytes]) -> "GeometryArray":
+        """Decodes WKB geometries of a single type (2D points, lines or polygons, any byte order)."""
+        return decode_wkb(*join_wkb(wkbs))
+
+    def to_ogr(self) -> List[ogr.Geometry]:
+        """Creates the ogr geometries, straight from WKB."""
+        return [ogr.CreateGeometryFromWkb(wkb) for wkb in self.to_wkb_list()]
+
+
+def _uint32_bytes(values: np.ndarray) -> np.ndarray:
+    """Little endian bytes (N, 4) of uint32 values."""
+    return np.asarray(values, dtype="<u4").view(np.uint8).reshape(-1, 4)
+
+
+def _read_uint32(buffer: np.ndarray, positions: np.ndarray, byte_order: str) -> np.ndarray:
+    data = buffer[positions[:, np.newaxis] + np.arange(4)]
+    return np.ascontiguousarray(data).view(byte_order + "u4").ravel().astype(np.int64)
+
+
+def split_wkb(buffer: np.ndarray, offsets: np.ndarray) -> List[bytes]:
+    """Splits a WKB buffer in one bytes object per geometry."""
+    data = buffer.tobytes()
+    return [data[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def join_wkb(wkbs: Sequence[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """Joins WKB geometries in a single buffer, returns the buffer and the byte offsets."""
+    offsets = np.concatenate(([0], np.cumsum([len(wkb) for wkb in wkbs]))).astype(np.int64)
+    return np.frombuffer(b"".join(wkbs), dtype=np.uint8), offsets
+
+
+def decode_wkb(buffer: np.ndarray, offsets: np.ndarray) -> GeometryArray:
+    """Decodes a WKB buffer (see join_wkb) of geometries of a single type into a GeometryArray.
+    Supports 2D points, lines and polygons, all in the same byte order.
+    """
+    starts = offsets[:-1]
+    if len(starts) == 0:
+        raise ValueError("No geometries to decode.")
+    orders = buffer[starts]
+    if not np.all(orders == orders[0]):
+        raise ValueError("Every geometry must have the same byte order.")
+    byte_order = "<" if orders[0] == 1 else ">"
+    types = np.unique(_read_uint32(buffer, starts + 1, byte_order))
+    if len(types) != 1 or types[0] not in (WKB_POINT, WKB_LINESTRING, WKB_POLYGON):
+        raise ValueError("Only 2D points, lines or polygons of a single type are supported, got {}.".format(
+            types.tolist()))
+    geom_type = int(types[0])
+
+    if geom_type == WKB_POINT:
+        point_dtype = _WKB_POINT_DTYPE[byte_order]
+        if not np.all(np.diff(offsets) == point_dtype.itemsize):
+            raise ValueError("Invalid WKB point size.")
+        points = buffer[offsets[0]:offsets[-1]].view(point_dtype)
+        return GeometryArray(geom_type, np.column_stack((points["x"], points["y"])))
+
+    counts = _read_uint32(buffer, starts + 5, byte_order)
+    header_index = [(starts[:, np.newaxis] + np.arange(9)).ravel()]
+    if geom_type == WKB_LINESTRING:
+        geom_offsets = np.concatenate(([0], np.cumsum(counts)))
+        ring_offsets = None
+    else:
+        # Os anéis são lidos em sequência, um índice de anel por vez para todos os polígonos.
+        rings_per_geom = counts
+        ring_points = np.zeros((len(starts), int(rings_per_geom.max(initial=0))), dtype=np.int64)
+        position = starts + 9
+        for ring in range(ring_points.shape[1]):
+            has_ring = np.flatnonzero(rings_per_geom > ring)
+            ring_points[has_ring, ring] = _read_uint32(buffer, position[has_ring], byte_order)
+            header_index.append((position[has_ring, np.newaxis] + np.arange(4)).ravel())
+            position[has_ring] += 4 + 16 * ring_points[has_ring, ring]
+        ring_counts = ring_points[np.arange(ring_points.shape[1]) < rings_per_geom[:, np.newaxis]]
+        geom_offsets = np.concatenate(([0], np.cumsum(rings_per_geom)))
+        ring_offsets = np.concatenate(([0], np.cumsum(ring_counts)))
+
+    is_coord = np.ones(len(buffer), dtype=bool)
+    is_coord[np.concatenate(header_index)] = False
+    is_coord[:offsets[0]] = False
+    is_coord[offsets[-1]:] = False
+    coords = buffer[is_coord].view(byte_order + "f8").reshape(-1, 2)
+    return GeometryArray(geom_type, coords.astype(np.float64), geom_offsets, ring_offsets)
+
 
 def create_ogr_linestring_from_list(geom: list) -> ogr.Geometry:
-    """Creates a geometry from a Json geometry object"""
-    return ogr.CreateGeometryFromJson(json.dumps({"type": 'LineString', 'coordinates': geom}))
+    """Creates a line geometry from a list of coordinates [[x, y], ...]."""
+    wkb = GeometryArray.from_lists(WKB_LINESTRING, [geom]).to_wkb()[0]
+    return ogr.CreateGeometryFromWkb(wkb.tobytes())
 
 
 def create_ogr_geom(geom) -> ogr.Geometry:
@@ -20,21 +211,17 @@ def create_ogr_geom(geom) -> ogr.Geometry:
     """
     if isinstance(geom, ogr.Geometry):
         return geom
-
-    # Converte os tipos para diferentes situações (python 2.7).
-    # if isinstance(geom, str):
-    #     geom = str(geom)
-    # elif isinstance(geom, unicode):
-    #     geom = str(geom)
+    if isinstance(geom, str):
+        return ogr.CreateGeometryFromWkt(geom)
     try:
-        ogr_geom = ogr.CreateGeometryFromWkb(geom)
-    except RuntimeError:
-        ogr_geom = ogr.CreateGeometryFromWkt(geom)
-    if not ogr_geom:
-        ogr_geom = ogr.CreateGeometryFromWkt(geom)
-    return ogr_geom
+        # Qualquer objeto bytes-like (bytes, bytearray, memoryview, arrays numpy...).
+        wkb = memoryview(geom).cast("B").tobytes()
+    except TypeError:
+        raise TypeError("Geometry must be an ogr.Geometry, a bytes-like WKB or a WKT string.") from None
+    return ogr.CreateGeometryFromWkb(wkb)
 
 
+@instrumented("srs.create_transform")
 def create_osr_transform(src_epsg: int, dst_epsg: int):
     """Creates an OSR transform from epsg codes."""
     src_srs = osr.SpatialReference()
@@ -1,10 +1,13 @@
 # Pablo Carreira - 21/03/17
 import os
-from typing import Union, Iterator
+from typing import AsyncIterator, Union, Iterator, Sequence
 
 from osgeo import ogr, osr
 
+from geodata.aio import AsyncHandles
 from geodata.geo_objects import BBox
+from geodata.instrumentation import gdal_call, instrumented, timed
+from geodata.vector_utils import GeometryArray, WKB_LINESTRING, WKB_POINT, WKB_POLYGON
 
 
 class VectorData:
@@ -20,6 +23,7 @@ class VectorData:
         self.ogr_format = None
         self.update = update
         self.srs = None
+        self._async_handles = None
 
         if not os.path.isfile(src_file):
             raise NotImplementedError(f"Not a file: {src_file}. \n Use VectorData.create() to create a new file.")
@@ -97,6 +101,46 @@ class VectorData:
         layer.ResetReading()
         return layer
 
+    def iter_features(self) -> Iterator[ogr.Feature]:
+        """Iterates over the features of the first layer, timing each read as vector.read_feature."""
+        layer = self.get_features_iterator()
+        while True:
+            with timed("vector.read_feature", gdal=True):
+                feature = layer.GetNextFeature()
+            if feature is None:
+                return
+            yield feature
+
+    async def aiter_features(self, batch_size: int = 256) -> AsyncIterator[ogr.Feature]:
+        """Async version of iter_features, features are read in batches in the geodata.aio executor.
+        The layer reading position is shared, run only one iteration at a time on each VectorData.
+        """
+        if self._async_handles is None:
+            self._async_handles = AsyncHandles(self.ogr_datasource)
+
+        def read_batch(ogr_datasource, reset: bool) -> list:
+            layer = ogr_datasource.GetLayerByIndex(0)
+            if reset:
+                layer.ResetReading()
+            batch = []
+            with timed("vector.read_feature", gdal=True):
+                for _ in range(batch_size):
+                    feature = layer.GetNextFeature()
+                    if feature is None:
+                        break
+                    batch.append(feature)
+            return batch
+
+        reset = True
+        while True:
+            batch = await self._async_handles.run(read_batch, reset)
+            reset = False
+            for feature in batch:
+                yield feature
+            if len(batch) < batch_size:
+                return
+
+    @instrumented("vector.write_feature")
     def add_feature_to_layer(self, geometry: ogr.Geometry, properties: dict):
         # Fixme - Deve estar na layer, pode estar aqui apenas por um atalho de conveniência.
         layer = self.ogr_datasource.GetLayerByIndex(0)
@@ -104,4 +148,50 @@ class VectorData:
         feature.SetGeometry(geometry)
         for k, v in properties.items():
             feature.SetField(k, v)
-        layer.CreateFeature(feature)
\ No newline at end of file
+        with gdal_call():
+            layer.CreateFeature(feature)
+
+    def read_geometries(self) -> GeometryArray:
+        """Reads the geometries of the first layer (2D points, lines or polygons) in bulk, as a GeometryArray.
+        Each geometry is exported once as WKB and all of them are decoded together with numpy.
+        An empty layer gives an empty array of the layer geometry type, features without geometry are rejected.
+        """
+        layer = self.ogr_datasource.GetLayerByIndex(0)
+        layer.ResetReading()
+        wkbs = []
+        with timed("vector.read_geometries", gdal=True):
+            for feature in layer:
+                geometry = feature.GetGeometryRef()
+                if geometry is None:
+                    raise ValueError("Feature {} has no geometry.".format(feature.GetFID()))
+                wkbs.append(geometry.ExportToIsoWkb(ogr.wkbNDR))
+        if not wkbs:
+            geom_type = ogr.GT_Flatten(layer.GetGeomType())
+            if geom_type not in (WKB_LINESTRING, WKB_POLYGON):
+                geom_type = WKB_POINT
+            return GeometryArray.from_lists(geom_type, [])
+        return GeometryArray.from_wkb(wkbs)
+
+    def write_geometries(self, geometries: GeometryArray, properties: Sequence[dict] = None):
+        """Writes many geometries to the first layer in a single transaction, rolled back on errors.
+
+        :param geometries: The geometries, encoded to WKB with numpy.
+        :param properties: Optional fields of each feature.
+        """
+        layer = self.ogr_datasource.GetLayerByIndex(0)
+        layer_definition = layer.GetLayerDefn()
+        with timed("vector.write_geometries", gdal=True):
+            layer.StartTransaction()
+            try:
+                for index, wkb in enumerate(geometries.to_wkb_list()):
+                    feature = ogr.Feature(layer_definition)
+                    feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+                    if properties is not None:
+                        for k, v in properties[index].items():
+                            feature.SetField(k, v)
+                    with gdal_call():
+                        layer.CreateFeature(feature)
+            except BaseException:
+                layer.RollbackTransaction()
+                raise
+            layer.CommitTransaction()